@@ -1,54 +1,62 @@
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, request, current_app
 from flask_login import current_user, login_required
 from models import db, Post, Tag, Favorite, post_tags
+from json_provider import jsonify
+from serializers import with_relations, load_posts, serialize_posts, favorited_ids
+from pagination import paginate_feed, paginate_by_id, InvalidCursor
+from cache import cached_response, bump_generation
+from ingest import import_posts
+from search import search_posts, InvalidQuery
+from stream import publish, subscribe
+from tag_index import find_posts_by_tags, unindex_post
+from unfurl import register_urls, schedule_unfurl
+from urls import try_normalize_url, url_hash
+from thread import fetch_thread, nest, DEFAULT_MAX_DEPTH, DEFAULT_LIMIT, MAX_LIMIT
+from tag_stats import WINDOWS, hour_bucket, record_post_tags, forget_post_tags, popular_tags
 from datetime import datetime
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 api = Blueprint('api', __name__)
 
+MAX_FAVORITE_STATE_IDS = 200
+MAX_FILTER_TAGS = 10
+
+@api.errorhandler(InvalidCursor)
+def handle_invalid_cursor(e):
+    return jsonify({'error': 'カーソルが不正です'}), 400
+
+def posts_with_url(normalized):
+    # 正規化したURLが同じ投稿（url_hash の索引で引き、ハッシュが衝突した別のURLの投稿は LIMIT の前に除く）
+    # posts.url は投稿されたままのURLなので、正規化済みでない行だけ normalize_url() で比べる
+    return Post.query.filter(
+        Post.url_hash == url_hash(normalized),
+        db.or_(Post.url == normalized, db.func.normalize_url(Post.url) == normalized)
+    )
+
+def publish_post(kind, post, **extra):
+    # 配信する投稿は閲覧者によらない形にする。is_own は main.js の setupLiveStream で
+    # base.html の currentUser と投稿者を比べて付け直す（新しい投稿はまだ誰のお気に入りでもない）
+    data = serialize_posts([post], favorited=set())[0]
+    data['is_own'] = False
+    data.update(extra)
+    publish(kind, data)
+
 @api.route('/posts', methods=['GET'])
+@cached_response
 def get_posts():
-    page = request.args.get('page', 1, type=int)
     per_page = 20  # 1ページあたりの表示件数
     
     # デバッグログ追加
-    current_app.logger.debug(f"Fetching posts... Page: {page}, Per page: {per_page}")
+    current_app.logger.debug(f"Fetching posts... Args: {dict(request.args)}, Per page: {per_page}")
     
     # 投稿の取得（ページネーション付き）
-    posts = Post.query.order_by(Post.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    posts, meta = paginate_feed(with_relations(Post.query), per_page=per_page)
     
     # デバッグログ追加
-    current_app.logger.debug(f"Found {posts.total} posts, Current page: {posts.page}, Pages: {posts.pages}")
+    current_app.logger.debug(f"Found {len(posts)} posts, Has next: {meta['has_next']}")
     
     # レスポンスの整形
-    posts_data = []
-    for post in posts.items:
-        post_data = {
-            'id': post.id,
-            'content': post.content,
-            'url': post.url,
-            'created_at': post.created_at.isoformat(),
-            'favorite_count': post.favorite_count,
-            'replies_count': post.replies.count(),
-            'author': {
-                'id': post.author.id,
-                'name': post.author.name,
-                'profile_pic': post.author.profile_pic
-            },
-            'tags': [tag.name for tag in post.tags],
-            'is_own': current_user.is_authenticated and post.user_id == current_user.id,
-            'is_favorited': current_user.is_authenticated and post in current_user.favorites
-        }
-        posts_data.append(post_data)
-    
-    return jsonify({
-        'posts': posts_data,
-        'has_next': posts.has_next,
-        'total': posts.total,
-        'current_page': posts.page,
-        'pages': posts.pages
-    })
+    return jsonify({'posts': serialize_posts(posts), **meta})
 
 @api.route('/posts', methods=['POST'])
 @login_required
@@ -59,6 +67,17 @@ def create_post():
     if not all(key in data for key in ['url', 'content']):
         return jsonify({'error': '必須フィールドが不足しています'}), 400
     
+    # 同じ会話がすでに投稿されていれば 409（force: true ならそのまま投稿する）
+    normalized = try_normalize_url(data['url'])
+    if normalized and not data.get('force'):
+        duplicate = posts_with_url(normalized).order_by(Post.created_at).first()
+        if duplicate:
+            return jsonify({
+                'error': 'この会話はすでに投稿されています',
+                'duplicate_of': duplicate.id,
+                'url': normalized
+            }), 409
+    
     try:
         # 投稿の作成
         post = Post(
@@ -78,7 +97,14 @@ def create_post():
                 post.tags.append(tag)
         
         db.session.add(post)
+        db.session.flush()
+        record_post_tags(post)
+        publish_post('post', post)
+        # URLのプレビューは登録だけして、取得はコミット後にバックグラウンドで行う
+        pending_urls = register_urls([post.url])
+        bump_generation()
         db.session.commit()
+        schedule_unfurl(pending_urls)
         
         return jsonify({
             'message': '投稿が作成されました',
@@ -90,28 +116,57 @@ def create_post():
         db.session.rollback()
         return jsonify({'error': '投稿の作成に失敗しました'}), 500
 
+@api.route('/posts/bulk', methods=['POST'])
+@login_required
+def create_posts_bulk():
+    # NDJSON（1行1投稿）での一括投稿。行ごとのエラーを報告する
+    lines = request.get_data(as_text=True).splitlines()
+    report = import_posts(lines, current_user.id, ip_address=request.remote_addr)
+    
+    status = 201 if report['imported'] else 400
+    return jsonify(report), status
+
 @api.route('/posts/<int:post_id>/favorite', methods=['POST'])
 @login_required
 def toggle_favorite(post_id):
-    post = Post.query.get_or_404(post_id)
+    Post.query.get_or_404(post_id)
     
     try:
-        is_favorited = post in current_user.favorites
-        if is_favorited:
-            current_user.favorites.remove(post)
-            post.favorite_count -= 1
+        # お気に入りの行を削除できれば解除、なければ追加する。
+        # 最初の書き込みで書き込みロックを取るため、複数ワーカーからの同時トグルでも
+        # 判定と更新の間に他のリクエストが割り込まない。
+        removed = Favorite.query.filter_by(user_id=current_user.id, post_id=post_id)\
+            .delete(synchronize_session=False)
+        if removed:
+            delta = -1
             action = 'removed'
         else:
-            current_user.favorites.append(post)
-            post.favorite_count += 1
+            inserted = db.session.execute(
+                sqlite_insert(Favorite.__table__).values(
+                    user_id=current_user.id,
+                    post_id=post_id,
+                    created_at=datetime.utcnow()
+                ).on_conflict_do_nothing()
+            ).rowcount
+            delta = 1 if inserted else 0
             action = 'added'
         
+        # 件数はSQL上で加算・減算する（Pythonでの読み込み・書き戻しをしない）
+        Post.query.filter_by(id=post_id).update(
+            {Post.favorite_count: db.func.coalesce(Post.favorite_count, 0) + delta},
+            synchronize_session=False
+        )
+        favorite_count = db.session.query(Post.favorite_count).filter_by(id=post_id).scalar()
+        if delta:
+            publish('favorite', {'post_id': post_id, 'favorite_count': favorite_count})
+        
+        bump_generation()
         db.session.commit()
         
         return jsonify({
             'message': f'Favorite {action}',
             'action': action,
-            'favorite_count': post.favorite_count
+            'favorite_count': favorite_count
         })
         
     except Exception as e:
@@ -119,6 +174,22 @@ def toggle_favorite(post_id):
         db.session.rollback()
         return jsonify({'error': 'お気に入りの更新に失敗しました'}), 500
 
+@api.route('/favorites/state', methods=['POST'])
+def get_favorite_state():
+    # 複数投稿のお気に入り状態を1クエリで返す（未ログイン時はすべてFalse）
+    data = request.get_json(silent=True) or {}
+    post_ids = data.get('post_ids')
+    
+    if not isinstance(post_ids, list) or not all(isinstance(post_id, int) for post_id in post_ids):
+        return jsonify({'error': 'post_ids は整数の配列で指定してください'}), 400
+    if len(post_ids) > MAX_FAVORITE_STATE_IDS:
+        return jsonify({'error': f'post_ids は{MAX_FAVORITE_STATE_IDS}件までです'}), 400
+    
+    favorited = favorited_ids(post_ids)
+    return jsonify({
+        'favorites': {str(post_id): post_id in favorited for post_id in post_ids}
+    })
+
 @api.route('/posts/<int:post_id>', methods=['DELETE'])
 @login_required
 def delete_post(post_id):
@@ -128,8 +199,16 @@ def delete_post(post_id):
         return jsonify({'error': '権限がありません'}), 403
     
     try:
+        tag_ids = [tag.id for tag in post.tags]
+        if post.reply_to_id:
+            Post.query.filter_by(id=post.reply_to_id).update(
+                {Post.replies_count: Post.replies_count - 1}, synchronize_session=False
+            )
+        forget_post_tags(post)
         db.session.delete(post)
+        bump_generation()
         db.session.commit()
+        unindex_post(post_id, tag_ids)
         return jsonify({'message': '投稿が削除されました'})
         
     except Exception as e:
@@ -138,19 +217,29 @@ def delete_post(post_id):
         return jsonify({'error': '投稿の削除に失敗しました'}), 500
 
 @api.route('/tags/popular', methods=['GET'])
+@cached_response(key_extra=lambda: hour_bucket(datetime.utcnow()))
 def get_popular_tags():
-    # 人気のタグを10個取得
-    popular_tags = db.session.query(Tag, db.func.count(post_tags.c.post_id).label('post_count'))\
-        .join(post_tags)\
-        .group_by(Tag.id)\
-        .order_by(db.desc('post_count'))\
-        .limit(10)\
-        .all()
+    # 人気のタグを10個取得（?window=24h / 7d / all）
+    window = request.args.get('window', 'all')
+    if window not in WINDOWS:
+        return jsonify({'error': '集計期間が不正です'}), 400
     
     return jsonify([{
-        'name': tag.name,
+        'name': name,
         'count': count
-    } for tag, count in popular_tags])
+    } for name, count in popular_tags(window)])
+
+@api.route('/search')
+@cached_response
+def search():
+    # 本文・タグの全文検索（?q=...&cursor=...）
+    q = request.args.get('q', '').strip()
+    try:
+        posts, meta = search_posts(q, request.args.get('cursor'))
+    except InvalidQuery:
+        return jsonify({'error': '検索語は3文字以上で指定してください'}), 400
+    
+    return jsonify({'posts': serialize_posts(posts), **meta})
 
 @api.route('/posts/<int:post_id>/replies', methods=['POST'])
 @login_required
@@ -171,7 +260,18 @@ def create_reply(post_id):
         )
         
         db.session.add(reply)
+        # 返信数は親投稿のカラムをSQL上で加算する（同一トランザクション）
+        Post.query.filter_by(id=post_id).update(
+            {Post.replies_count: Post.replies_count + 1}, synchronize_session=False
+        )
+        db.session.flush()
+        replies_count = db.session.query(Post.replies_count).filter_by(id=post_id).scalar()
+        publish_post('reply', reply, reply_to_id=post_id, parent_replies_count=replies_count)
+        # 返信のURLも投稿と同じく、登録だけしてコミット後に取得する（空のURLは登録されない）
+        pending_urls = register_urls([reply.url])
+        bump_generation()
         db.session.commit()
+        schedule_unfurl(pending_urls)
         
         return jsonify({
             'message': '返信が投稿されました',
@@ -183,153 +283,120 @@ def create_reply(post_id):
         db.session.rollback()
         return jsonify({'error': '返信の投稿に失敗しました'}), 500
 
+@api.route('/stream')
+def stream():
+    # 新しい投稿・返信・お気に入り数の変化を Server-Sent Events で配信する
+    # （再接続時はブラウザが送る Last-Event-ID の続きから）
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if last_event_id is not None:
+        try:
+            last_event_id = int(last_event_id)
+        except ValueError:
+            return jsonify({'error': 'Last-Event-ID が不正です'}), 400
+
+    response = current_app.response_class(subscribe(last_event_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # nginx にバッファリングさせない
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @api.route('/posts/tag/<tag_name>')
+@cached_response
 def get_posts_by_tag(tag_name):
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
+    # post_tags(tag_id, post_id) の索引の順に読み、posts.created_at での並べ替えをしない
+    # （投稿IDの順は作成日時の順と一致するので、他の一覧と同じ新しい順になる。pagination.py 参照）
+    posts, meta = paginate_by_id(
+        with_relations(Post.query)
+            .join(post_tags, post_tags.c.post_id == Post.id)
+            .join(Tag, Tag.id == post_tags.c.tag_id)
+            .filter(Tag.name == tag_name),
+        post_tags.c.post_id
+    )
     
-    posts = Post.query.join(Post.tags).filter(Tag.name == tag_name)\
-        .order_by(Post.created_at.desc())\
-        .paginate(page=page, per_page=per_page, error_out=False)
+    return jsonify({'posts': serialize_posts(posts), **meta})
+
+@api.route('/posts/tags')
+@cached_response
+def get_posts_by_tags():
+    # 複数タグでの絞り込み（?all=a,b でいずれも含む、?any=c,d でいずれかを含む。併用可）
+    # メモリ上のタグ索引で投稿IDを求め、?before=<投稿ID> で続きを取得する
+    all_tags = [name.strip() for name in request.args.get('all', '').split(',') if name.strip()]
+    any_tags = [name.strip() for name in request.args.get('any', '').split(',') if name.strip()]
+    if not all_tags and not any_tags:
+        return jsonify({'error': 'all または any でタグを指定してください'}), 400
+    if len(all_tags) + len(any_tags) > MAX_FILTER_TAGS:
+        return jsonify({'error': f'タグは{MAX_FILTER_TAGS}個までです'}), 400
+
+    before = request.args.get('before')
+    if before and not before.isdigit():
+        raise InvalidCursor(before)
+
+    posts, meta = find_posts_by_tags(all_tags, any_tags, int(before) if before else None)
+    return jsonify({'posts': serialize_posts(posts), **meta})
+
+@api.route('/posts/by-url')
+@cached_response
+def get_posts_by_url():
+    # 同じ会話（正規化したURLが同じ）の投稿を新しい順に取得（?url=...&before=...）
+    normalized = try_normalize_url(request.args.get('url', ''))
+    if normalized is None:
+        return jsonify({'error': 'url を指定してください'}), 400
     
-    posts_data = []
-    for post in posts.items:
-        post_data = {
-            'id': post.id,
-            'content': post.content,
-            'url': post.url,
-            'created_at': post.created_at.isoformat(),
-            'favorite_count': post.favorite_count,
-            'replies_count': post.replies.count(),
-            'author': {
-                'id': post.author.id,
-                'name': post.author.name,
-                'profile_pic': post.author.profile_pic
-            },
-            'tags': [tag.name for tag in post.tags],
-            'is_own': current_user.is_authenticated and post.user_id == current_user.id,
-            'is_favorited': current_user.is_authenticated and post in current_user.favorites
-        }
-        posts_data.append(post_data)
+    posts, meta = paginate_feed(with_relations(posts_with_url(normalized)))
     
-    return jsonify({
-        'posts': posts_data,
-        'has_next': posts.has_next,
-        'total': posts.total,
-        'current_page': posts.page,
-        'pages': posts.pages
-    })
+    return jsonify({'url': normalized, 'posts': serialize_posts(posts), **meta})
 
 @api.route('/posts/user/<int:user_id>')
+@cached_response
 def get_posts_by_user(user_id):
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    
-    posts = Post.query.filter_by(user_id=user_id)\
-        .order_by(Post.created_at.desc())\
-        .paginate(page=page, per_page=per_page, error_out=False)
-    
-    posts_data = []
-    for post in posts.items:
-        post_data = {
-            'id': post.id,
-            'content': post.content,
-            'url': post.url,
-            'created_at': post.created_at.isoformat(),
-            'favorite_count': post.favorite_count,
-            'replies_count': post.replies.count(),
-            'author': {
-                'id': post.author.id,
-                'name': post.author.name,
-                'profile_pic': post.author.profile_pic
-            },
-            'tags': [tag.name for tag in post.tags],
-            'is_own': current_user.is_authenticated and post.user_id == current_user.id,
-            'is_favorited': current_user.is_authenticated and post in current_user.favorites
-        }
-        posts_data.append(post_data)
+    posts, meta = paginate_feed(with_relations(Post.query).filter_by(user_id=user_id))
     
-    return jsonify({
-        'posts': posts_data,
-        'has_next': posts.has_next,
-        'total': posts.total,
-        'current_page': posts.page,
-        'pages': posts.pages
-    })
+    return jsonify({'posts': serialize_posts(posts), **meta})
 
 @api.route('/posts/<int:post_id>/replies')
+@cached_response
 def get_replies(post_id):
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    
-    replies = Post.query.filter_by(reply_to_id=post_id)\
-        .order_by(Post.created_at.desc())\
-        .paginate(page=page, per_page=per_page, error_out=False)
-    
-    replies_data = []
-    for reply in replies.items:
-        reply_data = {
-            'id': reply.id,
-            'content': reply.content,
-            'url': reply.url,
-            'created_at': reply.created_at.isoformat(),
-            'favorite_count': reply.favorite_count,
-            'replies_count': reply.replies.count(),
-            'author': {
-                'id': reply.author.id,
-                'name': reply.author.name,
-                'profile_pic': reply.author.profile_pic
-            },
-            'tags': [tag.name for tag in reply.tags],
-            'is_own': current_user.is_authenticated and reply.user_id == current_user.id,
-            'is_favorited': current_user.is_authenticated and reply in current_user.favorites
-        }
-        replies_data.append(reply_data)
+    replies, meta = paginate_feed(with_relations(Post.query).filter_by(reply_to_id=post_id))
     
+    return jsonify({'replies': serialize_posts(replies), **meta})
+
+@api.route('/posts/<int:post_id>/thread')
+@cached_response
+def get_thread(post_id):
+    # 投稿以下の返信ツリーを1回の再帰クエリで取得（?max_depth=&limit=&format=flat|nested）
+    max_depth = max(request.args.get('max_depth', DEFAULT_MAX_DEPTH, type=int), 0)
+    limit = min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+    output = request.args.get('format', 'flat')
+    if output not in ('flat', 'nested'):
+        return jsonify({'error': 'format は flat か nested を指定してください'}), 400
+
+    items, truncated = fetch_thread(post_id, max_depth=max_depth, limit=limit)
+    if not items:
+        return jsonify({'error': '投稿が見つかりません'}), 404
+
+    posts = serialize_posts([post for post, reply_to_id, depth in items])
+    for data, (post, reply_to_id, depth) in zip(posts, items):
+        data['reply_to_id'] = reply_to_id
+        data['depth'] = depth
+
     return jsonify({
-        'replies': replies_data,
-        'has_next': replies.has_next,
-        'total': replies.total,
-        'current_page': replies.page,
-        'pages': replies.pages
+        'root_id': post_id,
+        'posts': nest(posts) if output == 'nested' else posts,
+        'truncated': truncated
     })
 
 @api.route('/posts/favorites')
 @login_required
+@cached_response
 def get_favorite_posts():
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    
-    # ユーザーのお気に入り投稿を取得
-    posts = Post.query.join(Favorite)\
-        .filter(Favorite.user_id == current_user.id)\
-        .order_by(Post.created_at.desc())\
-        .paginate(page=page, per_page=per_page, error_out=False)
+    # ユーザーのお気に入り投稿を、お気に入りに追加した順に取得
+    favorites, meta = paginate_feed(
+        Favorite.query.filter_by(user_id=current_user.id),
+        order_by=(Favorite.created_at, Favorite.post_id)
+    )
+    posts = load_posts([favorite.post_id for favorite in favorites])
     
-    posts_data = []
-    for post in posts.items:
-        post_data = {
-            'id': post.id,
-            'content': post.content,
-            'url': post.url,
-            'created_at': post.created_at.isoformat(),
-            'favorite_count': post.favorite_count,
-            'replies_count': post.replies.count(),
-            'author': {
-                'id': post.author.id,
-                'name': post.author.name,
-                'profile_pic': post.author.profile_pic
-            },
-            'tags': [tag.name for tag in post.tags],
-            'is_own': current_user.is_authenticated and post.user_id == current_user.id,
-            'is_favorited': True  # お気に入り一覧なので必ずTrue
-        }
-        posts_data.append(post_data)
+    # お気に入り一覧なので必ずTrue
+    posts_data = serialize_posts(posts, favorited={post.id for post in posts})
     
-    return jsonify({
-        'posts': posts_data,
-        'has_next': posts.has_next,
-        'total': posts.total,
-        'current_page': posts.page,
-        'pages': posts.pages
-    })
\ No newline at end of file
+    return jsonify({'posts': posts_data, **meta})
@@ -1,25 +1,96 @@
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, render_template
 from flask_login import LoginManager
-from flask_migrate import Migrate
-from config import Config
+import os
+from models import db, configure_sqlite
+from user_cache import load_session_user
+from instrumentation import init_instrumentation, phase
+from metrics import init_metrics
+from compression import init_compression
+from profiler import init_profiler
+from config import Config, config_by_name
+from dotenv import load_dotenv
+import logging
 
-db = SQLAlchemy()
-login_manager = LoginManager()
-migrate = Migrate()
+# アプリケーションファクトリ
+# 読み込み時にはデータベースに接続しない（スキーマの作成は `flask db upgrade` か `flask init-db`）。
+# gunicorn の --preload でマスターが読み込んでも、fork 前に接続やスレッドを作らない。
+# Google OAuth のライブラリは /auth/* で初めて読み込み、Flask-Migrate（alembic）は flask コマンドの
+# ときだけ読み込むので、ワーカーの起動ではどちらも読み込まない。
 
-def create_app(config_class=Config):
-    app = Flask(__name__)
-    app.config.from_object(config_class)
+# 環境変数の読み込み
+load_dotenv()
 
+# 追加：開発環境でのOAuth2 HTTPSチェックを無効化
+os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+
+# templates / static / instance はリポジトリ直下
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def create_app(config_class=None):
+    app = Flask(__name__, root_path=ROOT_PATH)
+    app.config.from_object(config_class or config_by_name.get(os.getenv('FLASK_ENV'), Config))
+
+    # デバッグログの設定
+    app.logger.setLevel(logging.DEBUG)
+
+    # データベースの初期化
     db.init_app(app)
+    with app.app_context():
+        # エンジンを作ってPRAGMAと関数のリスナーを付けるだけで、接続はしない
+        if db.engine.dialect.name == 'sqlite':
+            configure_sqlite(db.engine, app.config.get('SQLITE_PRAGMAS') or {})
+
+    # マイグレーション（flask コマンドから呼ばれたときだけ）
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+    # 指定されたリクエストのプロファイル取得（他のフックも含めて計測するため最初に登録する）
+    init_profiler(app)
+
+    # リクエスト単位の計測（SQL・シリアライズ・描画の時間）
+    init_instrumentation(app)
+    init_metrics(app)
+    # レスポンスの圧縮（計測の after_request より先に実行され、圧縮時間も計測に含まれる）
+    init_compression(app)
+
+    # ログイン管理の設定
+    login_manager = LoginManager()
     login_manager.init_app(app)
-    migrate.init_app(app, db)
+    login_manager.login_view = 'auth.login'
+
+    @login_manager.user_loader
+    def load_user(user_id):
+        # ワーカーごとのキャッシュから返す（通常はDBを読まない）
+        return load_session_user(int(user_id))
+
+    # ルート設定
+    @app.route('/')
+    def index():
+        with phase('render'):
+            return render_template('index.html')
+
+    # Blueprintの登録
+    from auth import auth
+    from api import api
+
+    app.register_blueprint(auth, url_prefix='/auth')
+    app.register_blueprint(api, url_prefix='/api')
+
+    # CLIコマンドの登録
+    from commands import (check_counts, rebuild_search_index_command, check_query_plans, import_posts_command,
+        profiles_command, init_db_command, upgrade_db_command, unfurl_command)
+
+    app.cli.add_command(check_counts)
+    app.cli.add_command(rebuild_search_index_command)
+    app.cli.add_command(check_query_plans)
+    app.cli.add_command(import_posts_command)
+    app.cli.add_command(profiles_command)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(upgrade_db_command)
+    app.cli.add_command(unfurl_command)
 
-    from app.api import bp as api_bp
-    from app.auth import bp as auth_bp
-    
-    app.register_blueprint(api_bp, url_prefix='/api')
-    app.register_blueprint(auth_bp, url_prefix='/auth')
+    return app
 
-    return app 
\ No newline at end of file
+# gunicorn 'app:app' / flask run / スクリプトからの `from app import app` 用
+app = create_app()
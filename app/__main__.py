@@ -0,0 +1,5 @@
+from app import app
+
+# 開発用サーバー（python -m app）
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=3001, debug=True)
@@ -1,5 +0,0 @@
-from flask import Blueprint
-
-bp = Blueprint('api', __name__)
-
-from app.api import posts, users, tags 
\ No newline at end of file
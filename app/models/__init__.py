@@ -1,7 +0,0 @@
-from flask_sqlalchemy import SQLAlchemy
-
-db = SQLAlchemy()
-
-from app.models.user import User
-from app.models.post import Post
-from app.models.tag import Tag 
\ No newline at end of file
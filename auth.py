@@ -1,103 +1,46 @@
-from flask import Blueprint, session, redirect, url_for, current_app, request
+import secrets
+from flask import Blueprint, session, redirect, url_for, current_app, request, abort
 from flask_login import login_user, logout_user, login_required
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from google.oauth2 import id_token
-from google.auth.transport import requests
 from models import db, User
-import os
-from dotenv import load_dotenv
-import json
-
-# 環境変数の読み込み
-load_dotenv()
-
-# 環境変数からベースURLを取得
-BASE_URL = os.getenv('BASE_URL', 'http://localhost:3000')
-REDIRECT_URI = f'{BASE_URL}/auth/callback'
+from user_cache import invalidate_user
+from cache import bump_generation
+from oauth import oauth_client, OAuthError
 
 auth = Blueprint('auth', __name__)
 
-GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
-GOOGLE_CLIENT_SECRET = os.getenv('GOOGLE_CLIENT_SECRET')
-GOOGLE_DISCOVERY_URL = "https://accounts.google.com/.well-known/openid-configuration"
-
-# スコープを修正
-SCOPES = [
-    'https://www.googleapis.com/auth/userinfo.email',
-    'https://www.googleapis.com/auth/userinfo.profile',
-    'openid'
-]
+# クライアント設定・HTTP セッション・Google の署名鍵はアプリごとに1つの OAuthClient で使い回す（oauth.py）
 
 @auth.route('/login')
 def login():
     # セッションをクリア
     session.clear()
     
-    # デバッグ用のログ出力
-    current_app.logger.debug(f"GOOGLE_CLIENT_ID: {GOOGLE_CLIENT_ID}")
-    current_app.logger.debug(f"GOOGLE_CLIENT_SECRET: {GOOGLE_CLIENT_SECRET}")
-    
-    flow = Flow.from_client_config(
-        {
-            "web": {
-                "client_id": GOOGLE_CLIENT_ID,
-                "client_secret": GOOGLE_CLIENT_SECRET,
-                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                "token_uri": "https://oauth2.googleapis.com/token",
-                "redirect_uris": [REDIRECT_URI]
-            }
-        },
-        scopes=SCOPES,  # 修正したスコープを使用
-        redirect_uri=REDIRECT_URI
-    )
-    authorization_url, state = flow.authorization_url(
-        access_type='offline',
-        include_granted_scopes='true'
-    )
+    state = secrets.token_urlsafe(30)
     session['state'] = state
-    return redirect(authorization_url)
+    return redirect(oauth_client().authorization_url(state))
+
 
 @auth.route('/callback')
 def callback():
     # デバッグログを追加
     current_app.logger.debug(f"Request URL: {request.url}")
-    current_app.logger.debug(f"Headers: {request.headers}")
-    current_app.logger.debug(f"REDIRECT_URI: {REDIRECT_URI}")
     
-    # HTTPS経由でのリクエストURLを構築
-    scheme = 'https'
-    host = request.headers.get('X-Forwarded-Host', request.host)
-    path = request.full_path
-    authorization_response = f'{scheme}://{host}{path}'
+    if 'error' in request.args:
+        current_app.logger.info(f"OAuth error: {request.args['error']}")
+        return redirect(url_for('index'))
+    state = session.pop('state', None)
+    if not state or not secrets.compare_digest(state, request.args.get('state', '')):
+        abort(400)
+    if not request.args.get('code'):
+        abort(400)
     
-    current_app.logger.debug(f"Authorization Response: {authorization_response}")
-    
-    flow = Flow.from_client_config(
-        {
-            "web": {
-                "client_id": GOOGLE_CLIENT_ID,
-                "client_secret": GOOGLE_CLIENT_SECRET,
-                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                "token_uri": "https://oauth2.googleapis.com/token",
-                "redirect_uris": [REDIRECT_URI]
-            }
-        },
-        scopes=SCOPES,
-        redirect_uri=REDIRECT_URI
-    )
-    
-    flow.fetch_token(
-        authorization_response=authorization_response,
-        state=session['state']
-    )
-    
-    credentials = flow.credentials
-    id_info = id_token.verify_oauth2_token(
-        credentials.id_token,
-        requests.Request(),
-        GOOGLE_CLIENT_ID
-    )
+    client = oauth_client()
+    try:
+        token = client.exchange_code(request.args['code'])
+        id_info = client.verify_id_token(token['id_token'])
+    except OAuthError as e:
+        current_app.logger.warning(f"OAuth login failed: {e}")
+        abort(400)
     
     email = id_info.get('email')
     user = User.query.filter_by(email=email).first()
@@ -111,6 +54,14 @@ def callback():
         )
         db.session.add(user)
         db.session.commit()
+    elif (user.name, user.profile_pic) != (id_info['name'], id_info.get('picture')):
+        # Google 側で変わった名前・アイコンを反映し、キャッシュ済みのユーザーを捨てる
+        # 投稿者名・アイコンを含むレスポンスのキャッシュ（と ETag）も世代番号を進めて無効にする
+        user.name = id_info['name']
+        user.profile_pic = id_info.get('picture')
+        bump_generation()
+        db.session.commit()
+        invalidate_user(user.id)
     
     login_user(user)
     return redirect(url_for('index'))
@@ -119,4 +70,4 @@ def callback():
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('index'))
\ No newline at end of file
+    return redirect(url_for('index'))
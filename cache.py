@@ -0,0 +1,106 @@
+import hashlib
+from functools import wraps
+from threading import Lock
+from cachetools import TTLCache
+from flask import request, current_app, make_response
+from flask_login import current_user
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, DataVersion
+from compression import matching_etag
+
+# 公開GETエンドポイントのレスポンスキャッシュ（ワーカープロセスごと）
+# キーは ルート + クエリ + 認証状態 + データ世代番号。
+# 書き込み時に data_version を加算すると、全ワーカーで古いエントリが参照されなくなる
+# （古いエントリはTTL/LRUで自然に追い出される）。
+# 同じキーからは同じ内容が返るため、キーのハッシュをそのまま強いETagとして使い、
+# If-None-Match が一致すればシリアライズせずに 304 を返す（圧縮した表現のETagも受け付ける）。
+
+DATA_VERSION_ID = 1
+
+_cache = None
+_lock = Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = TTLCache(
+            maxsize=current_app.config.get('RESPONSE_CACHE_SIZE', 1024),
+            ttl=current_app.config.get('RESPONSE_CACHE_TTL', 30)
+        )
+    return _cache
+
+def current_generation():
+    value = db.session.query(DataVersion.value).filter_by(id=DATA_VERSION_ID).scalar()
+    return value or 0
+
+def bump_generation():
+    # 書き込みと同じトランザクション内で呼ぶ
+    table = DataVersion.__table__
+    stmt = sqlite_insert(table).values(id=DATA_VERSION_ID, value=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.id],
+        set_={'value': table.c.value + 1}
+    )
+    db.session.execute(stmt)
+
+def cache_stats():
+    with _lock:
+        return dict(_stats, size=len(_cache) if _cache is not None else 0)
+
+def clear_cache():
+    with _lock:
+        if _cache is not None:
+            _cache.clear()
+
+def make_etag(key):
+    generation = key[-1]
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
+    return f'{generation}-{digest}'
+
+def _conditional(response, etag):
+    if response.status_code in (200, 304):
+        response.set_etag(etag)
+        # 保存は許可するが、再利用時は必ず再検証させる
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def cached_response(f=None, key_extra=None):
+    # key_extra: 書き込み以外で内容が変わるエンドポイント用の追加キー（時間帯など）
+    if f is None:
+        return lambda f: cached_response(f, key_extra=key_extra)
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        key = (
+            request.path,
+            tuple(sorted(request.args.items(multi=True))),
+            current_user.get_id(),
+            key_extra() if key_extra else None,
+            current_generation()
+        )
+        etag = make_etag(key)
+        matched = matching_etag(etag)
+        if matched:
+            return _conditional(current_app.response_class(status=304), matched)
+
+        if not current_app.config.get('RESPONSE_CACHE_ENABLED', True):
+            return _conditional(make_response(f(*args, **kwargs)), etag)
+
+        with _lock:
+            entry = _get_cache().get(key)
+            _stats['hits' if entry else 'misses'] += 1
+
+        if entry:
+            body, status, mimetype = entry
+            response = current_app.response_class(body, status=status, mimetype=mimetype)
+            response.headers['X-Cache'] = 'HIT'
+            return _conditional(response, etag)
+
+        response = make_response(f(*args, **kwargs))
+        if response.status_code == 200:
+            with _lock:
+                _get_cache()[key] = (response.get_data(), response.status_code, response.mimetype)
+        response.headers['X-Cache'] = 'MISS'
+        return _conditional(response, etag)
+    return wrapper
@@ -0,0 +1,284 @@
+import io
+import os
+import time
+import click
+import pstats
+from urllib.parse import quote
+from flask import current_app
+from flask.cli import with_appcontext
+from models import db, Post, Tag
+from tag_stats import find_tag_count_mismatches, rebuild_tag_stats
+from search import rebuild_search_index
+from ingest import import_posts, CHUNK_SIZE
+from profiler import list_profiles, make_token, profile_dir, TOKEN_HEADER
+from unfurl import backfill_previews, unfurl_pending
+
+# 非正規化したカウンタの整合性チェック
+# 返信数: posts.replies_count と reply_to_id で数えた実際の件数
+# お気に入り数: posts.favorite_count と favorites の件数
+# タグ投稿数: tags.post_count と post_tags の件数（修復時は時間別バケットも再構築）
+
+REPLIES_COUNT_MISMATCHES = '''
+    SELECT p.id, p.replies_count, COUNT(r.id) AS actual
+    FROM posts AS p
+    LEFT JOIN posts AS r ON r.reply_to_id = p.id
+    GROUP BY p.id
+    HAVING p.replies_count != COUNT(r.id)
+'''
+
+REPAIR_REPLIES_COUNT = '''
+    UPDATE posts SET replies_count = (
+        SELECT COUNT(*) FROM posts AS r WHERE r.reply_to_id = posts.id
+    )
+'''
+
+FAVORITE_COUNT_MISMATCHES = '''
+    SELECT p.id, p.favorite_count, COUNT(f.user_id) AS actual
+    FROM posts AS p
+    LEFT JOIN favorites AS f ON f.post_id = p.id
+    GROUP BY p.id
+    HAVING coalesce(p.favorite_count, 0) != COUNT(f.user_id)
+'''
+
+REPAIR_FAVORITE_COUNT = '''
+    UPDATE posts SET favorite_count = (
+        SELECT COUNT(*) FROM favorites WHERE favorites.post_id = posts.id
+    )
+'''
+
+def find_replies_count_mismatches():
+    return db.session.execute(db.text(REPLIES_COUNT_MISMATCHES)).fetchall()
+
+def repair_replies_count():
+    db.session.execute(db.text(REPAIR_REPLIES_COUNT))
+
+def find_favorite_count_mismatches():
+    return db.session.execute(db.text(FAVORITE_COUNT_MISMATCHES)).fetchall()
+
+def repair_favorite_count():
+    db.session.execute(db.text(REPAIR_FAVORITE_COUNT))
+
+@click.command('check-counts')
+@click.option('--repair', is_flag=True, help='不整合があれば実際の件数で更新する')
+@with_appcontext
+def check_counts(repair):
+    """非正規化したカウンタと実データの整合性を確認する"""
+    mismatches = find_replies_count_mismatches()
+    for post_id, stored, actual in mismatches[:20]:
+        click.echo(f'post {post_id}: replies_count={stored}, actual={actual}')
+    click.echo(f'replies_count: {len(mismatches)} 件の不整合')
+
+    if repair and mismatches:
+        repair_replies_count()
+        db.session.commit()
+        click.echo('replies_count を修正しました')
+
+    mismatches = find_favorite_count_mismatches()
+    for post_id, stored, actual in mismatches[:20]:
+        click.echo(f'post {post_id}: favorite_count={stored}, actual={actual}')
+    click.echo(f'favorite_count: {len(mismatches)} 件の不整合')
+
+    if repair and mismatches:
+        repair_favorite_count()
+        db.session.commit()
+        click.echo('favorite_count を修正しました')
+
+    mismatches = find_tag_count_mismatches()
+    for tag_id, stored, actual in mismatches[:20]:
+        click.echo(f'tag {tag_id}: post_count={stored}, actual={actual}')
+    click.echo(f'tags.post_count: {len(mismatches)} 件の不整合')
+
+    if repair:
+        rebuild_tag_stats()
+        db.session.commit()
+        click.echo('タグの集計を再構築しました')
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """空のデータベースにモデルからテーブルを作成し、最新のマイグレーションとして記録する"""
+    # 既存のデータベースは列の追加などが必要なので flask db upgrade で更新する
+    if db.inspect(db.engine).get_table_names():
+        raise click.ClickException('既にテーブルがあります。flask db upgrade を使ってください')
+    from flask_migrate import stamp
+    db.create_all()
+    stamp()
+    click.echo('データベースを作成しました')
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """マイグレーションを最新まで適用する（デプロイ時に gunicorn の起動前に実行する）"""
+    # マイグレーション導入前に db.create_all() で作成したデータベースは、初期スキーマとして記録してから適用する
+    from flask_migrate import stamp, upgrade
+    tables = db.inspect(db.engine).get_table_names()
+    if tables and 'alembic_version' not in tables:
+        click.echo('マイグレーションの記録がないため、0001_initial として記録します')
+        stamp(revision='0001_initial')
+    upgrade()
+    click.echo('データベースを最新のスキーマに更新しました')
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """全文検索インデックス（posts_fts）を投稿テーブルから再構築する"""
+    rebuild_search_index()
+    db.session.commit()
+    click.echo('検索インデックスを再構築しました')
+
+@click.command('import-posts')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--user-id', type=int, required=True, help='投稿者のユーザーID')
+@click.option('--chunk-size', type=int, default=CHUNK_SIZE, show_default=True, help='1トランザクションあたりの件数')
+@with_appcontext
+def import_posts_command(source, user_id, chunk_size):
+    """NDJSON（1行1投稿、- で標準入力）から投稿を一括登録する"""
+    started = time.perf_counter()
+    report = import_posts(source, user_id, chunk_size=chunk_size, unfurl=False)
+    elapsed = time.perf_counter() - started
+
+    for error in report['errors'][:50]:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    rate = report['imported'] / elapsed * 60 if elapsed else 0
+    click.echo(f"{report['imported']} 件を登録しました（エラー {len(report['errors'])} 件、"
+               f"{elapsed:.1f} 秒、{rate:,.0f} 件/分）")
+    if report['imported']:
+        click.echo('URLのプレビューは `flask unfurl` で取得してください')
+
+@click.command('unfurl')
+@click.option('--backfill', is_flag=True, help='プレビューの行がない投稿URLを先に登録する')
+@click.option('--retry-errors', is_flag=True, help='取得に失敗したURLも試行回数の上限まで取得し直す')
+@click.option('--limit', type=int, help='取得するURLの最大数')
+@with_appcontext
+def unfurl_command(backfill, retry_errors, limit):
+    """取得待ちのURLのプレビューを取得する"""
+    if backfill:
+        click.echo(f'{backfill_previews()} 件のURLを登録しました')
+    started = time.perf_counter()
+    results = unfurl_pending(limit=limit, retry_errors=retry_errors)
+    click.echo(f"取得 {results['ok']} 件、失敗 {results['error']} 件（{time.perf_counter() - started:.1f} 秒）")
+
+# 各エンドポイントが実際に発行するSELECTの実行計画を確認する
+# (名前, URL, ログイン要否, 並べ替え用の一時B-treeを許容するか)
+# 期間別に集計して並べる人気タグと、経路順に並べるスレッドは、対象件数が限られるため一時B-treeを許容する
+def query_plan_targets(post_id, user_id, tag_name, post_url):
+    return [
+        ('timeline', '/api/posts', False, False),
+        ('timeline (cursor)', '/api/posts?before=', False, False),
+        ('tag', f'/api/posts/tag/{tag_name}?before=', False, False),
+        ('user', f'/api/posts/user/{user_id}?before=', False, False),
+        ('by url', f'/api/posts/by-url?url={quote(post_url, safe="")}&before=', False, False),
+        ('replies', f'/api/posts/{post_id}/replies?before=', False, False),
+        ('thread', f'/api/posts/{post_id}/thread', False, True),
+        ('favorites', '/api/posts/favorites?before=', True, False),
+        ('popular tags', '/api/tags/popular', False, False),
+        ('popular tags (24h)', '/api/tags/popular?window=24h', False, True),
+        ('search', '/api/search?q=ChatGPT', False, False),
+    ]
+
+# 再帰CTE（スレッド取得）の作業テーブルの走査。テーブルの全件走査ではない
+CTE_SCANS = ('SCAN t', 'SCAN thread')
+
+def is_bad_plan(detail, allow_sort):
+    if detail in CTE_SCANS:
+        return False
+    if 'TEMP B-TREE' in detail:
+        return not allow_sort
+    # インデックスを使わない全件走査
+    return detail.startswith('SCAN') and 'INDEX' not in detail and 'VIRTUAL TABLE' not in detail
+
+def query_plans(client, url):
+    # url を取得したときに発行された SELECT ごとの実行計画（detail の一覧）。レスポンスと一緒に返す
+    statements = []
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            statements.append((statement, parameters))
+
+    db.event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        response = client.get(url)
+    finally:
+        db.event.remove(db.engine, 'before_cursor_execute', capture)
+
+    plans = []
+    raw = db.engine.raw_connection()
+    try:
+        for statement, parameters in statements:
+            cursor = raw.cursor()
+            plans.append([row[-1] for row in cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()])
+            cursor.close()
+    finally:
+        raw.close()
+    return response, plans
+
+@click.command('check-query-plans')
+@with_appcontext
+def check_query_plans():
+    """各エンドポイントのクエリが索引を使っているかを EXPLAIN QUERY PLAN で確認する"""
+    post = Post.query.order_by(Post.replies_count.desc()).first()
+    tag = Tag.query.order_by(Tag.post_count.desc()).first()
+    if post is None or tag is None:
+        raise click.ClickException('投稿とタグが存在するデータベースで実行してください')
+
+    cache_enabled = current_app.config.get('RESPONSE_CACHE_ENABLED', True)
+    current_app.config['RESPONSE_CACHE_ENABLED'] = False
+    client = current_app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(post.user_id)
+
+    failures = 0
+    try:
+        for name, url, login, allow_sort in query_plan_targets(post.id, post.user_id, tag.name, post.url):
+            response, plans = query_plans(client if login else current_app.test_client(), url)
+            click.echo(f'{name} ({url}) -> {response.status_code}')
+            for plan in plans:
+                for detail in plan:
+                    bad = is_bad_plan(detail, allow_sort)
+                    failures += bad
+                    click.echo(f'  {"NG" if bad else "ok"}  {detail}')
+    finally:
+        current_app.config['RESPONSE_CACHE_ENABLED'] = cache_enabled
+
+    if failures:
+        raise click.ClickException(f'{failures} 件の全件走査または一時B-treeによる並べ替えがあります')
+    click.echo('すべてのクエリが索引を使用しています')
+
+@click.group('profiles')
+def profiles_command():
+    """取得したリクエストのプロファイルを扱う"""
+
+@profiles_command.command('list')
+@click.option('--limit', type=int, default=50, show_default=True)
+@with_appcontext
+def list_profiles_command(limit):
+    """取得済みのプロファイルを新しい順に表示する"""
+    profiles = list_profiles(current_app)
+    if not profiles:
+        click.echo(f'{profile_dir(current_app)} にプロファイルはありません')
+        return
+    for profile in profiles[:limit]:
+        click.echo(f"{profile['captured_at']:%Y-%m-%d %H:%M:%S}  {profile['duration_ms']:>6} ms  "
+                   f"{profile['method']:<6} /{profile['path_slug']}  {profile['name']}")
+
+@profiles_command.command('show')
+@click.argument('name')
+@click.option('--sort', type=click.Choice(['cumulative', 'tottime', 'calls']), default='cumulative', show_default=True)
+@click.option('--limit', type=int, default=30, show_default=True)
+@with_appcontext
+def show_profile_command(name, sort, limit):
+    """プロファイルの上位の関数を表示する（NAME は list のファイル名）"""
+    # .speedscope.json やパスで指定されても同じ取得の .prof を開く（ファイル名の語幹にはドットを含まない）
+    stem = os.path.basename(name).split('.', 1)[0]
+    path = os.path.join(profile_dir(current_app), stem + '.prof')
+    if not os.path.exists(path):
+        raise click.ClickException(f'{path} がありません')
+    output = io.StringIO()
+    pstats.Stats(path, stream=output).strip_dirs().sort_stats(sort).print_stats(limit)
+    click.echo(output.getvalue())
+
+@profiles_command.command('token')
+@with_appcontext
+def profile_token_command():
+    """プロファイル取得用の署名付きトークンを発行する"""
+    click.echo(make_token(current_app))
+    click.echo(f"（{TOKEN_HEADER} ヘッダーに指定。有効期限 {current_app.config.get('PROFILE_TOKEN_MAX_AGE', 3600)} 秒）", err=True)
@@ -0,0 +1,77 @@
+import gzip
+from threading import Lock
+from cachetools import LRUCache
+from flask import request, current_app
+from instrumentation import phase
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# レスポンスの圧縮（Accept-Encoding で br / gzip を選ぶ。brotli がなければ gzip のみ）
+# COMPRESS_MIMETYPES のレスポンスのうち COMPRESS_MIN_SIZE バイト以上のものだけを圧縮し、
+# ストリーミング（/api/stream）や送信ファイル、200 以外はそのまま返す。
+# 圧縮した表現には符号化ごとに別のETag（"<etag>-br" など）を付け、Vary: Accept-Encoding を返す。
+# ETag の付いたレスポンス（cached_response）は内容がETagで決まるので、圧縮結果をETagごとに使い回す。
+
+# 同じ品質ならこの順で選ぶ
+ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+_cache = None
+_lock = Lock()
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = LRUCache(maxsize=current_app.config.get('COMPRESS_CACHE_SIZE', 1024))
+    return _cache
+
+def compress(data, encoding, config):
+    if encoding == 'br':
+        return brotli.compress(data, quality=config.get('COMPRESS_BROTLI_QUALITY', 4))
+    return gzip.compress(data, compresslevel=config.get('COMPRESS_GZIP_LEVEL', 6), mtime=0)
+
+def encoded_etag(etag, encoding):
+    return f'{etag}-{encoding}'
+
+def matching_etag(etag):
+    # If-None-Match に一致する表現のETag（受け付けない符号化の表現は一致させない）。なければ None
+    candidates = [etag] + [encoded_etag(etag, encoding) for encoding in ENCODINGS if request.accept_encodings[encoding]]
+    return next((candidate for candidate in candidates if request.if_none_match.contains(candidate)), None)
+
+def compress_response(response):
+    config = current_app.config
+    if not config.get('COMPRESS_ENABLED', True) or response.mimetype not in config.get('COMPRESS_MIMETYPES', ()):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200 or response.direct_passthrough or response.is_streamed \
+            or 'Content-Encoding' in response.headers:
+        return response
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < config.get('COMPRESS_MIN_SIZE', 1024):
+        return response
+
+    etag, weak = response.get_etag()
+    key = (etag, encoding) if etag and not weak else None
+    with phase('compress'):
+        with _lock:
+            body = _get_cache().get(key) if key else None
+        if body is None:
+            body = compress(data, encoding, config)
+            if key:
+                with _lock:
+                    _get_cache()[key] = body
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        response.set_etag(encoded_etag(etag, encoding), weak=weak)
+    return response
+
+def init_compression(app):
+    # 計測（instrumentation）の after_request より先に実行されるよう、その後に登録する
+    app.after_request(compress_response)
@@ -1,5 +1,6 @@
 import os
 from dotenv import load_dotenv
+from sqlalchemy.pool import QueuePool
 
 load_dotenv()
 
@@ -7,13 +8,110 @@ class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-here')
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///instance/database.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # 公開GETエンドポイントのレスポンスキャッシュ
+    RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', '1') != '0'
+    RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 30))
+    RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 1024))
+    # 全文検索（search.py）。どの語の該当件数もこれ以下ならスコア順、超えれば新しい順
+    SEARCH_RANK_LIMIT = int(os.getenv('SEARCH_RANK_LIMIT', 1000))
+    # Google OAuth（oauth.py）。各エンドポイントは手元の OpenID プロバイダに差し替えられる
+    GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
+    GOOGLE_CLIENT_SECRET = os.getenv('GOOGLE_CLIENT_SECRET')
+    OAUTH_REDIRECT_URI = f"{os.getenv('BASE_URL', 'http://localhost:3000')}/auth/callback"
+    GOOGLE_AUTH_URI = os.getenv('GOOGLE_AUTH_URI', 'https://accounts.google.com/o/oauth2/auth')
+    GOOGLE_TOKEN_URI = os.getenv('GOOGLE_TOKEN_URI', 'https://oauth2.googleapis.com/token')
+    GOOGLE_CERTS_URI = os.getenv('GOOGLE_CERTS_URI', 'https://www.googleapis.com/oauth2/v1/certs')
+    GOOGLE_ISSUERS = [issuer.strip() for issuer in os.getenv('GOOGLE_ISSUERS', 'accounts.google.com,https://accounts.google.com').split(',')]
+    OAUTH_SCOPES = [
+        'https://www.googleapis.com/auth/userinfo.email',
+        'https://www.googleapis.com/auth/userinfo.profile',
+        'openid'
+    ]
+    OAUTH_HTTP_TIMEOUT = float(os.getenv('OAUTH_HTTP_TIMEOUT', 10))
+    OAUTH_CERTS_DEFAULT_TTL = int(os.getenv('OAUTH_CERTS_DEFAULT_TTL', 3600))  # Cache-Control がない場合
+    # API レスポンスのJSONエンコード（json_provider.py。auto は orjson があれば使う）と圧縮（compression.py）
+    JSON_BACKEND = os.getenv('JSON_BACKEND', 'auto')
+    COMPRESS_ENABLED = os.getenv('COMPRESS_ENABLED', '1') != '0'
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+    COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+    COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))
+    COMPRESS_CACHE_SIZE = int(os.getenv('COMPRESS_CACHE_SIZE', 1024))
+    COMPRESS_MIMETYPES = ('application/json', 'text/html', 'text/css', 'text/javascript', 'application/javascript', 'text/plain')
+    # URLのプレビュー取得（unfurl.py）。ワーカーごとのスレッドプールで、溢れた分は `flask unfurl` で取得する
+    UNFURL_ENABLED = os.getenv('UNFURL_ENABLED', '1') != '0'
+    UNFURL_CONCURRENCY = int(os.getenv('UNFURL_CONCURRENCY', 4))
+    UNFURL_QUEUE_SIZE = int(os.getenv('UNFURL_QUEUE_SIZE', 200))
+    UNFURL_CONNECT_TIMEOUT = float(os.getenv('UNFURL_CONNECT_TIMEOUT', 3))
+    UNFURL_READ_TIMEOUT = float(os.getenv('UNFURL_READ_TIMEOUT', 5))
+    UNFURL_TOTAL_TIMEOUT = float(os.getenv('UNFURL_TOTAL_TIMEOUT', 10))
+    UNFURL_MAX_BYTES = int(os.getenv('UNFURL_MAX_BYTES', 256 * 1024))
+    UNFURL_MAX_REDIRECTS = int(os.getenv('UNFURL_MAX_REDIRECTS', 3))
+    UNFURL_MAX_ATTEMPTS = int(os.getenv('UNFURL_MAX_ATTEMPTS', 3))
+    UNFURL_ALLOW_PRIVATE = os.getenv('UNFURL_ALLOW_PRIVATE', '0') == '1'  # 手元のスタンドインサーバー用
+    UNFURL_USER_AGENT = os.getenv('UNFURL_USER_AGENT', 'ATG-LinkPreview/1.0')
+    # ログインユーザーのキャッシュ（user_cache.py）。他ワーカーでのプロフィール変更は TTL 後に反映される
+    USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 60))
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 4096))
+    # リクエスト単位の計測（Server-Timing とログ）。本番ではサンプリングする
+    INSTRUMENTATION_ENABLED = os.getenv('INSTRUMENTATION_ENABLED', '1') != '0'
+    INSTRUMENTATION_SAMPLE_RATE = float(os.getenv('INSTRUMENTATION_SAMPLE_RATE', 1.0))
+    N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', 10))
+    # /metrics（ワーカー間の集計は METRICS_DB_PATH の SQLite で行う。既定は instance/metrics.db）
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') != '0'
+    METRICS_DB_PATH = os.getenv('METRICS_DB_PATH')
+    METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+    # リクエスト単位のプロファイル取得（profiler.py）
+    PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', '1') != '0'
+    PROFILE_DIR = os.getenv('PROFILE_DIR')  # 既定は instance/profiles
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_LATENCY_THRESHOLD_MS = float(os.getenv('PROFILE_LATENCY_THRESHOLD_MS', 500))
+    PROFILE_TOKEN_MAX_AGE = int(os.getenv('PROFILE_TOKEN_MAX_AGE', 3600))
+    PROFILE_ADMIN_EMAILS = [email.strip() for email in os.getenv('PROFILE_ADMIN_EMAILS', '').split(',') if email.strip()]
+    PROFILE_FORMATS = ('pstats', 'speedscope')
+    PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 200))
+    # ライブ配信（stream.py）。接続を多数保持するため本番は gevent ワーカーで動かす
+    STREAM_POLL_INTERVAL = float(os.getenv('STREAM_POLL_INTERVAL', 0.5))
+    STREAM_HEARTBEAT = float(os.getenv('STREAM_HEARTBEAT', 15))
+    STREAM_MAX_DURATION = float(os.getenv('STREAM_MAX_DURATION', 600))  # 超えたら再接続させる
+    STREAM_BUFFER_SIZE = int(os.getenv('STREAM_BUFFER_SIZE', 1000))
+    STREAM_REPLAY_LIMIT = int(os.getenv('STREAM_REPLAY_LIMIT', 1000))
+    STREAM_RETENTION = int(os.getenv('STREAM_RETENTION', 3600))
+    STREAM_RETRY_MS = int(os.getenv('STREAM_RETRY_MS', 3000))
 
 class DevelopmentConfig(Config):
     DEBUG = True
 
 class ProductionConfig(Config):
     DEBUG = False
+    INSTRUMENTATION_SAMPLE_RATE = float(os.getenv('INSTRUMENTATION_SAMPLE_RATE', 0.05))
+    # SQLite を複数ワーカーで使うための接続ごとのPRAGMA
+    # WAL で読み込みと書き込みを並行させ、ロック競合は busy_timeout の間待つ
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64000,  # 負の値はKiB単位（約64MB）
+        'temp_store': 'MEMORY',
+    }
+    # PRAGMAとページキャッシュを活かすため、接続をプールして使い回す
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'poolclass': QueuePool,
+        'pool_size': 5,
+        'max_overflow': 10,
+        'connect_args': {'timeout': 5, 'check_same_thread': False},
+    }
 
 class TestingConfig(Config):
     TESTING = True
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:' 
\ No newline at end of file
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    RESPONSE_CACHE_ENABLED = False 
+    UNFURL_ENABLED = False
+    METRICS_ENABLED = False
+
+config_by_name = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'testing': TestingConfig,
+}
@@ -43,9 +43,16 @@ if [ ! -d "instance" ]; then
     chmod 777 instance
 fi
 
+# データベースを最新のスキーマに更新（アプリの読み込み時にはテーブルを作成しないため、起動前に必ず実行する）
+# マイグレーション導入前に作成したデータベースは 0001_initial として記録してから適用される
+echo "Upgrading database schema..."
+FLASK_APP=app flask upgrade-db
+
 # Gunicornでアプリケーションを起動
+# /api/stream の接続を多数保持するため gevent ワーカー（接続ごとにグリーンレット）で動かす
 echo "Starting application with Gunicorn..."
-cd /var/www/atg && PYTHONPATH=/var/www/atg nohup gunicorn --bind 0.0.0.0:3001 --workers 3 --timeout 120 'app:app' > flask.log 2>&1 &
+cd /var/www/atg && PYTHONPATH=/var/www/atg nohup gunicorn --bind 0.0.0.0:3001 --workers 3 \
+    --worker-class gevent --worker-connections 2000 --timeout 120 'app:app' > flask.log 2>&1 &
 disown
 
 # Nginxの設定をテスト
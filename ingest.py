@@ -0,0 +1,161 @@
+import json
+from datetime import datetime
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, Post, Tag, post_tags, next_post_id
+from cache import bump_generation
+from tag_stats import record_bulk_tags
+from unfurl import register_urls, schedule_unfurl
+from urls import try_url_hash
+
+# 投稿の一括登録（NDJSON: 1行1投稿）
+#   {"content": "...", "url": "...", "tags": ["..."], "created_at": "2024-01-01T12:00:00"}
+# tags と created_at は任意。不正な行はスキップして行番号つきで報告する。
+# created_at は既存の最新の投稿（同じ取り込みの前の行を含む）以後、現在時刻以前に限る。
+# 投稿IDの順と作成日時の順を一致させるため（タグ別一覧は投稿IDの降順で返す）。
+# チャンクごとに1トランザクションで、タグは IN 句でまとめて解決し、
+# posts / post_tags は executemany で挿入する。
+
+CHUNK_SIZE = 1000
+IN_CLAUSE_SIZE = 500  # SQLite のバインド変数上限に収まるよう IN 句を分割する
+
+class InvalidRecord(ValueError):
+    pass
+
+def parse_record(line):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        raise InvalidRecord('JSONとして解釈できません')
+    if not isinstance(record, dict):
+        raise InvalidRecord('オブジェクトではありません')
+
+    content = record.get('content')
+    url = record.get('url')
+    if not isinstance(content, str) or not content.strip():
+        raise InvalidRecord('content が必要です')
+    if not isinstance(url, str) or not url.strip():
+        raise InvalidRecord('url が必要です')
+    if len(url) > 2048:
+        raise InvalidRecord('url が長すぎます')
+
+    tags = record.get('tags') or []
+    if not isinstance(tags, list) or not all(isinstance(tag, str) and tag.strip() for tag in tags):
+        raise InvalidRecord('tags は文字列の配列で指定してください')
+    tags = list(dict.fromkeys(tag.strip() for tag in tags))
+    if any(len(tag) > 50 for tag in tags):
+        raise InvalidRecord('タグが長すぎます')
+
+    created_at = record.get('created_at')
+    if created_at is not None:
+        try:
+            created_at = datetime.fromisoformat(created_at)
+        except (TypeError, ValueError):
+            raise InvalidRecord('created_at が不正です')
+
+    return {
+        'content': content,
+        'url': url,
+        'tags': tags,
+        'created_at': created_at,
+    }
+
+def resolve_tags(names):
+    # タグ名 -> ID。既存タグを IN 句で引き、足りないものだけまとめて挿入する
+    names = list(names)
+    tag_ids = {}
+    for i in range(0, len(names), IN_CLAUSE_SIZE):
+        chunk = names[i:i + IN_CLAUSE_SIZE]
+        tag_ids.update(db.session.query(Tag.name, Tag.id).filter(Tag.name.in_(chunk)).all())
+
+    missing = [name for name in names if name not in tag_ids]
+    if missing:
+        now = datetime.utcnow()
+        db.session.execute(
+            sqlite_insert(Tag.__table__).on_conflict_do_nothing(),
+            [{'name': name, 'created_at': now, 'post_count': 0} for name in missing]
+        )
+        for i in range(0, len(missing), IN_CLAUSE_SIZE):
+            chunk = missing[i:i + IN_CLAUSE_SIZE]
+            tag_ids.update(db.session.query(Tag.name, Tag.id).filter(Tag.name.in_(chunk)).all())
+    return tag_ids
+
+def _insert_chunk(records, user_id, ip_address):
+    # 最初の書き込み（世代番号の更新）で書き込みロックを取るため、
+    # 以降の next_post_id() による採番は他のワーカーと競合しない
+    bump_generation()
+
+    tag_ids = resolve_tags({name for record in records for name in record['tags']})
+    next_id = next_post_id()
+    now = datetime.utcnow()
+
+    post_rows = []
+    post_tag_rows = []
+    tag_entries = []
+    for post_id, record in enumerate(records, next_id):
+        created_at = record['created_at'] or now
+        post_rows.append({
+            'id': post_id,
+            'content': record['content'],
+            'url': record['url'],
+            'url_hash': try_url_hash(record['url']),
+            'user_id': user_id,
+            'created_at': created_at,
+            'favorite_count': 0,
+            'replies_count': 0,
+            'ip_address': ip_address,
+        })
+        ids = [tag_ids[name] for name in record['tags']]
+        post_tag_rows.extend({'post_id': post_id, 'tag_id': tag_id} for tag_id in ids)
+        tag_entries.append((ids, created_at))
+
+    db.session.execute(Post.__table__.insert(), post_rows)
+    if post_tag_rows:
+        db.session.execute(post_tags.insert(), post_tag_rows)
+    record_bulk_tags(tag_entries)
+    pending_urls = register_urls(record['url'] for record in records)
+    db.session.commit()
+    return pending_urls
+
+def check_created_at(record, latest):
+    # 過去に遡った日時・未来の日時は、後から採番される投稿IDと日時の順序が食い違うので受け付けない
+    created_at = record['created_at']
+    if created_at is None:
+        return latest
+    if latest is not None and created_at < latest:
+        raise InvalidRecord('created_at が既存の最新の投稿より前です')
+    if created_at > datetime.utcnow():
+        raise InvalidRecord('created_at が未来の日時です')
+    return created_at
+
+def import_posts(lines, user_id, ip_address=None, chunk_size=CHUNK_SIZE, unfurl=True):
+    # unfurl=False ではURLのプレビューを登録だけする（`flask unfurl` で取得する）
+    report = {'imported': 0, 'errors': []}
+    chunk = []
+    latest = db.session.query(db.func.max(Post.created_at)).scalar()
+
+    def flush():
+        try:
+            pending_urls = _insert_chunk([record for line_no, record in chunk], user_id, ip_address)
+            report['imported'] += len(chunk)
+            if unfurl:
+                schedule_unfurl(pending_urls)
+        except Exception as e:
+            db.session.rollback()
+            report['errors'].extend({'line': line_no, 'error': f'登録に失敗しました: {e}'} for line_no, record in chunk)
+        chunk.clear()
+
+    for line_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = parse_record(line)
+            latest = check_created_at(record, latest)
+            chunk.append((line_no, record))
+        except InvalidRecord as e:
+            report['errors'].append({'line': line_no, 'error': str(e)})
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+
+    return report
@@ -0,0 +1,123 @@
+import json
+import random
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# リクエスト単位の計測
+# SQL（件数・合計時間・最も遅い文）、シリアライズ、テンプレート描画の時間を集計し、
+# Server-Timing ヘッダーと1行のJSONログに出す。
+# 同じ形の文が N_PLUS_ONE_THRESHOLD 回を超えて実行されたリクエストは N+1 の疑いとして警告する。
+# 件数と合計時間は全リクエストで数え（/metrics が使う）、文の形の集計・ヘッダー・ログは
+# サンプリングしたリクエストだけで行う。
+
+SLOWEST_SQL_LENGTH = 200
+
+# IN 句のプレースホルダ数や数値リテラルの違いは同じ形とみなす
+_IN_PARAMS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_NUMBERS = re.compile(r'\b\d+\b')
+
+def statement_shape(statement):
+    shape = _IN_PARAMS.sub('(?)', statement)
+    shape = _NUMBERS.sub('N', shape)
+    return ' '.join(shape.split())
+
+def _stats():
+    if not has_request_context():
+        return None
+    return g.get('instrumentation')
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _stats() is not None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _stats()
+    if stats is None or not conn.info.get('query_started'):
+        return
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    stats['queries'] += 1
+    stats['sql'] += elapsed
+    if stats['sampled']:
+        stats['shapes'][statement_shape(statement)] += 1
+        if elapsed > stats['slowest'][0]:
+            stats['slowest'] = (elapsed, statement)
+
+@contextmanager
+def phase(name):
+    # 任意の区間の時間を Server-Timing に載せる（計測対象外のリクエストでは何もしない）
+    stats = _stats()
+    if stats is None or not stats['sampled']:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats['phases'][name] = stats['phases'].get(name, 0) + time.perf_counter() - started
+
+def request_stats():
+    # 処理中のリクエストのクエリ数と SQL 時間（計測が無効なら None）
+    return _stats()
+
+def _start(sample_rate):
+    g.instrumentation = {
+        'sampled': random.random() < sample_rate,
+        'started': time.perf_counter(),
+        'queries': 0,
+        'sql': 0.0,
+        'slowest': (0.0, None),
+        'shapes': Counter(),
+        'phases': {},
+    }
+
+def _finish(response, app):
+    stats = _stats()
+    if stats is None or not stats['sampled']:
+        return response
+    total = time.perf_counter() - stats['started']
+
+    timings = [f'sql;dur={stats["sql"] * 1000:.2f};desc="{stats["queries"]} queries"']
+    timings.extend(f'{name};dur={elapsed * 1000:.2f}' for name, elapsed in stats['phases'].items())
+    timings.append(f'total;dur={total * 1000:.2f}')
+    response.headers.add('Server-Timing', ', '.join(timings))
+
+    threshold = app.config.get('N_PLUS_ONE_THRESHOLD', 10)
+    repeated = [(shape, count) for shape, count in stats['shapes'].most_common(3) if count > threshold]
+    slowest_time, slowest_statement = stats['slowest']
+    app.logger.info(json.dumps({
+        'event': 'request',
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'cache': response.headers.get('X-Cache'),
+        'duration_ms': round(total * 1000, 2),
+        'sql_ms': round(stats['sql'] * 1000, 2),
+        'queries': stats['queries'],
+        'phases_ms': {name: round(elapsed * 1000, 2) for name, elapsed in stats['phases'].items()},
+        'slowest_sql_ms': round(slowest_time * 1000, 2),
+        'slowest_sql': ' '.join(slowest_statement.split())[:SLOWEST_SQL_LENGTH] if slowest_statement else None,
+        'n_plus_one': [{'statement': shape[:SLOWEST_SQL_LENGTH], 'count': count} for shape, count in repeated],
+    }, ensure_ascii=False))
+    for shape, count in repeated:
+        app.logger.warning(f'N+1 の疑い: {request.method} {request.path} で同じ形のクエリが {count} 回実行されました: {shape[:SLOWEST_SQL_LENGTH]}')
+    return response
+
+def init_instrumentation(app):
+    if not app.config.get('INSTRUMENTATION_ENABLED', True):
+        return
+
+    @app.before_request
+    def start_instrumentation():
+        _start(app.config.get('INSTRUMENTATION_SAMPLE_RATE', 1.0))
+
+    @app.after_request
+    def finish_instrumentation(response):
+        return _finish(response, app)
@@ -0,0 +1,50 @@
+import json
+from datetime import date, datetime
+from flask import current_app
+from instrumentation import phase
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# API レスポンスのJSONエンコード（flask.jsonify の置き換え）
+# Flask 2.0 の jsonify は標準の json で日本語を \uXXXX にエスケープしてエンコードする。
+# JSON_BACKEND（auto / orjson / stdlib）で選んだエンコーダを使い、auto は orjson があればそれを、
+# なければ標準の json を使う。どちらも日本語は UTF-8 のまま出力する。
+# datetime は各エンコーダが直接 ISO 8601 にする（シリアライザでは datetime のまま渡す）。
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} は JSON にできません')
+
+def dumps_stdlib(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+def dumps_orjson(obj):
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+BACKENDS = {'stdlib': dumps_stdlib}
+if orjson is not None:
+    BACKENDS['orjson'] = dumps_orjson
+
+def get_backend(name='auto'):
+    if name == 'auto':
+        return BACKENDS.get('orjson', dumps_stdlib)
+    if name not in BACKENDS:
+        raise ValueError(f'JSON_BACKEND {name!r} は使えません（{", ".join(BACKENDS)}）')
+    return BACKENDS[name]
+
+def dumps(obj):
+    # JSON の bytes（UTF-8）を返す
+    return get_backend(current_app.config.get('JSON_BACKEND', 'auto'))(obj)
+
+def jsonify(*args, **kwargs):
+    # flask.jsonify と同じ引数（値1つならその値、複数ならリスト、キーワードなら辞書）
+    if args and kwargs:
+        raise TypeError('jsonify は位置引数とキーワード引数を同時に受け取れません')
+    data = args[0] if len(args) == 1 else list(args) if args else kwargs
+    with phase('encode'):
+        body = dumps(data) + b'\n'
+    return current_app.response_class(body, mimetype='application/json')
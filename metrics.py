@@ -0,0 +1,303 @@
+import os
+import sqlite3
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from threading import Lock
+from flask import g, request, Response, abort
+from instrumentation import request_stats
+from cache import cache_stats
+from stream import stream_stats
+from user_cache import user_cache_stats
+from unfurl import unfurl_stats
+
+# Prometheus 形式の /metrics
+# 各ワーカーはメモリ上で集計し、METRICS_FLUSH_INTERVAL 秒ごとに累積値を共有の SQLite ファイルへ
+# ワーカー単位の行として書き出す（リクエストごとの処理は辞書の加算だけ）。
+# /metrics では全ワーカーの行を合計して返す。終了したワーカーのカウンタは retired 行に畳み込んで
+# 合計を減らさず、処理中リクエスト数（ゲージ）は生きているワーカーの分だけを数える。
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+SQL_TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# 名前 -> (型, 説明)。出力もこの順に並べる
+METRICS = {
+    'atg_http_requests_total': ('counter', 'ルート・メソッド・ステータス別のリクエスト数'),
+    'atg_http_request_duration_seconds': ('histogram', 'リクエストの処理時間'),
+    'atg_http_requests_in_flight': ('gauge', '処理中のリクエスト数'),
+    'atg_db_queries_per_request': ('histogram', '1リクエストあたりのSQLクエリ数'),
+    'atg_db_time_seconds': ('histogram', '1リクエストあたりのSQL実行時間の合計'),
+    'atg_stream_subscribers': ('gauge', '接続中のライブ配信クライアント数'),
+    'atg_response_cache_hits_total': ('counter', 'レスポンスキャッシュのヒット数'),
+    'atg_response_cache_misses_total': ('counter', 'レスポンスキャッシュのミス数'),
+    'atg_response_cache_hit_ratio': ('gauge', 'レスポンスキャッシュのヒット率（全ワーカー合計から算出）'),
+    'atg_user_cache_hits_total': ('counter', 'ログインユーザーキャッシュのヒット数'),
+    'atg_user_cache_misses_total': ('counter', 'ログインユーザーキャッシュのミス数'),
+    'atg_user_cache_hit_ratio': ('gauge', 'ログインユーザーキャッシュのヒット率（全ワーカー合計から算出）'),
+    'atg_unfurl_total': ('counter', 'URLプレビューの取得結果別の件数（dropped は取得待ちが溢れて受け付けなかった数）'),
+    'atg_unfurl_queued': ('gauge', '取得待ち・取得中のURL数'),
+}
+
+# ヒット率を算出するキャッシュ（接頭辞）
+CACHES = ('atg_response_cache', 'atg_user_cache')
+
+RETIRED = 'retired'
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS samples (
+        worker TEXT NOT NULL,
+        pid INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        labels TEXT NOT NULL,
+        le TEXT NOT NULL,
+        value REAL NOT NULL,
+        PRIMARY KEY (worker, name, labels, le)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS gauges (
+        worker TEXT NOT NULL,
+        pid INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        labels TEXT NOT NULL,
+        value REAL NOT NULL,
+        PRIMARY KEY (worker, name, labels)
+    )''',
+]
+
+def format_labels(**labels):
+    return ','.join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+
+def format_le(bound):
+    return '+Inf' if bound == float('inf') else format_value(bound)
+
+class Registry:
+    # ワーカープロセス内の集計値
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.worker = f'{self.pid}-{int(time.time() * 1000)}'
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.in_flight = 0
+        self.last_flush = time.monotonic()
+
+    def check_fork(self):
+        # fork 後の子プロセスは親の集計値を引き継がない
+        if self.pid != os.getpid():
+            self.reset()
+
+    def inc(self, name, labels, value=1):
+        self.counters[name, labels] += value
+
+    def observe(self, name, labels, buckets, value):
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            histogram = self.histograms[name, labels] = {'buckets': buckets, 'counts': [0] * (len(buckets) + 1), 'sum': 0.0}
+        histogram['counts'][bisect_left(buckets, value)] += 1
+        histogram['sum'] += value
+
+    def samples(self):
+        # (名前, ラベル, le, 値)。ヒストグラムは累積の _bucket と _sum / _count に展開する
+        rows = [(name, labels, '', value) for (name, labels), value in self.counters.items()]
+        for (name, labels), histogram in self.histograms.items():
+            cumulative = 0
+            bounds = list(histogram['buckets']) + [float('inf')]
+            for bound, count in zip(bounds, histogram['counts']):
+                cumulative += count
+                rows.append((f'{name}_bucket', labels, format_le(bound), cumulative))
+            rows.append((f'{name}_sum', labels, '', histogram['sum']))
+            rows.append((f'{name}_count', labels, '', cumulative))
+        return rows
+
+class Store:
+    # ワーカー間で共有する SQLite ファイル（アプリのデータベースとは別）
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.pid = None
+
+    def connect(self):
+        if self.conn is None or self.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+            self.pid = os.getpid()
+        return self.conn
+
+    def write(self, worker, pid, samples, gauges):
+        conn = self.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT OR REPLACE INTO samples (worker, pid, name, labels, le, value) VALUES (?, ?, ?, ?, ?, ?)',
+                [(worker, pid, name, labels, le, value) for name, labels, le, value in samples]
+            )
+            conn.executemany(
+                'INSERT OR REPLACE INTO gauges (worker, pid, name, labels, value) VALUES (?, ?, ?, ?, ?)',
+                [(worker, pid, name, labels, value) for name, labels, value in gauges]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def retire_dead_workers(self):
+        conn = self.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            workers = conn.execute('SELECT DISTINCT worker, pid FROM samples WHERE worker != ?', (RETIRED,)).fetchall()
+            dead = [worker for worker, pid in workers if not pid_alive(pid)]
+            for worker in dead:
+                conn.execute('''
+                    INSERT INTO samples (worker, pid, name, labels, le, value)
+                    SELECT ?, 0, name, labels, le, value FROM samples WHERE worker = ?
+                    ON CONFLICT (worker, name, labels, le) DO UPDATE SET value = value + excluded.value
+                ''', (RETIRED, worker))
+                conn.execute('DELETE FROM samples WHERE worker = ?', (worker,))
+                conn.execute('DELETE FROM gauges WHERE worker = ?', (worker,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def collect(self):
+        conn = self.connect()
+        samples = conn.execute('SELECT name, labels, le, SUM(value) FROM samples GROUP BY name, labels, le').fetchall()
+        gauges = conn.execute('SELECT name, labels, SUM(value) FROM gauges GROUP BY name, labels').fetchall()
+        return samples, gauges
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+_registry = Registry()
+_store = None
+
+def flush(scraping=False):
+    with _registry.lock:
+        _registry.check_fork()
+        samples = _registry.samples()
+        # /metrics の処理中に書き出す場合は、スクレイプ自身を処理中の数に含めない
+        gauges = [
+            ('atg_http_requests_in_flight', '', _registry.in_flight - (1 if scraping else 0)),
+            ('atg_stream_subscribers', '', stream_stats()['subscribers']),
+        ]
+        worker, pid = _registry.worker, _registry.pid
+        _registry.last_flush = time.monotonic()
+    stats = cache_stats()
+    samples.append(('atg_response_cache_hits_total', '', '', stats['hits']))
+    samples.append(('atg_response_cache_misses_total', '', '', stats['misses']))
+    stats = user_cache_stats()
+    samples.append(('atg_user_cache_hits_total', '', '', stats['hits']))
+    samples.append(('atg_user_cache_misses_total', '', '', stats['misses']))
+    stats = unfurl_stats()
+    for result in ('ok', 'error', 'dropped'):
+        samples.append(('atg_unfurl_total', format_labels(result=result), '', stats[result]))
+    gauges.append(('atg_unfurl_queued', '', stats['queued']))
+    _store.write(worker, pid, samples, gauges)
+
+SUFFIXES = ['', '_bucket', '_sum', '_count']
+
+def family_of(name):
+    return next((metric for metric in METRICS if name == metric or name.startswith(metric + '_')), name)
+
+def _sort_key(row):
+    name, labels, le, value = row
+    family = family_of(name)
+    suffix = name[len(family):]
+    order = list(METRICS).index(family) if family in METRICS else len(METRICS)
+    return (order, family, labels, SUFFIXES.index(suffix) if suffix in SUFFIXES else len(SUFFIXES), float(le) if le else 0.0)
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def render(samples, gauges):
+    rows = sorted(list(samples) + [(name, labels, '', value) for name, labels, value in gauges], key=_sort_key)
+
+    totals = {name: value for name, labels, le, value in rows if name.startswith(CACHES)}
+    for cache in CACHES:
+        hits = totals.get(f'{cache}_hits_total', 0)
+        lookups = hits + totals.get(f'{cache}_misses_total', 0)
+        if lookups:
+            rows.append((f'{cache}_hit_ratio', '', '', hits / lookups))
+    rows.sort(key=_sort_key)
+
+    lines = []
+    current = None
+    for name, labels, le, value in rows:
+        family = family_of(name)
+        if family != current:
+            kind, description = METRICS.get(family, ('untyped', ''))
+            lines.append(f'# HELP {family} {description}')
+            lines.append(f'# TYPE {family} {kind}')
+            current = family
+        label_text = ','.join(part for part in (labels, f'le="{le}"' if le else '') if part)
+        lines.append(f'{name}{{{label_text}}} {format_value(value)}' if label_text else f'{name} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+def init_metrics(app):
+    global _store
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    _store = Store(app.config.get('METRICS_DB_PATH') or os.path.join(app.instance_path, 'metrics.db'))
+    interval = app.config.get('METRICS_FLUSH_INTERVAL', 5)
+
+    @app.before_request
+    def start_metrics():
+        g.metrics_started = time.perf_counter()
+        with _registry.lock:
+            _registry.check_fork()
+            _registry.in_flight += 1
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_metrics(exc):
+        if 'metrics_started' not in g:
+            return
+        elapsed = time.perf_counter() - g.metrics_started
+        # 未定義のパスはラベルの種類が増えないよう1つにまとめる
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        route_labels = format_labels(blueprint=request.blueprint or '', route=route, method=request.method)
+        status = g.get('metrics_status', 500)
+        stats = request_stats()
+
+        with _registry.lock:
+            _registry.in_flight -= 1
+            _registry.inc('atg_http_requests_total', format_labels(
+                blueprint=request.blueprint or '', route=route, method=request.method, status=status
+            ))
+            _registry.observe('atg_http_request_duration_seconds', route_labels, LATENCY_BUCKETS, elapsed)
+            if stats is not None:
+                _registry.observe('atg_db_queries_per_request', route_labels, QUERY_BUCKETS, stats['queries'])
+                _registry.observe('atg_db_time_seconds', route_labels, SQL_TIME_BUCKETS, stats['sql'])
+            due = time.monotonic() - _registry.last_flush >= interval
+
+        if due:
+            try:
+                flush()
+            except sqlite3.Error as e:
+                app.logger.warning(f'メトリクスの書き出しに失敗しました: {e}')
+
+    @app.route('/metrics')
+    def metrics():
+        token = app.config.get('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            abort(403)
+        flush(scraping=True)
+        _store.retire_dead_workers()
+        return Response(render(*_store.collect()), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,32 @@
+"""add posts.replies_count
+
+Revision ID: 0002_replies_count
+Revises: 0001_initial
+Create Date: 2026-10-18 18:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_replies_count'
+down_revision = '0001_initial'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('posts', sa.Column('replies_count', sa.Integer(), nullable=False, server_default='0'))
+
+    # 既存データを一括で埋める
+    op.execute('''
+        UPDATE posts SET replies_count = (
+            SELECT COUNT(*) FROM posts AS r WHERE r.reply_to_id = posts.id
+        )
+    ''')
+
+
+def downgrade():
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('replies_count')
@@ -0,0 +1,54 @@
+"""add tags.post_count and tag_hourly_counts
+
+Revision ID: 0003_tag_leaderboard
+Revises: 0002_replies_count
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from datetime import datetime, timedelta
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_tag_leaderboard'
+down_revision = '0002_replies_count'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('tags', sa.Column('post_count', sa.Integer(), nullable=False, server_default='0'))
+    op.create_index(op.f('ix_tags_post_count'), 'tags', ['post_count'], unique=False)
+    op.create_table('tag_hourly_counts',
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.Column('hour', sa.DateTime(), nullable=False),
+    sa.Column('post_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ),
+    sa.PrimaryKeyConstraint('tag_id', 'hour')
+    )
+    op.create_index('ix_tag_hourly_counts_hour', 'tag_hourly_counts', ['hour', 'tag_id', 'post_count'], unique=False)
+
+    # 既存データを一括で集計（時間別は直近7日分のみ）
+    op.execute('''
+        UPDATE tags SET post_count = (
+            SELECT COUNT(*) FROM post_tags WHERE post_tags.tag_id = tags.id
+        )
+    ''')
+    since = (datetime.utcnow() - timedelta(days=7)).replace(minute=0, second=0, microsecond=0)
+    op.execute(sa.text('''
+        INSERT INTO tag_hourly_counts (tag_id, hour, post_count)
+        SELECT pt.tag_id, strftime('%Y-%m-%d %H:00:00.000000', p.created_at), COUNT(*)
+        FROM post_tags AS pt
+        JOIN posts AS p ON p.id = pt.post_id
+        WHERE p.created_at >= :since
+        GROUP BY 1, 2
+    ''').bindparams(sa.bindparam('since', since, type_=sa.DateTime)))
+
+
+def downgrade():
+    op.drop_index('ix_tag_hourly_counts_hour', table_name='tag_hourly_counts')
+    op.drop_table('tag_hourly_counts')
+    op.drop_index(op.f('ix_tags_post_count'), table_name='tags')
+    with op.batch_alter_table('tags') as batch_op:
+        batch_op.drop_column('post_count')
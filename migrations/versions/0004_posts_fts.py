@@ -0,0 +1,69 @@
+"""add posts_fts full-text search index
+
+Revision ID: 0004_posts_fts
+Revises: 0003_tag_leaderboard
+Create Date: 2026-10-18 19:30:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_posts_fts'
+down_revision = '0003_tag_leaderboard'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE VIRTUAL TABLE posts_fts USING fts5(content, tags, tokenize='trigram')")
+    op.execute('''
+        CREATE TRIGGER posts_fts_insert AFTER INSERT ON posts BEGIN
+            INSERT INTO posts_fts (rowid, content, tags) VALUES (new.id, new.content, '');
+        END
+    ''')
+    op.execute('''
+        CREATE TRIGGER posts_fts_update AFTER UPDATE OF content ON posts BEGIN
+            UPDATE posts_fts SET content = new.content WHERE rowid = new.id;
+        END
+    ''')
+    op.execute('''
+        CREATE TRIGGER posts_fts_delete AFTER DELETE ON posts BEGIN
+            DELETE FROM posts_fts WHERE rowid = old.id;
+        END
+    ''')
+    op.execute('''
+        CREATE TRIGGER post_tags_fts_insert AFTER INSERT ON post_tags BEGIN
+            UPDATE posts_fts SET tags = trim(tags || ' ' || (SELECT name FROM tags WHERE id = new.tag_id))
+            WHERE rowid = new.post_id;
+        END
+    ''')
+    op.execute('''
+        CREATE TRIGGER post_tags_fts_delete AFTER DELETE ON post_tags BEGIN
+            UPDATE posts_fts SET tags = coalesce((
+                SELECT group_concat(t.name, ' ') FROM post_tags AS pt
+                JOIN tags AS t ON t.id = pt.tag_id
+                WHERE pt.post_id = old.post_id
+            ), '')
+            WHERE rowid = old.post_id;
+        END
+    ''')
+
+    # 既存の投稿を索引
+    op.execute('''
+        INSERT INTO posts_fts (rowid, content, tags)
+        SELECT p.id, p.content, coalesce(group_concat(t.name, ' '), '')
+        FROM posts AS p
+        LEFT JOIN post_tags AS pt ON pt.post_id = p.id
+        LEFT JOIN tags AS t ON t.id = pt.tag_id
+        GROUP BY p.id
+    ''')
+
+
+def downgrade():
+    op.execute('DROP TRIGGER post_tags_fts_delete')
+    op.execute('DROP TRIGGER post_tags_fts_insert')
+    op.execute('DROP TRIGGER posts_fts_delete')
+    op.execute('DROP TRIGGER posts_fts_update')
+    op.execute('DROP TRIGGER posts_fts_insert')
+    op.execute('DROP TABLE posts_fts')
@@ -0,0 +1,32 @@
+"""add indexes for feed access paths
+
+Revision ID: 0006_feed_indexes
+Revises: 0005_data_version
+Create Date: 2026-10-18 20:30:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_feed_indexes'
+down_revision = '0005_data_version'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_posts_created_at_id', 'posts', ['created_at', 'id'], unique=False)
+    op.create_index('ix_posts_user_id_created_at', 'posts', ['user_id', 'created_at'], unique=False)
+    op.create_index('ix_posts_reply_to_id_created_at', 'posts', ['reply_to_id', 'created_at'], unique=False)
+    op.create_index('ix_post_tags_tag_id_post_id', 'post_tags', ['tag_id', 'post_id'], unique=False)
+    op.create_index('ix_favorites_user_id_created_at', 'favorites', ['user_id', 'created_at', 'post_id'], unique=False)
+    op.execute('ANALYZE')
+
+
+def downgrade():
+    op.drop_index('ix_favorites_user_id_created_at', table_name='favorites')
+    op.drop_index('ix_post_tags_tag_id_post_id', table_name='post_tags')
+    op.drop_index('ix_posts_reply_to_id_created_at', table_name='posts')
+    op.drop_index('ix_posts_user_id_created_at', table_name='posts')
+    op.drop_index('ix_posts_created_at_id', table_name='posts')
@@ -0,0 +1,33 @@
+"""add stream_events for the live stream
+
+Revision ID: 0007_stream_events
+Revises: 0006_feed_indexes
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007_stream_events'
+down_revision = '0006_feed_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stream_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('data', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sqlite_autoincrement=True
+    )
+    op.create_index('ix_stream_events_created_at', 'stream_events', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_stream_events_created_at', table_name='stream_events')
+    op.drop_table('stream_events')
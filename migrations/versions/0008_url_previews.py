@@ -0,0 +1,38 @@
+"""add url_previews for link unfurling
+
+Revision ID: 0008_url_previews
+Revises: 0007_stream_events
+Create Date: 2026-10-18 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008_url_previews'
+down_revision = '0007_stream_events'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('url_previews',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('url', sa.String(length=2048), nullable=False),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('title', sa.String(length=300), nullable=True),
+    sa.Column('description', sa.String(length=1000), nullable=True),
+    sa.Column('site_name', sa.String(length=200), nullable=True),
+    sa.Column('image', sa.String(length=2048), nullable=True),
+    sa.Column('error', sa.String(length=200), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('fetched_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('url')
+    )
+
+
+def downgrade():
+    op.drop_table('url_previews')
@@ -0,0 +1,34 @@
+"""add posts.url_hash for same-conversation lookups
+
+Revision ID: 0009_posts_url_hash
+Revises: 0008_url_previews
+Create Date: 2026-10-19 00:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from urls import try_url_hash
+
+
+# revision identifiers, used by Alembic.
+revision = '0009_posts_url_hash'
+down_revision = '0008_url_previews'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('posts', sa.Column('url_hash', sa.BigInteger(), nullable=True))
+
+    # 正規化とハッシュはアプリと同じ Python の関数で計算する（1回の UPDATE で埋める）
+    op.get_bind().connection.create_function('url_hash', 1, try_url_hash, deterministic=True)
+    op.execute('UPDATE posts SET url_hash = url_hash(url)')
+
+    op.create_index('ix_posts_url_hash_created_at', 'posts', ['url_hash', 'created_at'], unique=False)
+    op.execute('ANALYZE posts')
+
+
+def downgrade():
+    op.drop_index('ix_posts_url_hash_created_at', table_name='posts')
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('url_hash')
@@ -0,0 +1,53 @@
+"""make posts.id AUTOINCREMENT so deleted ids are never reused
+
+Revision ID: 0010_posts_autoincrement
+Revises: 0009_posts_url_hash
+Create Date: 2026-10-19 02:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0010_posts_autoincrement'
+down_revision = '0009_posts_url_hash'
+branch_labels = None
+depends_on = None
+
+# テーブルを作り直すと posts のトリガも消えるので、全文検索のトリガを付け直す
+POSTS_FTS_TRIGGERS = [
+    '''
+    CREATE TRIGGER posts_fts_insert AFTER INSERT ON posts BEGIN
+        INSERT INTO posts_fts (rowid, content, tags) VALUES (new.id, new.content, '');
+    END
+    ''',
+    '''
+    CREATE TRIGGER posts_fts_update AFTER UPDATE OF content ON posts BEGIN
+        UPDATE posts_fts SET content = new.content WHERE rowid = new.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER posts_fts_delete AFTER DELETE ON posts BEGIN
+        DELETE FROM posts_fts WHERE rowid = old.id;
+    END
+    ''',
+]
+
+
+def rebuild_posts(autoincrement):
+    # SQLite では AUTOINCREMENT を後から付け外しできないので、テーブルを作り直して行を写す
+    # （明示した id で写すと sqlite_sequence は MAX(id) になる）
+    with op.batch_alter_table('posts', recreate='always',
+                              table_kwargs={'sqlite_autoincrement': autoincrement}):
+        pass
+    for statement in POSTS_FTS_TRIGGERS:
+        op.execute(statement)
+    op.execute('ANALYZE posts')
+
+
+def upgrade():
+    rebuild_posts(True)
+
+
+def downgrade():
+    rebuild_posts(False)
@@ -1,13 +1,15 @@
 from flask_login import UserMixin
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from urls import try_url_hash, try_normalize_url
 
 db = SQLAlchemy()
 
 # 中間テーブルの定義
 post_tags = db.Table('post_tags',
     db.Column('post_id', db.Integer, db.ForeignKey('posts.id'), primary_key=True),
-    db.Column('tag_id', db.Integer, db.ForeignKey('tags.id'), primary_key=True)
+    db.Column('tag_id', db.Integer, db.ForeignKey('tags.id'), primary_key=True),
+    db.Index('ix_post_tags_tag_id_post_id', 'tag_id', 'post_id')
 )
 
 class User(UserMixin, db.Model):
@@ -32,21 +34,140 @@ class Post(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     favorite_count = db.Column(db.Integer, default=0)
+    replies_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     ip_address = db.Column(db.String(45))
     reply_to_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=True)
+    # 正規化したURLのハッシュ（同じ会話の投稿の検索用。正規化できないURLは NULL）
+    url_hash = db.Column(db.BigInteger)
     
     # リレーションシップ
     tags = db.relationship('Tag', secondary=post_tags, backref=db.backref('posts', lazy=True))
     replies = db.relationship('Post', backref=db.backref('reply_to_post', remote_side=[id]), lazy='dynamic')
 
+    # フィードの取得経路ごとのインデックス（id は rowid として各インデックスの末尾に含まれる）
+    # id は AUTOINCREMENT にして、最新の投稿を削除してもそのIDを次の投稿に再利用しない
+    # （タグ索引やカーソルは「IDは単調増加で再利用されない」ことを前提にしている）
+    __table_args__ = (
+        db.Index('ix_posts_created_at_id', 'created_at', 'id'),
+        db.Index('ix_posts_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_posts_reply_to_id_created_at', 'reply_to_id', 'created_at'),
+        db.Index('ix_posts_url_hash_created_at', 'url_hash', 'created_at'),
+        {'sqlite_autoincrement': True},
+    )
+
+    @db.validates('url')
+    def set_url_hash(self, key, url):
+        # ORM 経由の書き込みでは url と一緒に設定する（Core の一括挿入では行に含めること）
+        self.url_hash = try_url_hash(url)
+        return url
+
+def next_post_id():
+    # IDを明示して一括挿入するときの先頭ID。削除された最新の投稿のIDも使わないよう sqlite_sequence も見る
+    return db.session.execute(db.text('''
+        SELECT max(coalesce((SELECT max(id) FROM posts), 0),
+                   coalesce((SELECT seq FROM sqlite_sequence WHERE name = 'posts'), 0)) + 1
+    ''')).scalar()
+
 class Favorite(db.Model):
     __tablename__ = 'favorites'
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), primary_key=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_favorites_user_id_created_at', 'user_id', 'created_at', 'post_id'),
+    )
+
 class Tag(db.Model):
     __tablename__ = 'tags'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow) 
\ No newline at end of file
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # 全期間の投稿数（人気タグ用に create_post / delete_post で更新）
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+
+# タグごとの1時間単位の投稿数（期間別の人気タグ用）
+class TagHourlyCount(db.Model):
+    __tablename__ = 'tag_hourly_counts'
+    tag_id = db.Column(db.Integer, db.ForeignKey('tags.id'), primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)
+    post_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_tag_hourly_counts_hour', 'hour', 'tag_id', 'post_count'),
+    ) 
+def configure_sqlite(engine, pragmas):
+    # 新しい接続ごとにPRAGMAと関数を設定する
+    # normalize_url(url) は同じ会話の投稿の絞り込み（url_hash の衝突の除外）を SQL の中で行うため
+    @db.event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        dbapi_connection.create_function('normalize_url', 1, try_normalize_url, deterministic=True)
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+# データ更新の世代番号（書き込みごとに加算し、各ワーカーのレスポンスキャッシュを無効化する）
+class DataVersion(db.Model):
+    __tablename__ = 'data_version'
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+# ライブ配信（/api/stream）用のイベントログ
+# 書き込みと同じトランザクションで追記し、各ワーカーが id 順に読み出して接続中のクライアントへ配る。
+# id は SSE のイベントIDとして使うので、古い行を削除しても再利用されないよう AUTOINCREMENT にする。
+class StreamEvent(db.Model):
+    __tablename__ = 'stream_events'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    data = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    __table_args__ = {'sqlite_autoincrement': True}
+
+# 投稿URLのプレビュー（タイトル・説明）。正規化したURLごとに1行で、同じURLの投稿で共有する
+# 投稿時に status='pending' で作り、バックグラウンドで取得して 'ok' / 'error' にする（unfurl.py）
+class UrlPreview(db.Model):
+    __tablename__ = 'url_previews'
+    id = db.Column(db.Integer, primary_key=True)
+    url = db.Column(db.String(2048), nullable=False, unique=True)
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    title = db.Column(db.String(300))
+    description = db.Column(db.String(1000))
+    site_name = db.Column(db.String(200))
+    image = db.Column(db.String(2048))
+    error = db.Column(db.String(200))
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    fetched_at = db.Column(db.DateTime)
+
+# 全文検索用のFTS5仮想テーブル（rowid = posts.id）
+# 日本語を扱うため trigram トークナイザを使用し、本文とタグ名を索引する。
+# posts / post_tags へのトリガで同期するため、どの書き込み経路からでも整合する。
+SEARCH_INDEX_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(content, tags, tokenize='trigram')",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+        INSERT INTO posts_fts (rowid, content, tags) VALUES (new.id, new.content, '');
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF content ON posts BEGIN
+        UPDATE posts_fts SET content = new.content WHERE rowid = new.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+        DELETE FROM posts_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS post_tags_fts_insert AFTER INSERT ON post_tags BEGIN
+        UPDATE posts_fts SET tags = trim(tags || ' ' || (SELECT name FROM tags WHERE id = new.tag_id))
+        WHERE rowid = new.post_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS post_tags_fts_delete AFTER DELETE ON post_tags BEGIN
+        UPDATE posts_fts SET tags = coalesce((
+            SELECT group_concat(t.name, ' ') FROM post_tags AS pt
+            JOIN tags AS t ON t.id = pt.tag_id
+            WHERE pt.post_id = old.post_id
+        ), '')
+        WHERE rowid = old.post_id;
+    END""",
+]
+
+for statement in SEARCH_INDEX_DDL:
+    db.event.listen(db.metadata, 'after_create', db.DDL(statement).execute_if(dialect='sqlite'))
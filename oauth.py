@@ -0,0 +1,147 @@
+import base64
+import json
+import re
+import time
+from threading import Lock
+from urllib.parse import urlencode
+from email.utils import parsedate_to_datetime
+from flask import current_app
+
+# Google OAuth 2.0 / OpenID Connect のクライアント
+# アプリごとに1つ作って使い回す（設定・HTTP セッション・署名鍵のキャッシュを共有する）。
+#   - 認可コードとトークンの交換は、接続プールを持つ requests.Session で行う
+#   - ID トークンの署名検証に使う公開鍵は、Cache-Control の max-age（なければ Expires）の間キャッシュし、
+#     未知の kid（鍵の入れ替え）を見たときだけ期限前でも取り直す
+# 各エンドポイントは設定で差し替えられるので、ローカルに立てた OpenID プロバイダでも試せる。
+
+MAX_AGE = re.compile(r'max-age=(\d+)')
+
+class OAuthError(Exception):
+    pass
+
+def _cache_ttl(response, default):
+    # 応答ヘッダーから鍵の有効期間（秒）を求める
+    cache_control = response.headers.get('Cache-Control', '')
+    if 'no-store' in cache_control or 'no-cache' in cache_control:
+        return 0
+    match = MAX_AGE.search(cache_control)
+    if match:
+        return max(int(match.group(1)) - int(response.headers.get('Age', 0) or 0), 0)
+    if 'Expires' in response.headers:
+        try:
+            return max(parsedate_to_datetime(response.headers['Expires']).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return 0
+    return default
+
+def _token_header(token):
+    try:
+        segment = token.split('.', 1)[0]
+        return json.loads(base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4)))
+    except (ValueError, IndexError):
+        raise OAuthError('ID トークンの形式が不正です')
+
+class SigningKeys:
+    # 公開鍵（kid -> PEM）のキャッシュ
+    def __init__(self, http, url, timeout, default_ttl, min_refresh):
+        self.http = http
+        self.url = url
+        self.timeout = timeout
+        self.default_ttl = default_ttl
+        self.min_refresh = min_refresh
+        self.lock = Lock()
+        self.keys = {}
+        self.expires = 0.0
+        self.fetched = 0.0
+        self.fetches = 0
+
+    def fresh(self, kid):
+        return time.monotonic() < self.expires and (kid is None or kid in self.keys)
+
+    def get(self, kid):
+        if self.fresh(kid):
+            return self.keys
+        with self.lock:
+            # 待っている間に他のスレッドが取り直していれば、それを使う
+            if self.fresh(kid):
+                return self.keys
+            if time.monotonic() < self.expires and time.monotonic() - self.fetched < self.min_refresh:
+                # 取り直した直後の未知の kid では鍵サーバーに問い合わせ続けない
+                return self.keys
+            response = self.http.get(self.url, timeout=self.timeout)
+            response.raise_for_status()
+            self.keys = response.json()
+            self.fetched = time.monotonic()
+            self.expires = self.fetched + _cache_ttl(response, self.default_ttl)
+            self.fetches += 1
+            return self.keys
+
+class OAuthClient:
+    def __init__(self, config):
+        self.client_id = config['GOOGLE_CLIENT_ID']
+        self.client_secret = config['GOOGLE_CLIENT_SECRET']
+        self.redirect_uri = config['OAUTH_REDIRECT_URI']
+        self.auth_uri = config['GOOGLE_AUTH_URI']
+        self.token_uri = config['GOOGLE_TOKEN_URI']
+        self.issuers = tuple(config['GOOGLE_ISSUERS'])
+        self.scopes = tuple(config['OAUTH_SCOPES'])
+        self.timeout = config.get('OAUTH_HTTP_TIMEOUT', 10)
+
+        # requests の読み込みもワーカーの起動時ではなく初回のログイン時に行う
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=config.get('OAUTH_HTTP_POOL_SIZE', 10))
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
+        self.keys = SigningKeys(
+            self.http,
+            config['GOOGLE_CERTS_URI'],
+            self.timeout,
+            default_ttl=config.get('OAUTH_CERTS_DEFAULT_TTL', 3600),
+            min_refresh=config.get('OAUTH_CERTS_MIN_REFRESH', 60)
+        )
+
+    def authorization_url(self, state):
+        return f'{self.auth_uri}?' + urlencode({
+            'response_type': 'code',
+            'client_id': self.client_id,
+            'redirect_uri': self.redirect_uri,
+            'scope': ' '.join(self.scopes),
+            'state': state,
+            'access_type': 'offline',
+            'include_granted_scopes': 'true',
+        })
+
+    def exchange_code(self, code):
+        response = self.http.post(self.token_uri, data={
+            'grant_type': 'authorization_code',
+            'code': code,
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'redirect_uri': self.redirect_uri,
+        }, timeout=self.timeout)
+        if response.status_code != 200:
+            raise OAuthError(f'トークンの取得に失敗しました: {response.status_code} {response.text[:200]}')
+        token = response.json()
+        if 'id_token' not in token:
+            raise OAuthError('トークン応答に id_token がありません')
+        return token
+
+    def verify_id_token(self, id_token):
+        # google.oauth2.id_token.verify_oauth2_token と同じ検証（署名・有効期限・aud・iss）を、キャッシュした鍵で行う
+        from google.auth import jwt
+        keys = self.keys.get(_token_header(id_token).get('kid'))
+        try:
+            claims = jwt.decode(id_token, certs=keys, audience=self.client_id)
+        except ValueError as e:
+            raise OAuthError(f'ID トークンを検証できません: {e}')
+        if claims.get('iss') not in self.issuers:
+            raise OAuthError(f'ID トークンの発行者が不正です: {claims.get("iss")}')
+        return claims
+
+def oauth_client():
+    client = current_app.extensions.get('oauth_client')
+    if client is None:
+        client = current_app.extensions['oauth_client'] = OAuthClient(current_app.config)
+    return client
@@ -0,0 +1,96 @@
+from datetime import datetime
+from flask import request
+from models import db, Post
+
+# フィードのページネーション
+# ?before=<created_at>,<id> が指定された場合はキーセット（カーソル）方式で取得し、
+# COUNT(*) と OFFSET スキャンを行わない。空の before は先頭ページを意味する。
+# 指定がない場合は従来の ?page= によるオフセット方式。
+# 並び順は (日時, ID) の降順。既定は投稿の作成日時だが、お気に入り一覧のように
+# 別テーブルの日時で並べる場合は order_by で列を指定する。
+# タグ別一覧のように中間テーブルの索引（tag_id, post_id）だけで並べたい場合は paginate_by_id で
+# 投稿IDの降順に並べる。カーソルは ?before=<id>。posts.id は AUTOINCREMENT で、一括登録（ingest.py）と
+# ダミーデータの生成も過去の日時では追加しないので、IDの順は作成日時の順と一致する。
+
+class InvalidCursor(ValueError):
+    pass
+
+def make_cursor(item, order_by=(Post.created_at, Post.id)):
+    created_at_column, id_column = order_by
+    return f'{getattr(item, created_at_column.key).isoformat()},{getattr(item, id_column.key)}'
+
+def parse_cursor(value):
+    if not value:
+        return None
+    try:
+        created_at, item_id = value.rsplit(',', 1)
+        return datetime.fromisoformat(created_at), int(item_id)
+    except ValueError:
+        raise InvalidCursor(value)
+
+def parse_id_cursor(value):
+    # (日時, ID) のカーソルが渡された場合も ID の部分を使う
+    if not value:
+        return None
+    try:
+        return int(value.rsplit(',', 1)[-1])
+    except ValueError:
+        raise InvalidCursor(value)
+
+def paginate_feed(query, per_page=20, order_by=(Post.created_at, Post.id)):
+    created_at_column, id_column = order_by
+    query = query.order_by(created_at_column.desc(), id_column.desc())
+
+    if 'before' in request.args:
+        cursor = parse_cursor(request.args['before'])
+        if cursor:
+            created_at, item_id = cursor
+            # created_at <= ? で範囲を絞ってからタイブレークを評価する
+            query = query.filter(
+                created_at_column <= created_at,
+                db.or_(created_at_column < created_at, id_column < item_id)
+            )
+        # 1件多く取得して次ページの有無を判定
+        items = query.limit(per_page + 1).all()
+        has_next = len(items) > per_page
+        items = items[:per_page]
+        return items, {
+            'has_next': has_next,
+            'next_cursor': make_cursor(items[-1], order_by) if has_next else None
+        }
+
+    page = request.args.get('page', 1, type=int)
+    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    return pagination.items, {
+        'has_next': pagination.has_next,
+        'total': pagination.total,
+        'current_page': pagination.page,
+        'pages': pagination.pages,
+        'next_cursor': make_cursor(pagination.items[-1], order_by) if pagination.has_next else None
+    }
+
+def paginate_by_id(query, id_column, per_page=20):
+    # id_column の降順で並べる（取得する要素は id を持つモデル）
+    query = query.order_by(id_column.desc())
+
+    if 'before' in request.args:
+        before = parse_id_cursor(request.args['before'])
+        if before:
+            query = query.filter(id_column < before)
+        items = query.limit(per_page + 1).all()
+        has_next = len(items) > per_page
+        items = items[:per_page]
+        return items, {
+            'has_next': has_next,
+            'next_cursor': str(items[-1].id) if has_next else None
+        }
+
+    page = request.args.get('page', 1, type=int)
+    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    return pagination.items, {
+        'has_next': pagination.has_next,
+        'total': pagination.total,
+        'current_page': pagination.page,
+        'pages': pagination.pages,
+        'next_cursor': str(pagination.items[-1].id) if pagination.has_next else None
+    }
@@ -0,0 +1,200 @@
+import cProfile
+import json
+import os
+import pstats
+import random
+import re
+import time
+from datetime import datetime
+from flask import g, request
+from flask_login import current_user
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+# 本番での1リクエスト単位のプロファイル取得（cProfile）
+# 次のいずれかに当てはまるリクエストだけをプロファイラの下で実行し、PROFILE_DIR に書き出す。
+#   - X-Profile-Token ヘッダーに `flask profiles token` で発行した署名付きトークンがある
+#   - ?_profile=1 かつ PROFILE_ADMIN_EMAILS に含まれるユーザーでログインしている
+#   - PROFILE_SAMPLE_RATE で抽選され、処理時間が PROFILE_LATENCY_THRESHOLD_MS 以上だった
+# 該当しないリクエストではヘッダーとクエリ文字列を1回ずつ見るだけで、cProfile は有効にしない。
+# PROFILE_ENABLED を偽にするとフック自体を登録しない。
+# 出力は pstats（.prof）と speedscope（.speedscope.json）。
+
+TOKEN_HEADER = 'X-Profile-Token'
+TOKEN_SALT = 'atg-profile'
+ADMIN_PARAM = '_profile'
+
+SPEEDSCOPE_MIN_SHARE = 0.001
+OTHER_FRAME = ('~', 0, '(その他)')
+
+_FILENAME = re.compile(r'^(?P<time>\d{8}T\d{6}-\d{6})_(?P<method>[A-Z]+)_(?P<path>.*)_(?P<ms>\d+)ms\.prof$')
+
+def _serializer(app):
+    return URLSafeTimedSerializer(app.secret_key, salt=TOKEN_SALT)
+
+def make_token(app):
+    return _serializer(app).dumps('profile')
+
+def _valid_token(app, token):
+    try:
+        _serializer(app).loads(token, max_age=app.config.get('PROFILE_TOKEN_MAX_AGE', 3600))
+        return True
+    except BadSignature:
+        return False
+
+def _requested(app):
+    # 明示的な指定（署名付きヘッダー、または管理者のクエリパラメータ）
+    token = request.headers.get(TOKEN_HEADER)
+    if token:
+        return _valid_token(app, token)
+    if request.args.get(ADMIN_PARAM) == '1':
+        admins = app.config.get('PROFILE_ADMIN_EMAILS') or ()
+        return current_user.is_authenticated and current_user.email in admins
+    return False
+
+def profile_dir(app):
+    return app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+
+def speedscope(stats, name):
+    # pstats の呼び出し元グラフを木に展開し、各経路に自己時間を按分した speedscope の sampled 形式にする
+    # （関数ごとの時間を呼び出し元ごとの累積時間の比で分けるので、経路ごとの値は近似）
+    frames = []
+    frame_index = {}
+    def frame(func):
+        if func not in frame_index:
+            filename, line, function = func
+            frame_index[func] = len(frames)
+            frames.append({'name': function, 'file': filename, 'line': line})
+        return frame_index[func]
+
+    children = {}
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((func, edge[3]))
+
+    roots = [func for func, (cc, nc, tt, ct, callers) in stats.stats.items() if not callers]
+    # 呼び出しグラフを木にすると経路数が爆発するので、全体の SPEEDSCOPE_MIN_SHARE 未満の枝は打ち切る
+    min_time = sum(stats.stats[func][3] for func in roots) * SPEEDSCOPE_MIN_SHARE
+    samples = []
+    weights = []
+    def walk(func, scale, stack):
+        cc, nc, tt, ct, callers = stats.stats[func]
+        stack = stack + [frame(func)]
+        if tt * scale > 0:
+            samples.append(stack)
+            weights.append(tt * scale)
+        other = 0.0
+        for child, edge_ct in children.get(func, []):
+            child_ct = stats.stats[child][3]
+            child_scale = scale * min(edge_ct / child_ct, 1.0) if child_ct > 0 else 0
+            if frame_index.get(child) in stack:
+                continue  # 再帰の時間は呼び出し元の累積時間に含まれている
+            if child_ct * child_scale < min_time:
+                # 打ち切った枝の時間は「その他」にまとめて合計を保つ
+                other += child_ct * child_scale
+                continue
+            walk(child, child_scale, stack)
+        if other > 0:
+            samples.append(stack + [frame(OTHER_FRAME)])
+            weights.append(other)
+
+    for func in roots:
+        walk(func, 1.0, [])
+
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'seconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights,
+        }],
+        'exporter': 'atg profiler',
+    }
+
+def _save(app, profile, elapsed):
+    directory = profile_dir(app)
+    os.makedirs(directory, exist_ok=True)
+    slug = re.sub(r'[^A-Za-z0-9]+', '-', request.path).strip('-')[:80] or 'root'
+    stem = f'{datetime.utcnow().strftime("%Y%m%dT%H%M%S-%f")}_{request.method}_{slug}_{int(elapsed * 1000)}ms'
+
+    formats = app.config.get('PROFILE_FORMATS', ('pstats', 'speedscope'))
+    path = os.path.join(directory, stem + '.prof')
+    profile.dump_stats(path)
+    if 'speedscope' in formats:
+        stats = pstats.Stats(path)
+        with open(os.path.join(directory, stem + '.speedscope.json'), 'w') as f:
+            json.dump(speedscope(stats, f'{request.method} {request.full_path}'), f)
+    if 'pstats' not in formats:
+        os.remove(path)
+
+    _prune(directory, app.config.get('PROFILE_MAX_FILES', 200))
+    return stem
+
+def _prune(directory, max_files):
+    # 古いものから消して、ディスクを使い切らないようにする
+    stems = sorted({name.split('.', 1)[0] for name in os.listdir(directory)})
+    for stem in stems[:max(0, len(stems) - max_files)]:
+        for suffix in ('.prof', '.speedscope.json'):
+            path = os.path.join(directory, stem + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+
+def list_profiles(app):
+    directory = profile_dir(app)
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        match = _FILENAME.match(name)
+        if match:
+            profiles.append({
+                'name': name,
+                'path': os.path.join(directory, name),
+                'captured_at': datetime.strptime(match['time'], '%Y%m%dT%H%M%S-%f'),
+                'method': match['method'],
+                'path_slug': match['path'],
+                'duration_ms': int(match['ms']),
+            })
+    return profiles
+
+def init_profiler(app):
+    if not app.config.get('PROFILE_ENABLED', False):
+        return
+    sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0.0)
+    threshold = app.config.get('PROFILE_LATENCY_THRESHOLD_MS', 500) / 1000
+
+    @app.before_request
+    def start_profile():
+        requested = _requested(app)
+        if not requested and not (sample_rate and random.random() < sample_rate):
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 別のスレッドでプロファイル中（同時に有効にできるのは1つ）
+            return
+        g.profile = (profile, requested, time.perf_counter())
+
+    @app.after_request
+    def finish_profile(response):
+        if 'profile' not in g:
+            return response
+        profile, requested, started = g.pop('profile')
+        profile.disable()
+        elapsed = time.perf_counter() - started
+        if requested or elapsed >= threshold:
+            stem = _save(app, profile, elapsed)
+            if requested:
+                response.headers['X-Profile-Id'] = stem
+        return response
+
+    @app.teardown_request
+    def stop_profile(exc):
+        # 例外で after_request を通らなかった場合も必ず止める
+        if 'profile' in g:
+            g.pop('profile')[0].disable()
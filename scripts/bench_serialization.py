@@ -0,0 +1,80 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import time
+
+# 一覧レスポンスのエンコード時間と転送量の計測
+#   python scripts/bench_serialization.py --database instance/bench.db
+#   python scripts/bench_serialization.py --database instance/bench.db --pages 500 --output serialization.json
+# 新しい投稿から --per-page 件ずつ --pages ページ分をシリアライズしておき、エンコーダごとに
+# 1ページあたりのエンコード時間（--repeat 回の最良値）と、無圧縮・gzip・brotli のバイト数と圧縮時間を出す。
+# 「flask.json」は従来の経路（シリアライザでの isoformat() と Flask 2.0 の jsonify と同じ設定の標準 json）。
+
+def best_of(repeat, f):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = f()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description='一覧レスポンスのエンコード時間と転送量を計測する')
+    parser.add_argument('--database', required=True, help='計測に使う SQLite ファイル（generate_dummy_data.py で生成）')
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--per-page', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='結果を JSON で保存するパス')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(args.database)}'
+    from flask import json as flask_json
+    from app import app
+    from models import db
+    from serializers import load_posts, serialize_posts
+    from json_provider import BACKENDS
+    from compression import ENCODINGS, compress
+
+    with app.test_request_context():
+        ids = [post_id for post_id, in db.session.execute(
+            db.text('SELECT id FROM posts ORDER BY id DESC LIMIT :n'), {'n': args.pages * args.per_page}
+        )]
+        pages = [serialize_posts(load_posts(ids[i:i + args.per_page])) for i in range(0, len(ids), args.per_page)]
+        if not pages:
+            raise SystemExit('投稿がありません。先に scripts/generate_dummy_data.py でデータを生成してください')
+
+        def flask_dumps(page):
+            posts = [dict(post, created_at=post['created_at'].isoformat()) for post in page]
+            return flask_json.dumps({'posts': posts}, separators=(',', ':')).encode('utf-8')
+
+        encoders = {'flask.json': flask_dumps}
+        encoders.update({name: (lambda dumps: lambda page: dumps({'posts': page}))(dumps) for name, dumps in BACKENDS.items()})
+
+        report = {'pages': len(pages), 'per_page': args.per_page, 'encoders': {}}
+        for name, encode in encoders.items():
+            elapsed, bodies = best_of(args.repeat, lambda: [encode(page) for page in pages])
+            result = {
+                'encode_us': round(elapsed / len(pages) * 1e6, 1),
+                'bytes': round(sum(map(len, bodies)) / len(bodies)),
+            }
+            for encoding in ENCODINGS:
+                elapsed, compressed = best_of(args.repeat, lambda: [compress(body, encoding, app.config) for body in bodies])
+                result[f'{encoding}_bytes'] = round(sum(map(len, compressed)) / len(compressed))
+                result[f'{encoding}_us'] = round(elapsed / len(pages) * 1e6, 1)
+            report['encoders'][name] = result
+
+    columns = ['encode_us', 'bytes'] + [f'{encoding}_{unit}' for encoding in ENCODINGS for unit in ('bytes', 'us')]
+    print(f"{report['pages']} ページ × {report['per_page']} 件（1ページあたりの平均）")
+    print(f"{'':12}" + ''.join(f'{column:>12}' for column in columns))
+    for name, result in report['encoders'].items():
+        print(f'{name:12}' + ''.join(f'{result[column]:>12}' for column in columns))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
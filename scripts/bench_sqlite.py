@@ -0,0 +1,138 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import multiprocessing
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from models import db, configure_sqlite
+from config import ProductionConfig
+
+# SQLite の設定別に、複数プロセスからの読み書き混在スループットを計測する
+#   default    : SQLAlchemy / pysqlite の既定（ロールバックジャーナル、接続プールなし）
+#   production : ProductionConfig の PRAGMA とエンジン設定
+# gunicorn の複数ワーカーを模して、各プロセスがタイムラインの読み込みと投稿の書き込みを繰り返す。
+
+FEED_QUERY = text('''
+    SELECT posts.id, posts.content, posts.created_at, users.name
+    FROM posts JOIN users ON users.id = posts.user_id
+    ORDER BY posts.created_at DESC, posts.id DESC
+    LIMIT 20
+''')
+
+INSERT_POST = text('''
+    INSERT INTO posts (content, url, user_id, created_at, favorite_count, replies_count)
+    VALUES (:content, :url, :user_id, :created_at, 0, 0)
+''')
+
+FAVORITE_POST = text('''
+    UPDATE posts SET favorite_count = favorite_count + 1 WHERE id = :post_id
+''')
+
+def make_engine(url, profile):
+    if profile == 'production':
+        engine = create_engine(url, **ProductionConfig.SQLALCHEMY_ENGINE_OPTIONS)
+        configure_sqlite(engine, ProductionConfig.SQLITE_PRAGMAS)
+        return engine
+    return create_engine(url)
+
+def prepare(path, posts):
+    engine = create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(engine)
+    base_time = datetime.utcnow() - timedelta(days=30)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, name) VALUES (1, 'bench')"))
+        conn.execute(INSERT_POST, [{
+            'content': f'ベンチマーク投稿 {i}',
+            'url': f'https://chat.openai.com/share/bench-{i}',
+            'user_id': 1,
+            'created_at': base_time + timedelta(seconds=i),
+        } for i in range(posts)])
+    engine.dispose()
+
+def worker(url, profile, duration, write_ratio, seed, results):
+    random.seed(seed)
+    engine = make_engine(url, profile)
+    reads = writes = locked = 0
+    latencies = []
+    deadline = time.perf_counter() + duration
+
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            if random.random() < write_ratio:
+                with engine.begin() as conn:
+                    conn.execute(INSERT_POST, {
+                        'content': 'ベンチマーク書き込み',
+                        'url': 'https://chat.openai.com/share/bench',
+                        'user_id': 1,
+                        'created_at': datetime.utcnow(),
+                    })
+                    conn.execute(FAVORITE_POST, {'post_id': random.randint(1, 1000)})
+                writes += 1
+            else:
+                with engine.connect() as conn:
+                    conn.execute(FEED_QUERY).fetchall()
+                reads += 1
+        except OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            locked += 1
+        latencies.append(time.perf_counter() - started)
+
+    engine.dispose()
+    results.put({'reads': reads, 'writes': writes, 'locked': locked, 'latencies': latencies})
+
+def run(profile, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        prepare(path, args.posts)
+        url = f'sqlite:///{path}'
+
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=worker, args=(url, profile, args.duration, args.write_ratio, i, results))
+            for i in range(args.workers)
+        ]
+        for process in processes:
+            process.start()
+        outputs = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    latencies = sorted(latency for output in outputs for latency in output['latencies'])
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 3) if latencies else None
+
+    reads = sum(output['reads'] for output in outputs)
+    writes = sum(output['writes'] for output in outputs)
+    return {
+        'profile': profile,
+        'ops_per_sec': round((reads + writes) / args.duration, 1),
+        'reads': reads,
+        'writes': writes,
+        'locked_errors': sum(output['locked'] for output in outputs),
+        'p50_ms': percentile(0.50),
+        'p99_ms': percentile(0.99),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite の設定別の読み書き混在ベンチマーク')
+    parser.add_argument('--workers', type=int, default=3, help='プロセス数（gunicorn のワーカー数に相当）')
+    parser.add_argument('--duration', type=float, default=5.0, help='計測時間（秒）')
+    parser.add_argument('--write-ratio', type=float, default=0.1, help='書き込みの割合')
+    parser.add_argument('--posts', type=int, default=10000, help='事前に作成する投稿数')
+    parser.add_argument('--profile', choices=['default', 'production', 'both'], default='both')
+    args = parser.parse_args()
+
+    profiles = ['default', 'production'] if args.profile == 'both' else [args.profile]
+    print(json.dumps([run(profile, args) for profile in profiles], indent=2))
+
+if __name__ == '__main__':
+    main()
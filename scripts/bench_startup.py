@@ -0,0 +1,98 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import statistics
+import subprocess
+import time
+from collections import defaultdict
+
+# ワーカー起動時のインポート時間の計測（python -X importtime）
+#   python scripts/bench_startup.py
+#   python scripts/bench_startup.py --code "from app import create_app" --repeat 20 --output startup.json
+# 新しいインタプリタで --code を --repeat 回実行し、全体の所要時間の中央値と、
+# 最後の実行の importtime をトップレベルのパッケージ別（自己時間の合計）に集計して表示する。
+# --watch に挙げたモジュール（既定は Google OAuth と alembic）が読み込まれたかも表示する。
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WATCH = ['google_auth_oauthlib', 'google.oauth2', 'google.auth.transport.requests', 'alembic', 'flask_migrate']
+
+def parse_importtime(stderr):
+    # "import time: self [us] | cumulative | imported package" の行を (モジュール, 自己時間, 累積時間) にする
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+def run_once(code, env):
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise SystemExit(f'読み込みに失敗しました:\n{result.stderr[-2000:]}')
+    return elapsed, parse_importtime(result.stderr)
+
+def summarize(modules, top):
+    packages = defaultdict(int)
+    for name, self_us, cumulative_us in modules:
+        packages[name.split('.')[0]] += self_us
+    total_us = sum(packages.values())
+    imported = {name for name, self_us, cumulative_us in modules}
+    return {
+        'import_ms': round(total_us / 1000, 1),
+        'modules': len(modules),
+        'packages': [
+            {'package': package, 'self_ms': round(self_us / 1000, 1), 'share': round(self_us / total_us, 3)}
+            for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]
+        ],
+        'watched': {name: name in imported for name in WATCH},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='アプリ読み込み時のインポート時間を計測する')
+    parser.add_argument('--code', default='from app import app', help='計測する Python コード')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--top', type=int, default=15, help='表示するパッケージ数')
+    parser.add_argument('--output', help='結果を JSON で保存するパス')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # 読み込みだけを計測する（ログ出力やプロファイル用のフックは影響しない）
+    env.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+
+    # 1回目は .pyc の作成を含むので捨てる
+    run_once(args.code, env)
+    timings = []
+    for _ in range(args.repeat):
+        elapsed, modules = run_once(args.code, env)
+        timings.append(elapsed)
+
+    report = {
+        'code': args.code,
+        'repeat': args.repeat,
+        'wall_ms_median': round(statistics.median(timings) * 1000, 1),
+        'wall_ms_min': round(min(timings) * 1000, 1),
+        **summarize(modules, args.top),
+    }
+
+    print(f"{args.code}: 中央値 {report['wall_ms_median']} ms（最小 {report['wall_ms_min']} ms、"
+          f"インポート {report['import_ms']} ms、{report['modules']} モジュール）")
+    for package in report['packages']:
+        print(f"  {package['self_ms']:8.1f} ms  {package['share']:6.1%}  {package['package']}")
+    for name, loaded in report['watched'].items():
+        print(f"  {'読み込み済み' if loaded else '未読み込み':6}  {name}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import random
+import re
+import socket
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# API エンドポイントのベンチマーク
+#   python scripts/generate_dummy_data.py --reset --posts 1000000 ...   # 先にデータを用意する
+#   python scripts/benchmark.py --database instance/bench.db --output baseline.json
+#   python scripts/benchmark.py --database instance/bench.db --compare baseline.json
+#
+# 既定では WSGI アプリをプロセス内のテストクライアントで直接叩く（SQL のクエリ数も数える）。
+# HTTP 越しの場合のクエリ数は Server-Timing ヘッダーから読む（サンプリングされたリクエストのみ）。
+# --gunicorn でローカルに gunicorn を起動して HTTP 越しに、--url で起動済みのサーバーに対して計測する。
+# エンドポイントごとに、スループット・レイテンシのパーセンタイル・1リクエストあたりのクエリ数と
+# 転送バイト数（--accept-encoding で圧縮を指定）を JSON で出力する。
+# --compare では保存済みの結果と比べ、しきい値を超えて悪化したエンドポイントがあれば終了コード1で終わる。
+
+# 書き込み系はデータを変えるので読み込み系の後に流す
+SCENARIOS = [
+    'timeline',
+    'timeline_page',
+    'tag',
+    'user',
+    'replies',
+    'favorites',
+    'popular_tags',
+    'search',
+    'create_post',
+    'create_reply',
+    'toggle_favorite',
+]
+
+SEARCH_TERMS = ['人生の意味', '未来の技術', '宇宙の謎', '人間の本質', '創造性', 'ChatGPT']
+
+# HTTP 越しの計測では、サーバーが返す Server-Timing からクエリ数を読む
+SERVER_TIMING_QUERIES = re.compile(r'sql;[^,]*desc="(\d+) queries"')
+
+# 比較時の悪化判定。クエリ数はパラメータによる揺れ（空ページなど）を許容する
+QUERY_TOLERANCE = 0.5
+
+def make_request(name, rng, dataset):
+    # (メソッド, パス, JSON ボディ) を返す
+    if name == 'timeline':
+        return 'GET', '/api/posts?before=', None
+    if name == 'timeline_page':
+        return 'GET', f'/api/posts?page={rng.randint(1, 50)}', None
+    if name == 'tag':
+        return 'GET', f"/api/posts/tag/{rng.choice(dataset['tags'])}?before=", None
+    if name == 'user':
+        return 'GET', f"/api/posts/user/{rng.choice(dataset['users'])}?before=", None
+    if name == 'replies':
+        return 'GET', f"/api/posts/{rng.choice(dataset['threads'])}/replies?before=", None
+    if name == 'favorites':
+        return 'GET', '/api/posts/favorites?before=', None
+    if name == 'popular_tags':
+        return 'GET', f"/api/tags/popular?window={rng.choice(['24h', '7d', 'all'])}", None
+    if name == 'search':
+        return 'GET', f'/api/search?q={rng.choice(SEARCH_TERMS)}', None
+    if name == 'create_post':
+        return 'POST', '/api/posts', {
+            'content': 'ベンチマーク投稿',
+            'url': f'https://chat.openai.com/share/bench-{rng.getrandbits(48):x}',
+            'tags': rng.sample(dataset['tags'], min(2, len(dataset['tags']))),
+        }
+    if name == 'create_reply':
+        return 'POST', f"/api/posts/{rng.choice(dataset['threads'])}/replies", {'content': 'ベンチマーク返信'}
+    if name == 'toggle_favorite':
+        return 'POST', f"/api/posts/{rng.choice(dataset['posts'])}/favorite", None
+    raise ValueError(name)
+
+def load_dataset(app, sample_size):
+    # リクエストのパラメータに使う ID・タグ名をデータベースから抜き出しておく
+    from models import db
+    with app.app_context():
+        def ids(sql):
+            return [row[0] for row in db.session.execute(db.text(sql), {'n': sample_size})]
+        dataset = {
+            'posts': ids('SELECT id FROM posts ORDER BY random() LIMIT :n'),
+            'threads': ids('SELECT id FROM posts WHERE replies_count > 0 ORDER BY random() LIMIT :n'),
+            'users': ids('SELECT DISTINCT user_id FROM posts ORDER BY random() LIMIT :n'),
+            'tags': ids('SELECT name FROM tags ORDER BY post_count DESC LIMIT :n'),
+            # お気に入り一覧が空にならないよう、最もお気に入りの多いユーザーでログインする
+            'login_user': db.session.execute(db.text(
+                'SELECT user_id FROM favorites GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1'
+            )).scalar(),
+        }
+    if not dataset['posts']:
+        raise SystemExit('投稿がありません。先に scripts/generate_dummy_data.py でデータを生成してください')
+    dataset['threads'] = dataset['threads'] or dataset['posts']
+    dataset['tags'] = dataset['tags'] or ['ベンチマーク']
+    dataset['login_user'] = dataset['login_user'] or dataset['users'][0]
+    return dataset
+
+class QueryCounter:
+    # WSGI モードのみ。リクエストを処理したスレッドごとにクエリ数を数える
+    def __init__(self, engine):
+        self.local = threading.local()
+        from sqlalchemy import event
+        event.listen(engine, 'before_cursor_execute', self.count)
+
+    def count(self, *args):
+        self.local.queries = getattr(self.local, 'queries', 0) + 1
+
+    def reset(self):
+        self.local.queries = 0
+
+    def get(self):
+        return getattr(self.local, 'queries', 0)
+
+class WSGIClient:
+    def __init__(self, app, user_id, counter, accept_encoding):
+        self.client = app.test_client()
+        self.counter = counter
+        self.headers = {'Accept-Encoding': accept_encoding}
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+
+    def request(self, method, path, body):
+        self.counter.reset()
+        response = self.client.open(path, method=method, json=body, headers=self.headers)
+        return response.status_code, self.counter.get(), len(response.get_data())
+
+class HTTPClient:
+    def __init__(self, app, user_id, base_url, accept_encoding):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        self.session.headers['Accept-Encoding'] = accept_encoding
+        # サーバーと同じ SECRET_KEY で署名したセッションクッキーでログイン状態にする
+        serializer = app.session_interface.get_signing_serializer(app)
+        self.session.cookies.set(app.session_cookie_name, serializer.dumps({'_user_id': str(user_id), '_fresh': True}))
+
+    def request(self, method, path, body):
+        response = self.session.request(method, self.base_url + path, json=body)
+        match = SERVER_TIMING_QUERIES.search(response.headers.get('Server-Timing', ''))
+        # requests は本文を展開するので、転送量は Content-Length から読む
+        size = int(response.headers.get('Content-Length', len(response.content)))
+        return response.status_code, int(match.group(1)) if match else None, size
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 3)
+
+def run_scenario(name, make_client, dataset, args):
+    def worker(index, count):
+        rng = random.Random(f'{args.seed}-{name}-{index}')
+        client = make_client()
+        for _ in range(args.warmup if index == 0 else 0):
+            client.request(*make_request(name, rng, dataset))
+        samples = []
+        for _ in range(count):
+            method, path, body = make_request(name, rng, dataset)
+            started = time.perf_counter()
+            status, queries, size = client.request(method, path, body)
+            samples.append((time.perf_counter() - started, status, queries, size))
+        return samples
+
+    counts = [args.requests // args.concurrency + (i < args.requests % args.concurrency) for i in range(args.concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        samples = [s for result in executor.map(worker, range(args.concurrency), counts) for s in result]
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for latency, status, queries, size in samples]
+    queries = [queries for latency, status, queries, size in samples if queries is not None]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for latency, status, queries, size in samples if status >= 400),
+        'throughput_rps': round(len(samples) / elapsed, 1),
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'queries_mean': round(sum(queries) / len(queries), 2) if queries else None,
+        'queries_max': max(queries) if queries else None,
+        'bytes_mean': round(sum(size for latency, status, queries, size in samples) / len(samples)),
+    }
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_gunicorn(args, env):
+    port = free_port()
+    process = subprocess.Popen(
+        ['gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers), 'app:app'],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit('gunicorn の起動に失敗しました')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit('gunicorn が起動しませんでした')
+
+def run(args):
+    # app は DATABASE_URL を読んで初期化されるので、環境変数を設定してから読み込む
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(args.database)}'
+    if args.no_response_cache:
+        os.environ['RESPONSE_CACHE_ENABLED'] = '0'
+    from app import app
+    from models import db
+
+    dataset = load_dataset(app, args.sample_size)
+    user_id = dataset['login_user']
+    server = None
+    if args.gunicorn:
+        server, base_url = start_gunicorn(args, dict(os.environ))
+    else:
+        base_url = args.url
+
+    try:
+        if base_url:
+            make_client = lambda: HTTPClient(app, user_id, base_url, args.accept_encoding)
+        else:
+            with app.app_context():
+                counter = QueryCounter(db.engine)
+            make_client = lambda: WSGIClient(app, user_id, counter, args.accept_encoding)
+
+        results = {}
+        for name in args.scenarios:
+            results[name] = run_scenario(name, make_client, dataset, args)
+            print(f"{name}: {results[name]['throughput_rps']} req/s, p95 {results[name]['p95_ms']} ms, "
+                  f"{results[name]['bytes_mean']} bytes", file=sys.stderr)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    return {
+        'meta': {
+            'started_at': datetime.utcnow().isoformat(),
+            'target': 'gunicorn' if args.gunicorn else base_url or 'wsgi',
+            'database': args.database,
+            'posts': len(dataset['posts']),
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'response_cache': not args.no_response_cache,
+            'accept_encoding': args.accept_encoding,
+        },
+        'endpoints': results,
+    }
+
+def compare(result, baseline, threshold):
+    # p95 とスループットは相対しきい値、クエリ数は QUERY_TOLERANCE を超えた増加で悪化とみなす
+    regressions = []
+    for name, current in result['endpoints'].items():
+        base = baseline['endpoints'].get(name)
+        if not base:
+            continue
+        if base['p95_ms'] and current['p95_ms'] > base['p95_ms'] * (1 + threshold):
+            regressions.append(f"{name}: p95 {base['p95_ms']} ms -> {current['p95_ms']} ms")
+        if current['throughput_rps'] < base['throughput_rps'] * (1 - threshold):
+            regressions.append(f"{name}: throughput {base['throughput_rps']} -> {current['throughput_rps']} req/s")
+        if base['queries_mean'] is not None and current['queries_mean'] is not None \
+                and current['queries_mean'] > base['queries_mean'] + QUERY_TOLERANCE:
+            regressions.append(f"{name}: queries {base['queries_mean']} -> {current['queries_mean']}")
+        if current['errors'] > base['errors']:
+            regressions.append(f"{name}: errors {base['errors']} -> {current['errors']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='API エンドポイントのベンチマーク')
+    parser.add_argument('--database', required=True, help='計測に使う SQLite ファイル（generate_dummy_data.py で生成）')
+    parser.add_argument('--scenarios', type=lambda s: s.split(','), default=SCENARIOS,
+                        help=f"カンマ区切り（既定: {','.join(SCENARIOS)}）")
+    parser.add_argument('--requests', type=int, default=500, help='エンドポイントごとのリクエスト数')
+    parser.add_argument('--concurrency', type=int, default=4, help='同時に投げるスレッド数')
+    parser.add_argument('--warmup', type=int, default=20, help='計測前に捨てるリクエスト数')
+    parser.add_argument('--sample-size', type=int, default=1000, help='パラメータに使う ID の抽出数')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-response-cache', action='store_true', help='レスポンスキャッシュを無効にして計測する')
+    parser.add_argument('--accept-encoding', default='br, gzip', help='送る Accept-Encoding（identity で無圧縮）')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--gunicorn', action='store_true', help='ローカルに gunicorn を起動して HTTP 越しに計測する')
+    target.add_argument('--url', help='起動済みサーバーのベース URL（--database は同じファイルを指定する）')
+    parser.add_argument('--workers', type=int, default=3, help='--gunicorn のワーカー数')
+    parser.add_argument('--output', help='結果の JSON を保存するファイル')
+    parser.add_argument('--compare', help='比較するベースラインの JSON')
+    parser.add_argument('--threshold', type=float, default=0.2, help='悪化とみなす割合（0.2 = 20%%）')
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"不明なシナリオ: {', '.join(sorted(unknown))}")
+
+    result = run(args)
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
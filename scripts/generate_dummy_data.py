@@ -2,149 +2,282 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app import app, db
-from models import User, Post, Tag, Favorite
-from datetime import datetime, timedelta
+import argparse
 import random
+import time
+from array import array
+from datetime import datetime, timedelta
+from itertools import accumulate
 from faker import Faker
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app import app, db
+from models import User, Post, Favorite, post_tags, next_post_id
+from cache import bump_generation
+from ingest import resolve_tags
+from tag_stats import record_bulk_tags
+from urls import try_url_hash
+from search import drop_search_triggers, create_search_triggers, index_posts
 
-fake = Faker(['ja_JP'])
+# ベンチマーク用のダミーデータ生成
+#   python scripts/generate_dummy_data.py --posts 1000000 --replies 500000 --favorites 3000000
+# 同じ --seed と --until なら同じデータになる。既定では既存のデータベースに追記し、
+# --reset を指定したときだけ作り直す。
+# 行は Core の executemany でまとめて挿入する。返信数・お気に入り数は生成中に数えておいて
+# 最後にまとめて書き込み、タグ集計はバッチごとに加算する。検索索引は投入中はトリガを外し、
+# 最後に追加分だけ登録する（既存の行を数え直さないので、大きなデータベースへの追記でも速い）。
+#
+# 偏りの付け方
+#   タグ・ユーザーの活動量・投稿の人気 : 順位 r に 1/r^s の重みを付けたべき乗分布
+#   返信先 : 直近の投稿ほど選ばれやすく（パレート分布で遡る件数を決める）、返信への返信も作る
 
-def generate_dummy_data():
-    with app.app_context():
-        # データベースをクリア
-        db.drop_all()
-        db.create_all()
-        
-        print("Generating users...")
-        users = []
-        for i in range(10):
-            user = User(
-                google_id=f"dummy_google_id_{i}",
-                email=f"user{i}@example.com",
-                name=fake.name(),
-                profile_pic=f"https://api.dicebear.com/6.x/avataaars/svg?seed=user{i}",
-                created_at=fake.date_time_between(start_date='-30d', end_date='now')
-            )
-            users.append(user)
-            db.session.add(user)
-        db.session.commit()
-        
-        print("Generating tags...")
-        tags = []
-        tag_names = [
-            "面白い", "驚き", "感動", "学び", "技術", "アイデア",
-            "哲学", "ユーモア", "考察", "発見", "質問", "回答",
-            "議論", "雑談", "アドバイス", "経験談"
-        ]
-        for tag_name in tag_names:
-            tag = Tag(name=tag_name)
-            tags.append(tag)
-            db.session.add(tag)
+TAG_NAMES = [
+    "面白い", "驚き", "感動", "学び", "技術", "アイデア",
+    "哲学", "ユーモア", "考察", "発見", "質問", "回答",
+    "議論", "雑談", "アドバイス", "経験談", "プログラミング", "AI", "未来"
+]
+
+CONVERSATION_STARTERS = [
+    "ChatGPTに「{0}」について聞いてみました",
+    "AIと「{0}」の話で盛り上がりました",
+    "ChatGPTの「{0}」に関する回答が興味深かった",
+    "AIと「{0}」について議論してみた結果",
+    "ChatGPTに「{0}」を教えてもらいました"
+]
+
+TOPICS = [
+    "人生の意味", "幸せの定義", "理想の社会", "未来の技術",
+    "宇宙の謎", "人間の本質", "創造性", "感情", "意識",
+    "芸術", "音楽", "文学", "科学", "哲学", "歴史",
+    "教育", "環境", "経済", "政治", "文化"
+]
+
+REPLY_TEMPLATES = [
+    "確かに{0}は興味深い視点ですね。",
+    "私も{0}について考えていました。",
+    "この{0}という考え方は新鮮です。",
+    "{0}についての議論は大切だと思います。",
+    "なるほど、{0}はそういう見方もできるんですね。"
+]
+
+def zipf_weights(n, exponent):
+    # 順位 1..n に 1/r^s の重みを付けた累積重み（random.choices の cum_weights 用）
+    return list(accumulate(1.0 / (rank ** exponent) for rank in range(1, n + 1)))
+
+def next_id(column):
+    return (db.session.query(db.func.max(column)).scalar() or 0) + 1
+
+def generate_users(rng, fake, count, created_from, until):
+    first_id = next_id(User.id)
+    span = (until - created_from).total_seconds()
+    rows = [{
+        'id': user_id,
+        'google_id': f'dummy_google_id_{user_id}',
+        'email': f'user{user_id}@example.com',
+        'name': fake.name(),
+        'profile_pic': f'https://api.dicebear.com/6.x/avataaars/svg?seed=user{user_id}',
+        'created_at': created_from + timedelta(seconds=rng.random() * span),
+    } for user_id in range(first_id, first_id + count)]
+    db.session.execute(User.__table__.insert(), rows)
+    db.session.commit()
+    return list(range(first_id, first_id + count))
+
+def generate_tags(count):
+    names = TAG_NAMES[:count] + [f'タグ{i}' for i in range(len(TAG_NAMES) + 1, count + 1)]
+    tag_ids = resolve_tags(names)
+    db.session.commit()
+    return [tag_ids[name] for name in names]
+
+def generate_posts(rng, args, user_ids, tag_ids, created_from, until):
+    # 投稿と返信を時系列順に並べて生成するので、ID順と作成日時順が一致し、返信は必ず返信先より新しい
+    total = args.posts + args.replies
+    kinds = bytearray(args.posts) + bytearray(b'\x01' * args.replies)  # 1 = 返信
+    rng.shuffle(kinds)
+    if kinds and kinds[0]:
+        # 先頭は返信先がないので通常の投稿と入れ替える
+        kinds[kinds.index(0)] = 1
+        kinds[0] = 0
+
+    first_id = next_post_id()
+    step = (until - created_from).total_seconds() / max(total, 1)
+    user_weights = zipf_weights(len(user_ids), args.user_skew)
+    tag_weights = zipf_weights(len(tag_ids), args.tag_skew)
+    # スレッドの起点（URL と話題を返信に引き継ぐ）
+    roots = array('I')
+    topics = array('B')
+    created = []
+    replies_count = array('I', bytes(4 * total))
+
+    for start in range(0, total, args.batch_size):
+        post_rows = []
+        post_tag_rows = []
+        tag_entries = []
+        for i in range(start, min(start + args.batch_size, total)):
+            post_id = first_id + i
+            created_at = created_from + timedelta(seconds=(i + rng.random()) * step)
+            if kinds[i]:
+                parent = max(0, i - int(rng.paretovariate(args.reply_recency)))
+                root = roots[parent]
+                topic = topics[root]
+                reply_to_id = first_id + parent
+                replies_count[parent] += 1
+                content = rng.choice(REPLY_TEMPLATES).format(TOPICS[topic])
+                tag_count = rng.randint(0, 2)
+            else:
+                root = i
+                topic = rng.randrange(len(TOPICS))
+                reply_to_id = None
+                content = rng.choice(CONVERSATION_STARTERS).format(TOPICS[topic])
+                tag_count = rng.randint(1, 3)
+            roots.append(root)
+            topics.append(topic)
+            created.append(created_at)
+
+            url = f'https://chat.openai.com/share/dummy-{args.seed}-{first_id + root}'
+            post_rows.append({
+                'id': post_id,
+                'content': content,
+                'url': url,
+                'url_hash': try_url_hash(url),
+                'user_id': rng.choices(user_ids, cum_weights=user_weights)[0],
+                'created_at': created_at,
+                'ip_address': f'{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}',
+                'reply_to_id': reply_to_id,
+                'favorite_count': 0,
+                'replies_count': 0,
+            })
+            ids = set(rng.choices(tag_ids, cum_weights=tag_weights, k=tag_count))
+            post_tag_rows.extend({'post_id': post_id, 'tag_id': tag_id} for tag_id in ids)
+            tag_entries.append((ids, created_at))
+
+        db.session.execute(Post.__table__.insert(), post_rows)
+        if post_tag_rows:
+            db.session.execute(post_tags.insert(), post_tag_rows)
+        record_bulk_tags(tag_entries)
         db.session.commit()
-        
-        print("Generating posts...")
-        posts = []
-        conversation_starters = [
-            "ChatGPTに「{0}」について聞いてみました",
-            "AIと{0}の話で盛り上がりました",
-            "ChatGPTの{0}に関する回答が興味深かった",
-            "AIと{0}について議論してみた結果",
-            "ChatGPTに{0}を教えてもらいました"
-        ]
-        topics = [
-            "人生の意味", "幸せの定義", "理想の社会", "未来の技術",
-            "宇宙の謎", "人間の本質", "創造性", "感情", "意識",
-            "芸術", "音楽", "文学", "科学", "哲学", "歴史",
-            "教育", "環境", "経済", "政治", "文化"
-        ]
-        
-        # メインの投稿を生成
-        for i in range(100):
-            topic = random.choice(topics)
-            template = random.choice(conversation_starters)
-            content = template.format(topic)
-            user = random.choice(users)
-            
-            post = Post(
-                content=content,
-                url=f"https://chat.openai.com/share/dummy-conversation-{i}",
-                user_id=user.id,
-                created_at=fake.date_time_between(start_date='-30d', end_date='now'),
-                ip_address=fake.ipv4(),
-                favorite_count=0
-            )
-            
-            # ランダムにタグを付ける（1-3個）
-            post_tags = random.sample(tags, random.randint(1, 3))
-            for tag in post_tags:
-                post.tags.append(tag)
-            
-            posts.append(post)
-            db.session.add(post)
+        print(f'  posts: {min(start + args.batch_size, total)}/{total}')
+
+    return first_id, created, replies_count
+
+def generate_favorites(rng, args, user_ids, first_post_id, created, until):
+    if not created:
+        return array('I')
+    # 人気の偏りは投稿の新旧と無関係にするため、順位をシャッフルした投稿に割り当てる
+    popularity = array('I', range(len(created)))
+    rng.shuffle(popularity)
+    post_weights = zipf_weights(len(popularity), args.post_skew)
+    user_weights = zipf_weights(len(user_ids), args.user_skew)
+    seen = set()
+    favorite_count = array('I', bytes(4 * len(created)))
+    insert = sqlite_insert(Favorite.__table__).on_conflict_do_nothing()
+
+    for start in range(0, args.favorites, args.batch_size):
+        size = min(args.batch_size, args.favorites - start)
+        rows = []
+        for index, user_id in zip(rng.choices(popularity, cum_weights=post_weights, k=size),
+                                  rng.choices(user_ids, cum_weights=user_weights, k=size)):
+            if (user_id, index) in seen:
+                continue
+            seen.add((user_id, index))
+            favorite_count[index] += 1
+            post_created = created[index]
+            rows.append({
+                'user_id': user_id,
+                'post_id': first_post_id + index,
+                'created_at': post_created + (until - post_created) * rng.random(),
+            })
+        if rows:
+            db.session.execute(insert, rows)
         db.session.commit()
-        
-        # リプライを生成
-        print("Generating replies...")
-        reply_templates = [
-            "確かに{0}は興味深い視点ですね。",
-            "私も{0}について考えていました。",
-            "この{0}という考え方は新鮮です。",
-            "{0}についての議論は大切だと思います。",
-            "なるほど、{0}はそういう見方もできるんですね。"
-        ]
-        
-        for i in range(100):
-            original_post = random.choice(posts)
-            topic = original_post.content.split("「")[-1].split("」")[0] if "「" in original_post.content else "この話題"
-            template = random.choice(reply_templates)
-            content = template.format(topic)
-            user = random.choice(users)
-            
-            reply = Post(
-                content=content,
-                url=original_post.url,
-                user_id=user.id,
-                created_at=fake.date_time_between(start_date=original_post.created_at, end_date='now'),
-                ip_address=fake.ipv4(),
-                reply_to_id=original_post.id,
-                favorite_count=0
-            )
-            
-            # リプライにもタグを付ける（1-2個）
-            reply_tags = random.sample(tags, random.randint(1, 2))
-            for tag in reply_tags:
-                reply.tags.append(tag)
-            
-            db.session.add(reply)
+        print(f'  favorites: {start + size}/{args.favorites}')
+    return favorite_count
+
+def write_counters(first_post_id, replies_count, favorite_count):
+    # 追加した投稿だけが返信先・お気に入り先になるので、既存の行は数え直さなくてよい
+    posts = Post.__table__
+    stmt = posts.update()\
+        .where(posts.c.id == db.bindparam('post_id'))\
+        .values(replies_count=db.bindparam('replies'), favorite_count=db.bindparam('favorites'))
+    rows = [
+        {'post_id': first_post_id + index, 'replies': replies, 'favorites': favorites}
+        for index, (replies, favorites) in enumerate(zip(replies_count, favorite_count))
+        if replies or favorites
+    ]
+    if rows:
+        db.session.execute(stmt, rows)
+
+def generate(args):
+    rng = random.Random(args.seed)
+    fake = Faker(['ja_JP'])
+    fake.seed_instance(args.seed)
+    until = args.until or datetime.utcnow()
+    created_from = until - timedelta(days=args.days)
+
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+            db.session.execute(db.text('DROP TABLE IF EXISTS posts_fts'))
+            db.session.commit()
+        db.create_all()
+        # 追記する場合は既存の最新の投稿より後に分布させる（投稿IDの順と作成日時の順を一致させる）
+        latest = db.session.query(db.func.max(Post.created_at)).scalar()
+        if latest is not None and latest > created_from:
+            if latest >= until:
+                raise SystemExit(f'--until は既存の最新の投稿（{latest}）より後を指定してください')
+            created_from = latest
+
+        started = time.perf_counter()
+        drop_search_triggers()
         db.session.commit()
-        
-        print("Generating favorites...")
-        # いいねを生成
-        for post in posts:
-            # 各投稿に0-5個のいいねをつける
-            for _ in range(random.randint(0, 5)):
-                user = random.choice(users)
-                # 既にいいねしていない場合のみ追加
-                existing_favorite = Favorite.query.filter_by(
-                    user_id=user.id,
-                    post_id=post.id
-                ).first()
-                
-                if not existing_favorite:
-                    favorite = Favorite(
-                        user_id=user.id,
-                        post_id=post.id,
-                        created_at=fake.date_time_between(
-                            start_date=post.created_at,
-                            end_date='now'
-                        )
-                    )
-                    db.session.add(favorite)
-                    post.favorite_count += 1
-        
+        try:
+            print('Generating users...')
+            user_ids = generate_users(rng, fake, args.users, created_from, until)
+            print('Generating tags...')
+            tag_ids = generate_tags(args.tags)
+            print('Generating posts...')
+            first_post_id, created, replies_count = generate_posts(rng, args, user_ids, tag_ids, created_from, until)
+            print('Generating favorites...')
+            favorite_count = generate_favorites(rng, args, user_ids, first_post_id, created, until)
+            print('Writing counters and search index...')
+            write_counters(first_post_id, replies_count, favorite_count)
+            index_posts(first_post_id)
+            bump_generation()
+            db.session.commit()
+        finally:
+            # 途中で失敗した場合はコミット済みのバッチが未集計のまま残るので、
+            # flask check-counts --repair と flask rebuild-search-index で修復する
+            db.session.rollback()
+            create_search_triggers()
+            db.session.commit()
+
+        db.session.execute(db.text('ANALYZE'))
         db.session.commit()
-        print("Done!")
+        print(f'Done in {time.perf_counter() - started:.1f}s')
+
+def main():
+    parser = argparse.ArgumentParser(description='ベンチマーク用のダミーデータを生成する')
+    parser.add_argument('--seed', type=int, default=1, help='乱数シード')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--posts', type=int, default=1000, help='通常の投稿数')
+    parser.add_argument('--replies', type=int, default=500, help='返信数')
+    parser.add_argument('--tags', type=int, default=len(TAG_NAMES))
+    parser.add_argument('--favorites', type=int, default=3000, help='お気に入りの試行回数（重複分は登録されない）')
+    parser.add_argument('--days', type=float, default=365, help='データを分布させる期間（日）')
+    parser.add_argument('--until', type=datetime.fromisoformat, help='最新データの日時（UTC、既定は現在時刻）')
+    parser.add_argument('--tag-skew', type=float, default=1.1, help='タグ人気のべき指数')
+    parser.add_argument('--user-skew', type=float, default=1.0, help='ユーザー活動量のべき指数')
+    parser.add_argument('--post-skew', type=float, default=0.8, help='投稿人気（お気に入り）のべき指数')
+    parser.add_argument('--reply-recency', type=float, default=0.7, help='返信先の遡りやすさ（小さいほど古い投稿にも返信する）')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--reset', action='store_true', help='既存のテーブルを削除してから生成する')
+    args = parser.parse_args()
+    if args.users < 1 or args.tags < 1:
+        parser.error('--users と --tags は1以上を指定してください')
+    if args.posts < 0 or args.replies < 0:
+        parser.error('--posts と --replies は0以上を指定してください')
+    if args.replies and not args.posts:
+        # 返信先は同じ実行で生成する投稿から選ぶ
+        parser.error('--replies を指定する場合は --posts も1以上を指定してください')
+    generate(args)
 
-if __name__ == "__main__":
-    generate_dummy_data() 
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+from flask import current_app
+from models import db, SEARCH_INDEX_DDL
+from serializers import load_posts
+from pagination import InvalidCursor
+
+# posts_fts (FTS5, trigram) を使った投稿検索
+# bm25 は語ごとの該当件数を数えるために各語の一致行をすべて読むので、よくある語では
+# 検索のたびに数十万行を読むことになる。そこで語ごとの該当件数を SEARCH_RANK_LIMIT + 1 件まで数え、
+#   - すべての語が SEARCH_RANK_LIMIT 件以下なら、該当する投稿（SEARCH_RANK_LIMIT 件以下）を
+#     bm25 のスコア順に並べる（order: relevance、カーソルは score,id）
+#   - どれかの語がそれより多ければ、スコアを付けずに新しい順（rowid の降順）に返す
+#     （order: recent、カーソルは id）。FTS5 が rowid 順に読むので一時B-treeでの並べ替えはしない
+# 最初のページで決めた並び順は、以降のページではカーソルの形式に従う。
+# スコア順の途中でよくある語になった場合は、カーソルの投稿より古いものを新しい順に返す。
+
+MIN_TERM_LENGTH = 3  # trigram トークナイザは3文字未満の語にマッチしない
+MAX_ROWID = 2 ** 63 - 1
+
+class InvalidQuery(ValueError):
+    pass
+
+# 語ごとの該当件数を数えるための rowid（limit 件で打ち切る）
+TERM_MATCHES = '''
+    SELECT rowid FROM posts_fts WHERE posts_fts MATCH :match LIMIT :limit
+'''
+
+# 該当件数が少ない場合: すべてにスコアを付けて Python 側で並べる
+RANKED_MATCHES = '''
+    SELECT rowid AS id, bm25(posts_fts) AS score
+    FROM posts_fts
+    WHERE posts_fts MATCH :match
+'''
+
+# 該当件数が多い場合: 新しい順
+RECENT_PAGE = '''
+    SELECT rowid AS id
+    FROM posts_fts
+    WHERE posts_fts MATCH :match AND rowid < :before
+    ORDER BY rowid DESC
+    LIMIT :limit
+'''
+
+REBUILD_SEARCH_INDEX = '''
+    INSERT INTO posts_fts (rowid, content, tags)
+    SELECT p.id, p.content, coalesce(group_concat(t.name, ' '), '')
+    FROM posts AS p
+    LEFT JOIN post_tags AS pt ON pt.post_id = p.id
+    LEFT JOIN tags AS t ON t.id = pt.tag_id
+    WHERE p.id >= :min_id
+    GROUP BY p.id
+'''
+
+def quote_term(term):
+    # 利用者の入力はFTS5の構文として解釈させず、フレーズとして引用する
+    return '"{}"'.format(term.replace('"', '""'))
+
+def split_terms(q):
+    terms = q.split()
+    if not terms or any(len(term) < MIN_TERM_LENGTH for term in terms):
+        raise InvalidQuery(q)
+    return terms
+
+def build_match(terms):
+    # 語ごとのフレーズのAND検索
+    return ' '.join(quote_term(term) for term in terms)
+
+def make_cursor(score, post_id):
+    return f'{score!r},{post_id}'
+
+def parse_cursor(value):
+    # スコア順のカーソルは (score, id)、新しい順のカーソルは (None, id)
+    if not value:
+        return None, None
+    try:
+        if ',' not in value:
+            return None, int(value)
+        score, post_id = value.rsplit(',', 1)
+        return float(score), int(post_id)
+    except ValueError:
+        raise InvalidCursor(value)
+
+def can_rank(terms, limit):
+    # すべての語の該当件数が limit 件以下か
+    return all(
+        len(db.session.execute(db.text(TERM_MATCHES), {'match': quote_term(term), 'limit': limit + 1}).fetchall()) <= limit
+        for term in terms
+    )
+
+def ranked_page(match, cursor, per_page):
+    rows = sorted(db.session.execute(db.text(RANKED_MATCHES), {'match': match}).fetchall(),
+        key=lambda row: (row.score, row.id))
+    if cursor is not None:
+        rows = [row for row in rows if (row.score, row.id) > cursor]
+    return [(row.id, row.score) for row in rows[:per_page + 1]]
+
+def recent_page(match, before, per_page):
+    rows = db.session.execute(db.text(RECENT_PAGE), {
+        'match': match,
+        'before': MAX_ROWID if before is None else before,
+        'limit': per_page + 1
+    }).fetchall()
+    return [(row.id, None) for row in rows]
+
+def search_posts(q, cursor=None, per_page=20):
+    terms = split_terms(q)
+    match = build_match(terms)
+    cursor_score, cursor_id = parse_cursor(cursor)
+
+    if (cursor_id is None or cursor_score is not None) \
+            and can_rank(terms, current_app.config.get('SEARCH_RANK_LIMIT', 1000)):
+        order = 'relevance'
+        rows = ranked_page(match, None if cursor_id is None else (cursor_score, cursor_id), per_page)
+    else:
+        order = 'recent'
+        rows = recent_page(match, cursor_id, per_page)
+
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+
+    # 該当ページの投稿だけをまとめて取得し、検索結果の順に並べ直す
+    posts = load_posts([post_id for post_id, score in rows])
+
+    next_cursor = None
+    if has_next:
+        last_id, last_score = rows[-1]
+        next_cursor = make_cursor(last_score, last_id) if order == 'relevance' else str(last_id)
+
+    return posts, {
+        'order': order,
+        'has_next': has_next,
+        'next_cursor': next_cursor
+    }
+
+SEARCH_TRIGGERS = [
+    'posts_fts_insert',
+    'posts_fts_update',
+    'posts_fts_delete',
+    'post_tags_fts_insert',
+    'post_tags_fts_delete',
+]
+
+def drop_search_triggers():
+    # 大量投入時は行ごとの索引更新を止め、最後に index_posts でまとめて登録する
+    for name in SEARCH_TRIGGERS:
+        db.session.execute(db.text(f'DROP TRIGGER IF EXISTS {name}'))
+
+def create_search_triggers():
+    # SEARCH_INDEX_DDL の先頭は仮想テーブル本体、残りがトリガ
+    for statement in SEARCH_INDEX_DDL[1:]:
+        db.session.execute(db.text(statement))
+
+def index_posts(min_id):
+    # min_id 以降の投稿を索引に追加する（トリガを外して追記した分をまとめて登録する）
+    db.session.execute(db.text(REBUILD_SEARCH_INDEX), {'min_id': min_id})
+
+def rebuild_search_index():
+    db.session.execute(db.text('DELETE FROM posts_fts'))
+    index_posts(0)
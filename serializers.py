@@ -0,0 +1,58 @@
+from flask_login import current_user
+from sqlalchemy.orm import joinedload, selectinload
+from models import db, Post, Favorite
+from instrumentation import phase
+from unfurl import load_previews
+from urls import try_normalize_url
+
+# 一覧系エンドポイント共通のシリアライザ
+# 投稿ごとに author / tags / お気に入り状態を個別に読むとN+1になるため、
+# ページ単位でまとめて取得してクエリ数をページサイズに依存しない定数に抑える
+
+def with_relations(query):
+    # 投稿者はJOIN、タグはIN句で一括ロード
+    return query.options(joinedload(Post.author), selectinload(Post.tags))
+
+def load_posts(post_ids):
+    # ID順を保ったまま投稿をまとめて取得する（検索結果やお気に入り一覧の復元用）
+    if not post_ids:
+        return []
+    posts = with_relations(Post.query).filter(Post.id.in_(post_ids)).all()
+    posts_by_id = {post.id: post for post in posts}
+    return [posts_by_id[post_id] for post_id in post_ids if post_id in posts_by_id]
+
+def favorited_ids(post_ids):
+    # ログインユーザーがお気に入り済みの投稿IDを1クエリで取得
+    if not post_ids or not current_user.is_authenticated:
+        return set()
+    rows = db.session.query(Favorite.post_id)\
+        .filter(Favorite.user_id == current_user.id, Favorite.post_id.in_(post_ids))\
+        .all()
+    return {post_id for post_id, in rows}
+
+def serialize_posts(posts, favorited=None):
+    if favorited is None:
+        favorited = favorited_ids([post.id for post in posts])
+    user_id = current_user.id if current_user.is_authenticated else None
+    # URLのプレビューも同じURLの投稿をまとめて1クエリで読む（取得前のものは None）
+    preview_keys = {post.id: try_normalize_url(post.url) for post in posts}
+    previews = load_previews(preview_keys.values())
+
+    with phase('serialize'):
+        return [{
+            'id': post.id,
+            'content': post.content,
+            'url': post.url,
+            'created_at': post.created_at,
+            'favorite_count': post.favorite_count,
+            'replies_count': post.replies_count,
+            'author': {
+                'id': post.author.id,
+                'name': post.author.name,
+                'profile_pic': post.author.profile_pic
+            },
+            'tags': [tag.name for tag in post.tags],
+            'is_own': user_id is not None and post.user_id == user_id,
+            'is_favorited': post.id in favorited,
+            'preview': previews.get(preview_keys[post.id])
+        } for post in posts]
@@ -11,6 +11,7 @@ document.addEventListener('DOMContentLoaded', () => {
     fetchPopularTags();
     setupTagClickHandlers();
     setupNavigation();
+    setupLiveStream();
 });
 
 // イベントリスナーの設定
@@ -20,29 +21,48 @@ function setupEventListeners() {
 
     // 投稿一覧の無限スクロール
     window.addEventListener('scroll', handleScroll);
+
+    // 検索フォームの送信
+    document.getElementById('searchForm')?.addEventListener('submit', handleSearch);
 }
 
 // 投稿の取得
-async function fetchPosts(page = 1) {
+async function fetchPosts(cursor = null) {
     try {
         console.log('Fetching posts...'); // デバッグログ
-        const response = await fetch(`/api/posts?page=${page}`);
+        const response = await fetch(feedUrl('/api/posts', cursor));
         const data = await response.json();
         console.log('Received data:', data); // デバッグログ
         
-        if (page === 1) {
+        if (!cursor) {
             postsContainer.innerHTML = '';
         }
         
-        data.posts.forEach(post => {
-            const postElement = createPostElement(post);
-            postsContainer.appendChild(postElement);
-        });
+        appendPosts(data.posts);
+        setCurrentFeed('/api/posts', 'posts', data.next_cursor);
     } catch (error) {
         console.error('Error fetching posts:', error);
     }
 }
 
+// 投稿要素をまとめて追加
+function appendPosts(posts) {
+    posts.forEach(post => {
+        const postElement = createPostElement(post);
+        postsContainer.appendChild(postElement);
+    });
+}
+
+// スレッドの返信を深さに応じて字下げして追加
+function appendThread(posts) {
+    posts.forEach(post => {
+        const postElement = createPostElement(post);
+        const depth = Math.min(post.depth - 1, THREAD_INDENT_MAX_DEPTH);
+        postElement.querySelector('article').style.marginLeft = `${depth * 1.5}rem`;
+        postsContainer.appendChild(postElement);
+    });
+}
+
 // 投稿要素の作成
 function createPostElement(post) {
     const template = postTemplate.content.cloneNode(true);
@@ -67,6 +87,16 @@ function createPostElement(post) {
     contentLink.href = post.url;
     contentLink.textContent = post.content;
     
+    // URLのプレビュー（取得済みの場合のみ）
+    if (post.preview) {
+        const preview = template.querySelector('.link-preview');
+        preview.href = post.url;
+        preview.querySelector('.link-preview-site').textContent = post.preview.site_name || new URL(post.url).hostname;
+        preview.querySelector('.link-preview-title').textContent = post.preview.title || '';
+        preview.querySelector('.link-preview-description').textContent = post.preview.description || '';
+        preview.hidden = false;
+    }
+    
     // タグ
     const tagsContainer = template.querySelector('.post-tags');
     post.tags.forEach(tag => {
@@ -147,7 +177,7 @@ async function handleNewPost(event) {
             url = `/api/posts/${replyToId}/replies`;
         }
         
-        const response = await fetch(url, {
+        let response = await fetch(url, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
@@ -155,6 +185,23 @@ async function handleNewPost(event) {
             body: JSON.stringify(data)
         });
         
+        // 同じ会話がすでに投稿されている場合は、投稿するか既存の投稿を見るかを選ぶ
+        if (response.status === 409) {
+            const duplicate = await response.json();
+            if (!confirm('この会話はすでに投稿されています。それでも投稿しますか？\n（キャンセルすると既存の投稿を表示します）')) {
+                closeNewPostModal();
+                fetchPostsByUrl(duplicate.url);
+                return;
+            }
+            response = await fetch(url, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ ...data, force: true })
+            });
+        }
+        
         if (response.ok) {
             closeNewPostModal();
             newPostForm.reset();
@@ -211,22 +258,87 @@ function formatDate(dateString) {
     return `${Math.floor(diff / 86400000)}日前`;
 }
 
-// 無限スクロール
-let currentPage = 1;
+// 無限スクロール（カーソル方式）
+// 表示中のフィードと次ページのカーソルを保持し、?before=<cursor> で続きを取得する
+// 一覧APIは ETag と Cache-Control: no-cache を返すため、同じURLの再取得は
+// ブラウザが If-None-Match で再検証し、変更がなければ 304 でキャッシュを再利用する
+let currentFeed = null;
+let nextCursor = null;
 let isLoading = false;
 
+function feedUrl(url, cursor = null, param = 'before') {
+    const separator = url.includes('?') ? '&' : '?';
+    return `${url}${separator}${param}=${encodeURIComponent(cursor || '')}`;
+}
+
+function setCurrentFeed(url, key, cursor, param = 'before') {
+    currentFeed = { url, key, param };
+    nextCursor = cursor;
+}
+
+async function fetchNextPage() {
+    const response = await fetch(feedUrl(currentFeed.url, nextCursor, currentFeed.param));
+    if (!response.ok) throw new Error('Failed to fetch next page');
+    
+    const data = await response.json();
+    appendPosts(data[currentFeed.key]);
+    nextCursor = data.next_cursor;
+}
+
 function handleScroll() {
     const { scrollTop, scrollHeight, clientHeight } = document.documentElement;
     
-    if (scrollTop + clientHeight >= scrollHeight - 100 && !isLoading) {
+    if (scrollTop + clientHeight >= scrollHeight - 100 && !isLoading && currentFeed && nextCursor) {
         isLoading = true;
-        currentPage++;
-        fetchPosts(currentPage).finally(() => {
+        fetchNextPage().catch(error => {
+            console.error('Error fetching next page:', error);
+        }).finally(() => {
             isLoading = false;
         });
     }
 }
 
+// ライブ配信（Server-Sent Events）
+// 新しい投稿はホームのタイムライン表示中だけ先頭に追加し、返信数・いいね数は表示中の投稿に反映する
+// 切断時は EventSource が Last-Event-ID を付けて自動で再接続する
+function setupLiveStream() {
+    if (!window.EventSource) return;
+    const source = new EventSource('/api/stream');
+
+    source.addEventListener('post', (event) => {
+        const post = JSON.parse(event.data);
+        if (currentFeed?.url !== '/api/posts' || findPostElement(post.id)) return;
+        // 配信データの is_own は常に false なので、ログイン中のユーザーと投稿者を比べて削除ボタンを出す
+        post.is_own = currentUser !== null && post.author.id === currentUser.id;
+        postsContainer.prepend(createPostElement(post));
+    });
+
+    source.addEventListener('reply', (event) => {
+        const reply = JSON.parse(event.data);
+        const parent = findPostElement(reply.reply_to_id);
+        if (parent) {
+            parent.querySelector('.reply-count').textContent = reply.parent_replies_count;
+        }
+    });
+
+    source.addEventListener('favorite', (event) => {
+        const data = JSON.parse(event.data);
+        const article = findPostElement(data.post_id);
+        if (article) {
+            article.querySelector('.like-count').textContent = data.favorite_count;
+        }
+    });
+
+    // 取りこぼしがあり得る場合（保持期間外からの再接続）はタイムラインを読み直す
+    source.addEventListener('reset', () => {
+        if (currentFeed?.url === '/api/posts') fetchPosts();
+    });
+}
+
+function findPostElement(postId) {
+    return postsContainer.querySelector(`article[data-post-id="${postId}"]`);
+}
+
 // モーダルの外側クリックで閉じる
 window.addEventListener('click', (event) => {
     if (event.target === newPostModal) {
@@ -257,10 +369,7 @@ function displayPopularTags(tags) {
             <span class="hashtag-name">#${tag.name}</span>
             <span class="hashtag-count">${tag.count}</span>
         `;
-        tagLink.addEventListener('click', async (e) => {
-            e.preventDefault();
-            await fetchPostsByTag(tag.name);
-        });
+        // クリックは setupTagClickHandlers でまとめて処理する
         hashtagsList.appendChild(tagLink);
     });
 }
@@ -323,27 +432,36 @@ function setupTagClickHandlers() {
         if (!tagLink) return;
 
         event.preventDefault();
-        const tagName = tagLink.textContent.replace('#', '').trim().split(' ')[0];
+        const tagName = tagLink.textContent.replace('#', '').trim().split(/\s+/)[0];
         console.log('Clicked tag:', tagName);
-        await fetchPostsByTag(tagName);
+        // Shift / Ctrl / ⌘ を押しながらのクリックは、表示中のタグに追加して絞り込む
+        const extend = event.shiftKey || event.ctrlKey || event.metaKey;
+        const filtering = currentFeed?.url?.startsWith('/api/posts/tags');
+        const tags = extend && filtering ? [...new Set([...selectedTags, tagName])] : [tagName];
+        await fetchPostsByTags(tags);
     });
 }
 
-// タグでフィルタリングされた投稿を取得
-async function fetchPostsByTag(tagName) {
+// タグでフィルタリングされた投稿を取得（複数タグはすべてを含む投稿）
+let selectedTags = [];
+
+async function fetchPostsByTags(tags) {
     try {
-        console.log('Fetching posts for tag:', tagName);
-        const response = await fetch(`/api/posts/tag/${encodeURIComponent(tagName)}`);
+        console.log('Fetching posts for tags:', tags);
+        const url = `/api/posts/tags?all=${tags.map(encodeURIComponent).join(',')}`;
+        const response = await fetch(feedUrl(url));
         if (!response.ok) throw new Error('Failed to fetch posts');
         
         const data = await response.json();
         console.log('Received tag data:', data);
         
+        selectedTags = tags;
+        const subtitle = document.querySelector('.subtitle');
+        subtitle.textContent = tags.map(tag => `#${tag}`).join(' ');
+        
         postsContainer.innerHTML = '';
-        data.posts.forEach(post => {
-            const postElement = createPostElement(post);
-            postsContainer.appendChild(postElement);
-        });
+        appendPosts(data.posts);
+        setCurrentFeed(url, 'posts', data.next_cursor);
     } catch (error) {
         console.error('Error fetching posts by tag:', error);
     }
@@ -353,7 +471,8 @@ async function fetchPostsByTag(tagName) {
 async function fetchPostsByUser(userId, userName) {
     try {
         console.log('Fetching posts for user:', userName);
-        const response = await fetch(`/api/posts/user/${userId}`);
+        const url = `/api/posts/user/${userId}`;
+        const response = await fetch(feedUrl(url));
         if (!response.ok) throw new Error('Failed to fetch posts');
         
         const data = await response.json();
@@ -365,10 +484,8 @@ async function fetchPostsByUser(userId, userName) {
         
         // 投稿を表示
         postsContainer.innerHTML = '';
-        data.posts.forEach(post => {
-            const postElement = createPostElement(post);
-            postsContainer.appendChild(postElement);
-        });
+        appendPosts(data.posts);
+        setCurrentFeed(url, 'posts', data.next_cursor);
         
         // ホームに戻るボタンを表示
         const subtitle = document.querySelector('.subtitle');
@@ -382,6 +499,33 @@ async function fetchPostsByUser(userId, userName) {
     }
 }
 
+// 同じ会話（URL）の投稿を取得する
+async function fetchPostsByUrl(postUrl) {
+    try {
+        const url = `/api/posts/by-url?url=${encodeURIComponent(postUrl)}`;
+        const response = await fetch(feedUrl(url));
+        if (!response.ok) throw new Error('Failed to fetch posts');
+        
+        const data = await response.json();
+        
+        const title = document.querySelector('.content-header h1');
+        title.textContent = 'この会話の投稿';
+        
+        postsContainer.innerHTML = '';
+        appendPosts(data.posts);
+        setCurrentFeed(url, 'posts', data.next_cursor);
+        
+        const subtitle = document.querySelector('.subtitle');
+        subtitle.innerHTML = `
+            <a href="#" onclick="resetToHome(event)" style="color: #1DA1F2; text-decoration: none;">
+                ← ホームに戻る
+            </a>
+        `;
+    } catch (error) {
+        console.error('Error fetching posts by url:', error);
+    }
+}
+
 // ホームに戻る関数を追加
 function resetToHome(event) {
     if (event) event.preventDefault();
@@ -393,6 +537,7 @@ function resetToHome(event) {
     // サブタイトルを元に戻す
     const subtitle = document.querySelector('.subtitle');
     subtitle.textContent = 'ChatGPTとの面白い会話集';
+    selectedTags = [];
     
     // 投稿を再読み込み
     fetchPosts();
@@ -454,11 +599,14 @@ async function deletePost(postId) {
     }
 }
 
-// リプライ一覧を取得して表示
+// リプライ一覧（スレッド全体）を取得して表示
+// 返信への返信も1回のリクエストで行きがけ順に返るので、深さに応じて字下げする
+const THREAD_INDENT_MAX_DEPTH = 6;
+
 async function fetchReplies(postId, originalContent) {
     try {
         console.log('Fetching replies for post:', postId);
-        const response = await fetch(`/api/posts/${postId}/replies`);
+        const response = await fetch(`/api/posts/${postId}/thread`);
         if (!response.ok) throw new Error('Failed to fetch replies');
         
         const data = await response.json();
@@ -480,16 +628,19 @@ async function fetchReplies(postId, originalContent) {
             </a>
         `;
         
-        // リプ��イを表示
+        // リプライを表示（先頭は元の投稿なので除く）
+        const replies = data.posts.filter(post => post.depth > 0);
         postsContainer.innerHTML = '';
-        if (data.replies.length === 0) {
+        if (replies.length === 0) {
             postsContainer.innerHTML = '<p style="padding: 1rem;">まだリプライはありません。</p>';
         } else {
-            data.replies.forEach(reply => {
-                const replyElement = createPostElement(reply);
-                postsContainer.appendChild(replyElement);
-            });
+            appendThread(replies);
+            if (data.truncated) {
+                postsContainer.insertAdjacentHTML('beforeend', '<p style="padding: 1rem; color: #8899A6;">リプライが多いため一部のみ表示しています。</p>');
+            }
         }
+        // スレッドは一括で返るので無限スクロールは行わない
+        setCurrentFeed(null, 'posts', null);
     } catch (error) {
         console.error('Error fetching replies:', error);
     }
@@ -519,7 +670,7 @@ function setupNavigation() {
     profileNav?.addEventListener('click', async (e) => {
         e.preventDefault();
         // ログインユーザーの投稿を表示
-        const userId = currentUser.id;  // currentUserはサーバーから取得する必要があります
+        const userId = currentUser.id;  // currentUser は base.html で埋め込む
         const userName = currentUser.name;
         await fetchPostsByUser(userId, userName);
         updateActiveNav(profileNav);
@@ -537,7 +688,8 @@ function updateActiveNav(activeNav) {
 // お気に入り投稿の取得
 async function fetchFavoritePosts() {
     try {
-        const response = await fetch('/api/posts/favorites');
+        const url = '/api/posts/favorites';
+        const response = await fetch(feedUrl(url));
         if (!response.ok) throw new Error('Failed to fetch favorites');
         
         const data = await response.json();
@@ -555,12 +707,53 @@ async function fetchFavoritePosts() {
         if (data.posts.length === 0) {
             postsContainer.innerHTML = '<p style="padding: 1rem;">お気に入りの投稿はありません。</p>';
         } else {
-            data.posts.forEach(post => {
-                const postElement = createPostElement(post);
-                postsContainer.appendChild(postElement);
-            });
+            appendPosts(data.posts);
         }
+        setCurrentFeed(url, 'posts', data.next_cursor);
     } catch (error) {
         console.error('Error fetching favorites:', error);
     }
-}
\ No newline at end of file
+}
+
+// 検索フォームの送信
+async function handleSearch(event) {
+    event.preventDefault();
+    const query = new FormData(event.target).get('q').trim();
+    if (query) {
+        await fetchSearchResults(query);
+    }
+}
+
+// 全文検索の結果を取得して表示
+async function fetchSearchResults(query) {
+    try {
+        const url = `/api/search?q=${encodeURIComponent(query)}`;
+        const response = await fetch(feedUrl(url, null, 'cursor'));
+        if (!response.ok) throw new Error('Failed to search posts');
+        
+        const data = await response.json();
+        
+        // タイトルを更新
+        const title = document.querySelector('.content-header h1');
+        title.textContent = `「${query}」の検索結果`;
+        
+        // ホームに戻るボタンを表示
+        const subtitle = document.querySelector('.subtitle');
+        subtitle.innerHTML = `
+            <a href="#" onclick="resetToHome(event)" style="color: #1DA1F2; text-decoration: none;">
+                ← ホームに戻る
+            </a>
+        `;
+        
+        // 投稿を表示
+        postsContainer.innerHTML = '';
+        if (data.posts.length === 0) {
+            postsContainer.innerHTML = '<p style="padding: 1rem;">該当する投稿はありません。</p>';
+        } else {
+            appendPosts(data.posts);
+        }
+        setCurrentFeed(url, 'posts', data.next_cursor, 'cursor');
+    } catch (error) {
+        console.error('Error searching posts:', error);
+    }
+}
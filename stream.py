@@ -0,0 +1,180 @@
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from threading import Condition, Thread
+from flask import current_app
+from models import db, StreamEvent
+from json_provider import dumps
+
+# Server-Sent Events によるライブ配信（/api/stream）
+# 書き込みハンドラは publish() で stream_events に1行追記する（書き込みと同じトランザクション）。
+# 各ワーカーでは1本の読み出しスレッドが STREAM_POLL_INTERVAL 秒ごとに新しい行を id 順に読み、
+# メモリ上のリングバッファに積んで Condition で接続中の全クライアントを起こす。
+# どのワーカーで書き込まれても、すべてのワーカーの接続に届く。
+# クライアントごとのスレッドは持たない（gevent ワーカーでは接続ごとに軽量なグリーンレットになり、
+# このモジュールの Thread / Condition も協調的に動く）。
+# 再接続時は Last-Event-ID より後のイベントを、バッファになければ stream_events から送り直す。
+# STREAM_RETENTION 秒より古いイベントは publish() のついでに消す（接続のないワーカーでも消えるように）。
+
+TAIL_BATCH = 500
+
+class Hub:
+    # ワーカープロセス内の配信状態
+    def __init__(self):
+        self.condition = Condition()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.events = deque()
+        self.last_id = 0
+        self.subscribers = 0
+        self.thread = None
+        self.last_prune = None
+
+    def append(self, rows, maxlen):
+        with self.condition:
+            self.events.extend(rows)
+            while len(self.events) > maxlen:
+                self.events.popleft()
+            self.last_id = rows[-1][0]
+            self.condition.notify_all()
+
+    def since(self, event_id):
+        # event_id より後のイベント（バッファは id 順なので末尾から辿る）
+        pending = []
+        for event in reversed(self.events):
+            if event[0] <= event_id:
+                break
+            pending.append(event)
+        pending.reverse()
+        return pending
+
+    def covers(self, event_id):
+        # event_id の直後からバッファに残っているか
+        return event_id >= self.last_id or bool(self.events) and self.events[0][0] <= event_id + 1
+
+_hub = Hub()
+
+def publish(kind, data):
+    # 書き込みハンドラからコミット前に呼ぶ（ロールバックされれば配信されない）
+    db.session.add(StreamEvent(kind=kind, data=dumps(data).decode('utf-8')))
+    _prune()
+
+def _prune():
+    # 古いイベントはどれか1つのワーカーが消せばよいので、各ワーカーで保持期間の1/10ごとに1回、
+    # 書き込みと同じトランザクションで消す
+    retention = current_app.config.get('STREAM_RETENTION', 3600)
+    if _hub.pid != os.getpid():
+        _hub.reset()
+    now = time.monotonic()
+    with _hub.condition:
+        if _hub.last_prune is not None and now - _hub.last_prune < retention / 10:
+            return
+        _hub.last_prune = now
+    StreamEvent.query.filter(StreamEvent.created_at < datetime.utcnow() - timedelta(seconds=retention))\
+        .delete(synchronize_session=False)
+
+def stream_stats():
+    return {'subscribers': _hub.subscribers}
+
+def _tail(app):
+    poll_interval = app.config.get('STREAM_POLL_INTERVAL', 0.5)
+    buffer_size = app.config.get('STREAM_BUFFER_SIZE', 1000)
+    while True:
+        rows = []
+        try:
+            with app.app_context():
+                rows = db.session.query(StreamEvent.id, StreamEvent.kind, StreamEvent.data)\
+                    .filter(StreamEvent.id > _hub.last_id)\
+                    .order_by(StreamEvent.id)\
+                    .limit(TAIL_BATCH)\
+                    .all()
+                if rows:
+                    _hub.append([tuple(row) for row in rows], buffer_size)
+                db.session.remove()
+        except Exception as e:
+            app.logger.warning(f'ストリームの読み出しに失敗しました: {e}')
+        if len(rows) < TAIL_BATCH:
+            time.sleep(poll_interval)
+
+def _ensure_started():
+    # 読み出しスレッドは最初の接続で起動する（gunicorn の fork 後の各ワーカーで1本）
+    if _hub.pid != os.getpid():
+        _hub.reset()
+    if _hub.thread is not None:
+        return
+    with _hub.condition:
+        if _hub.thread is not None:
+            return
+        _hub.last_id = db.session.query(db.func.max(StreamEvent.id)).scalar() or 0
+        _hub.thread = Thread(target=_tail, args=(current_app._get_current_object(),), daemon=True)
+        _hub.thread.start()
+
+def _format(event_id, kind, data):
+    return f'id: {event_id}\nevent: {kind}\ndata: {data}\n\n'
+
+def subscribe(last_event_id=None):
+    # SSE の本文を返すジェネレータ。ここまではリクエストの中で実行し、
+    # ジェネレータ本体はアプリケーションコンテキストに依存しない
+    _ensure_started()
+    config = current_app.config
+    heartbeat = config.get('STREAM_HEARTBEAT', 15)
+    max_duration = config.get('STREAM_MAX_DURATION', 600)
+
+    replay = []
+    reset = False
+    if last_event_id is None:
+        cursor = _hub.last_id
+    else:
+        cursor = last_event_id
+        if not _hub.covers(cursor):
+            # バッファより古い位置からの再接続は stream_events から送り直す
+            limit = config.get('STREAM_REPLAY_LIMIT', 1000)
+            oldest = db.session.query(db.func.min(StreamEvent.id)).scalar()
+            reset = oldest is None or oldest > cursor + 1
+            if not reset:
+                replay = [tuple(row) for row in db.session.query(StreamEvent.id, StreamEvent.kind, StreamEvent.data)
+                    .filter(StreamEvent.id > cursor, StreamEvent.id <= _hub.last_id)
+                    .order_by(StreamEvent.id)
+                    .limit(limit + 1)
+                    .all()]
+                reset = len(replay) > limit
+            if reset:
+                # 保持期間外（または件数が多すぎる）の場合は、クライアントに読み直してもらう
+                replay = []
+                cursor = _hub.last_id
+            elif replay:
+                cursor = replay[-1][0]
+            else:
+                cursor = _hub.last_id
+    db.session.remove()
+
+    def events(cursor):
+        with _hub.condition:
+            _hub.subscribers += 1
+        try:
+            yield f'retry: {int(config.get("STREAM_RETRY_MS", 3000))}\n\n'
+            if reset:
+                yield _format(cursor, 'reset', '{}')
+            for event in replay:
+                yield _format(*event)
+            deadline = time.monotonic() + max_duration
+            while time.monotonic() < deadline:
+                with _hub.condition:
+                    pending = _hub.since(cursor)
+                    if not pending:
+                        _hub.condition.wait(heartbeat)
+                        pending = _hub.since(cursor)
+                if pending:
+                    cursor = pending[-1][0]
+                    yield ''.join(_format(*event) for event in pending)
+                else:
+                    # 切断の検出とプロキシのタイムアウト防止
+                    yield ': keep-alive\n\n'
+        finally:
+            with _hub.condition:
+                _hub.subscribers -= 1
+
+    return events(cursor)
@@ -0,0 +1,151 @@
+import time
+from array import array
+from bisect import bisect_left
+from heapq import merge
+from threading import Lock
+from flask import current_app
+from models import db
+from serializers import load_posts
+
+# タグ → 投稿IDの昇順配列（転置リスト）のメモリ上の索引（ワーカープロセスごと）
+# 複数タグの AND / OR を post_tags の JOIN ではなく配列の二分探索とマージで求め、
+# 必要な1ページ分の投稿だけをデータベースから読む。並び順は投稿IDの降順。
+# 最初の検索で post_tags から構築し、以後は検索のたびに「既知の最大ID より後」の post_tags を
+# 取り込む（posts.id は AUTOINCREMENT で削除されたIDも再利用されず、タグは投稿と同じトランザクションで
+# 付くため取りこぼさない）。
+# 削除は削除したワーカーでは即座に反映し、他のワーカーでは投稿の読み込み時に見つからなかった
+# IDを索引から取り除く。
+
+BUILD_QUERY = '''
+    SELECT pt.tag_id, pt.post_id FROM post_tags AS pt ORDER BY pt.tag_id, pt.post_id
+'''
+
+CATCH_UP_QUERY = '''
+    SELECT pt.post_id, pt.tag_id FROM post_tags AS pt WHERE pt.post_id > :after ORDER BY pt.post_id
+'''
+
+class TagIndex:
+    def __init__(self):
+        self.lock = Lock()
+        self.postings = None  # タグID -> array('I')
+        self.tag_ids = {}     # タグ名 -> タグID
+        self.max_post_id = 0
+
+    def build(self):
+        started = time.perf_counter()
+        postings = {}
+        current_id, current = None, None
+        for tag_id, post_id in db.session.execute(db.text(BUILD_QUERY)):
+            if tag_id != current_id:
+                current_id, current = tag_id, postings.setdefault(tag_id, array('I'))
+            current.append(post_id)
+        self.postings = postings
+        self.tag_ids = dict(db.session.execute(db.text('SELECT name, id FROM tags')).fetchall())
+        self.max_post_id = max((ids[-1] for ids in postings.values() if ids), default=0)
+        current_app.logger.info(
+            f'タグ索引を構築しました: {len(postings)} タグ, {sum(map(len, postings.values()))} 件, '
+            f'{(time.perf_counter() - started) * 1000:.0f}ms'
+        )
+
+    def catch_up(self):
+        rows = db.session.execute(db.text(CATCH_UP_QUERY), {'after': self.max_post_id}).fetchall()
+        if not rows:
+            return
+        unknown = {tag_id for post_id, tag_id in rows if tag_id not in self.postings}
+        if unknown:
+            self.tag_ids = dict(db.session.execute(db.text('SELECT name, id FROM tags')).fetchall())
+        for post_id, tag_id in rows:
+            self.postings.setdefault(tag_id, array('I')).append(post_id)
+        self.max_post_id = rows[-1][0]
+
+    def refresh(self):
+        with self.lock:
+            if self.postings is None:
+                self.build()
+            else:
+                self.catch_up()
+
+    def forget(self, post_ids, tag_ids=None):
+        with self.lock:
+            if self.postings is None:
+                return
+            for tag_id in (tag_ids if tag_ids is not None else list(self.postings)):
+                ids = self.postings.get(tag_id)
+                if not ids:
+                    continue
+                for post_id in post_ids:
+                    i = bisect_left(ids, post_id)
+                    if i < len(ids) and ids[i] == post_id:
+                        # 検索中の読み手が添字で辿っているので、その場で詰めずに新しい配列に置き換える
+                        ids = ids[:i] + ids[i + 1:]
+                self.postings[tag_id] = ids
+
+    def candidates(self, all_tags, any_tags, before=None):
+        # 条件に合う投稿IDを降順に返すジェネレータ。存在しないタグは AND なら結果なし、OR なら無視
+        with self.lock:
+            required = [self.postings.get(self.tag_ids.get(name), ()) for name in all_tags]
+            optional = [ids for ids in (self.postings.get(self.tag_ids.get(name)) for name in any_tags) if ids]
+        if any_tags and not optional or any(len(ids) == 0 for ids in required):
+            return
+        upper = before if before is not None else float('inf')
+
+        if required:
+            # 最も短い配列を後ろから辿り、残りの配列には二分探索で含まれるか確かめる
+            required.sort(key=len)
+            shortest, others = required[0], required[1:]
+            source = _descending(shortest, upper)
+        else:
+            others = []
+            source = _merge_desc(optional, upper)
+            optional = []
+
+        for post_id in source:
+            if all(_contains(ids, post_id) for ids in others) and \
+                    (not optional or any(_contains(ids, post_id) for ids in optional)):
+                yield post_id
+
+def _contains(ids, post_id):
+    i = bisect_left(ids, post_id)
+    return i < len(ids) and ids[i] == post_id
+
+def _descending(ids, upper):
+    # 昇順配列のうち upper 未満の要素を降順に返す
+    for i in range(bisect_left(ids, upper) - 1, -1, -1):
+        yield ids[i]
+
+def _merge_desc(postings, upper):
+    # 複数の昇順配列を upper 未満の範囲で降順にマージし、重複を除く
+    previous = None
+    for post_id in merge(*(_descending(ids, upper) for ids in postings), reverse=True):
+        if post_id != previous:
+            yield post_id
+            previous = post_id
+
+_index = TagIndex()
+
+def find_posts_by_tags(all_tags, any_tags, before=None, per_page=20):
+    _index.refresh()
+    candidates = _index.candidates(all_tags, any_tags, before)
+    posts = []
+    exhausted = False
+    # 1件多く読んで次ページの有無を判定する。削除済みで読めなかったIDは索引から除いて補充する
+    while len(posts) <= per_page and not exhausted:
+        wanted = per_page + 1 - len(posts)
+        ids = [post_id for _, post_id in zip(range(wanted), candidates)]
+        exhausted = len(ids) < wanted
+        loaded = load_posts(ids)
+        if len(loaded) < len(ids):
+            found = {post.id for post in loaded}
+            _index.forget([post_id for post_id in ids if post_id not in found])
+        posts.extend(loaded)
+
+    has_next = len(posts) > per_page
+    posts = posts[:per_page]
+    return posts, {
+        'has_next': has_next,
+        'next_cursor': str(posts[-1].id) if has_next else None
+    }
+
+def unindex_post(post_id, tag_ids):
+    # 削除をコミットした後に呼ぶ（タグIDは削除前に控えておく）
+    _index.forget([post_id], tag_ids)
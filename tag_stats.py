@@ -0,0 +1,126 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, Tag, TagHourlyCount
+
+# 人気タグのランキング
+# 全期間は tags.post_count、期間別は tag_hourly_counts の時間バケットを集計する。
+# どちらも create_post / delete_post のトランザクション内で更新するため、
+# 読み出し時に post_tags 全体を GROUP BY する必要がない。
+
+WINDOWS = {
+    '24h': timedelta(hours=24),
+    '7d': timedelta(days=7),
+    'all': None,
+}
+
+# 時間バケットの保持期間（最長のウィンドウ）
+RETENTION = timedelta(days=7)
+
+def hour_bucket(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+def window_start(window, now=None):
+    return hour_bucket((now or datetime.utcnow()) - WINDOWS[window])
+
+def _apply(entries, delta):
+    # entries: (タグIDの列, 投稿日時) の列。タグ別・時間帯別に集計してからまとめて更新する
+    cutoff = hour_bucket(datetime.utcnow() - RETENTION)
+    totals = Counter()
+    hourly = Counter()
+    for tag_ids, created_at in entries:
+        bucket = hour_bucket(created_at)
+        for tag_id in tag_ids:
+            totals[tag_id] += delta
+            if bucket >= cutoff:
+                hourly[tag_id, bucket] += delta
+
+    if not totals:
+        return
+
+    tags = Tag.__table__
+    db.session.execute(
+        tags.update()
+            .where(tags.c.id == db.bindparam('tag_id'))
+            .values(post_count=tags.c.post_count + db.bindparam('delta')),
+        [{'tag_id': tag_id, 'delta': count} for tag_id, count in totals.items()]
+    )
+
+    if hourly:
+        table = TagHourlyCount.__table__
+        stmt = sqlite_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.tag_id, table.c.hour],
+            set_={'post_count': table.c.post_count + stmt.excluded.post_count}
+        )
+        db.session.execute(stmt, [
+            {'tag_id': tag_id, 'hour': bucket, 'post_count': count}
+            for (tag_id, bucket), count in hourly.items()
+        ])
+
+    # 保持期間を過ぎたバケットを削除（hour のインデックスで範囲削除）
+    TagHourlyCount.query.filter(TagHourlyCount.hour < cutoff)\
+        .delete(synchronize_session=False)
+
+def record_post_tags(post):
+    # flush 済みの投稿に対して呼ぶ（タグIDと created_at が確定している必要がある）
+    _apply([([tag.id for tag in post.tags], post.created_at)], 1)
+
+def forget_post_tags(post):
+    _apply([([tag.id for tag in post.tags], post.created_at)], -1)
+
+def record_bulk_tags(entries):
+    # 一括登録用: entries は (タグIDの列, 投稿日時) の列
+    _apply(entries, 1)
+
+def popular_tags(window='all', limit=10):
+    if window == 'all':
+        return Tag.query.with_entities(Tag.name, Tag.post_count)\
+            .filter(Tag.post_count > 0)\
+            .order_by(Tag.post_count.desc(), Tag.id.desc())\
+            .limit(limit)\
+            .all()
+
+    post_count = db.func.sum(TagHourlyCount.post_count).label('post_count')
+    return db.session.query(Tag.name, post_count)\
+        .join(Tag, Tag.id == TagHourlyCount.tag_id)\
+        .filter(TagHourlyCount.hour >= window_start(window))\
+        .group_by(TagHourlyCount.tag_id)\
+        .having(post_count > 0)\
+        .order_by(db.desc('post_count'), TagHourlyCount.tag_id)\
+        .limit(limit)\
+        .all()
+
+# 整合性チェック・再構築用（check-counts から使用）
+
+TAG_COUNT_MISMATCHES = '''
+    SELECT t.id, t.post_count, COUNT(pt.post_id) AS actual
+    FROM tags AS t
+    LEFT JOIN post_tags AS pt ON pt.tag_id = t.id
+    GROUP BY t.id
+    HAVING t.post_count != COUNT(pt.post_id)
+'''
+
+REBUILD_TAG_COUNTS = '''
+    UPDATE tags SET post_count = (
+        SELECT COUNT(*) FROM post_tags WHERE post_tags.tag_id = tags.id
+    )
+'''
+
+REBUILD_HOURLY_COUNTS = '''
+    INSERT INTO tag_hourly_counts (tag_id, hour, post_count)
+    SELECT pt.tag_id, strftime('%Y-%m-%d %H:00:00.000000', p.created_at), COUNT(*)
+    FROM post_tags AS pt
+    JOIN posts AS p ON p.id = pt.post_id
+    WHERE p.created_at >= :since
+    GROUP BY 1, 2
+'''
+
+def find_tag_count_mismatches():
+    return db.session.execute(db.text(TAG_COUNT_MISMATCHES)).fetchall()
+
+def rebuild_tag_stats():
+    db.session.execute(db.text(REBUILD_TAG_COUNTS))
+    db.session.execute(db.text('DELETE FROM tag_hourly_counts'))
+    rebuild_hourly = db.text(REBUILD_HOURLY_COUNTS).bindparams(db.bindparam('since', type_=db.DateTime))
+    db.session.execute(rebuild_hourly, {'since': hour_bucket(datetime.utcnow() - RETENTION)})
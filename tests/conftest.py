@@ -0,0 +1,133 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from threading import Thread
+import pytest
+from werkzeug.serving import make_server, WSGIRequestHandler
+from app import create_app
+from config import TestingConfig, ProductionConfig
+from models import db, User, Post, Tag
+import tag_index
+import user_cache
+
+# テスト共通のフィクスチャ
+# app は TestingConfig（インメモリの SQLite）でテストごとに作り直し、テーブルはモデルから作成する。
+
+@pytest.fixture
+def app():
+    app = create_app(TestingConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+    # ワーカー単位のキャッシュと索引はテストをまたいで持ち越さない（ユーザーIDや投稿IDが使い回されるため）
+    user_cache._cache = None
+    tag_index._index = tag_index.TagIndex()
+
+@pytest.fixture
+def file_app(tmp_path):
+    # 接続ごとに別のトランザクションになるよう、本番と同じPRAGMAのファイルの SQLite で動かすアプリ
+    # （バックグラウンドのスレッドや同時リクエストを試す場合。アプリケーションコンテキストは各自で作る）
+    class FileConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "test.db"}'
+        SQLITE_PRAGMAS = ProductionConfig.SQLITE_PRAGMAS
+        SQLALCHEMY_ENGINE_OPTIONS = ProductionConfig.SQLALCHEMY_ENGINE_OPTIONS
+        INSTRUMENTATION_ENABLED = False
+
+    app = create_app(FileConfig)
+    with app.app_context():
+        db.create_all()
+        db.session.remove()
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+    user_cache._cache = None
+    tag_index._index = tag_index.TagIndex()
+
+def make_client(app, user_id=None):
+    client = app.test_client()
+    if user_id is not None:
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+    return client
+
+@pytest.fixture
+def client(app):
+    return make_client(app)
+
+@pytest.fixture
+def login(app):
+    # login(user_id) -> そのユーザーでログインしたテストクライアント
+    return lambda user_id: make_client(app, user_id)
+
+@pytest.fixture
+def count_queries():
+    # with count_queries() as statements: ... で実行されたSQL文を集める
+    @contextmanager
+    def counter():
+        statements = []
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        db.event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            yield statements
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', capture)
+    return counter
+
+class KeepAliveHandler(WSGIRequestHandler):
+    # 実際のサーバーと同じく接続を使い回せるようにする
+    protocol_version = 'HTTP/1.1'
+
+@pytest.fixture
+def serve():
+    # serve(wsgi_app) -> 'http://127.0.0.1:<port>'。テスト中だけ手元に立てるスタンドインのHTTPサーバー
+    servers = []
+    def start(wsgi_app):
+        server = make_server('127.0.0.1', 0, wsgi_app, threaded=True, request_handler=KeepAliveHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_port}'
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+@pytest.fixture
+def sample_data(app):
+    # ユーザー3人、タグ5個、投稿60件（各2タグ）と先頭の投稿への返信10件
+    users = [User(name=f'user{i}', email=f'user{i}@example.com', google_id=f'google-{i}') for i in range(3)]
+    tags = [Tag(name=f'tag{i}') for i in range(5)]
+    db.session.add_all(users + tags)
+    db.session.flush()
+
+    now = datetime.utcnow()
+    posts = []
+    for i in range(60):
+        post = Post(
+            content=f'投稿 {i} ChatGPT との会話',
+            url=f'https://chatgpt.com/share/conversation-{i}',
+            user_id=users[i % len(users)].id,
+            created_at=now - timedelta(minutes=i),
+            tags=[tags[i % len(tags)], tags[(i + 1) % len(tags)]]
+        )
+        posts.append(post)
+    db.session.add_all(posts)
+    db.session.flush()
+
+    for i in range(10):
+        db.session.add(Post(
+            content=f'返信 {i}',
+            url='',
+            user_id=users[(i + 1) % len(users)].id,
+            reply_to_id=posts[0].id,
+            created_at=now - timedelta(hours=2, minutes=i)
+        ))
+    posts[0].replies_count = 10
+    db.session.commit()
+    return {'users': users, 'tags': tags, 'posts': posts}
@@ -0,0 +1,92 @@
+import os
+import sqlite3
+import subprocess
+import sys
+from app import create_app, ROOT_PATH
+from config import Config, TestingConfig
+from compression import compress_response
+
+# アプリケーションファクトリの組み立て
+# （app.py が app/ パッケージに隠れて、各機能の登録が読み込まれていなかったことへの回帰テスト）
+
+COMMANDS = ['check-counts', 'rebuild-search-index', 'check-query-plans', 'import-posts', 'profiles', 'init-db', 'upgrade-db', 'unfurl']
+
+def test_flask_app_resolves_to_the_factory(tmp_path):
+    # FLASK_APP=app（flask コマンド・gunicorn 'app:app' と同じ解決）で読み込まれるアプリに、
+    # ファクトリで登録するCLIコマンドとフックが揃っている
+    code = ('from flask.cli import ScriptInfo; from compression import compress_response; '
+            'app = ScriptInfo(app_import_path="app").load_app(); '
+            'print(app.import_name, compress_response in app.after_request_funcs[None], '
+            '",".join(sorted(app.blueprints)))')
+    env = dict(os.environ, FLASK_APP='app', DATABASE_URL=f'sqlite:///{tmp_path / "app.db"}', METRICS_ENABLED='0')
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT_PATH, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == ['app', 'True', 'api,auth']
+
+    result = subprocess.run(['flask', '--help'], cwd=ROOT_PATH, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    listed = {line.split()[0] for line in result.stdout.split('Commands:')[1].splitlines() if line.strip()}
+    assert set(COMMANDS) <= listed
+
+def test_blueprints_and_routes_are_registered(app):
+    assert {'api', 'auth'} <= set(app.blueprints)
+    rules = {rule.rule for rule in app.url_map.iter_rules()}
+    for rule in ['/', '/api/posts', '/api/search', '/api/stream', '/api/posts/by-url', '/api/posts/tags',
+                 '/api/favorites/state', '/api/posts/<int:post_id>/thread', '/auth/login', '/auth/callback']:
+        assert rule in rules
+
+def test_hooks_and_commands_are_registered(app):
+    assert compress_response in app.after_request_funcs[None]
+    assert set(COMMANDS) <= set(app.cli.commands)
+
+def test_metrics_route_follows_config():
+    class MetricsConfig(TestingConfig):
+        METRICS_ENABLED = True
+        METRICS_DB_PATH = ':memory:'
+    assert '/metrics' in {rule.rule for rule in create_app(MetricsConfig).url_map.iter_rules()}
+    assert '/metrics' not in {rule.rule for rule in create_app(TestingConfig).url_map.iter_rules()}
+
+def test_import_does_not_load_oauth_or_touch_the_database(tmp_path):
+    # ワーカーの起動（from app import app）では Google OAuth と alembic を読み込まず、DBファイルも作らない
+    database = tmp_path / 'untouched.db'
+    code = ('import sys; from app import app; '
+            'print(",".join(m for m in ("google_auth_oauthlib", "google.oauth2", "alembic") if m in sys.modules))')
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{database}', METRICS_ENABLED='0')
+    env.pop('FLASK_RUN_FROM_CLI', None)
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT_PATH, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ''
+    assert not database.exists()
+
+def run_flask(*args, database):
+    env = dict(os.environ, FLASK_APP='app', DATABASE_URL=f'sqlite:///{database}', METRICS_ENABLED='0')
+    result = subprocess.run(['flask', *args], cwd=ROOT_PATH, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+def test_upgrade_db_stamps_databases_created_before_migrations(tmp_path):
+    # deploy.sh は gunicorn の起動前に flask upgrade-db を実行する
+    database = tmp_path / 'old.db'
+    run_flask('db', 'upgrade', '0001_initial', database=database)
+    with sqlite3.connect(database) as conn:
+        conn.execute('DROP TABLE alembic_version')
+
+    assert '0001_initial として記録します' in run_flask('upgrade-db', database=database)
+    head = run_flask('db', 'heads', database=database).split()[0]
+    with sqlite3.connect(database) as conn:
+        assert conn.execute('SELECT version_num FROM alembic_version').fetchone()[0] == head
+        assert 'url_hash' in {row[1] for row in conn.execute('PRAGMA table_info(posts)')}
+
+    # 新しいデータベースはそのまま最新まで適用する
+    database = tmp_path / 'new.db'
+    assert 'として記録します' not in run_flask('upgrade-db', database=database)
+    with sqlite3.connect(database) as conn:
+        assert conn.execute('SELECT version_num FROM alembic_version').fetchone()[0] == head
+
+def test_migrations_match_the_models(tmp_path):
+    # FTS5 の仮想テーブルと SQLite の内部テーブルがあっても、flask db migrate が何も生成しない
+    database = tmp_path / 'migrated.db'
+    run_flask('upgrade-db', database=database)
+    with sqlite3.connect(database) as conn:
+        conn.execute('ANALYZE')
+    assert 'No new upgrade operations detected' in run_flask('db', 'check', database=database)
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+from models import db, Post
+from urls import url_hash
+
+# /api/posts/by-url と投稿時の重複検出: 表記の違うURLはまとめ、url_hash が衝突した別のURLは LIMIT の前に除く
+
+CONVERSATION = 'https://chatgpt.com/share/same-conversation'
+VARIANTS = [
+    CONVERSATION,
+    'https://chat.openai.com/share/same-conversation',
+    'HTTPS://ChatGPT.com:443/share/same-conversation/?utm_source=x#top',
+]
+
+def add_posts(users, count, age, collide=False):
+    # collide=True なら、同じ url_hash を持つ別の会話の投稿にする
+    now = datetime.utcnow()
+    posts = []
+    for i in range(count):
+        if collide:
+            post = Post(content=f'別の会話 {i}', url=f'https://chatgpt.com/share/other-{i}', user_id=users[0].id)
+            post.url_hash = url_hash(CONVERSATION)
+        else:
+            post = Post(content=f'同じ会話 {i}', url=VARIANTS[i % len(VARIANTS)], user_id=users[0].id)
+        post.created_at = now - age - timedelta(seconds=i)
+        posts.append(post)
+    db.session.add_all(posts)
+    db.session.commit()
+    return posts
+
+def test_pages_are_full_despite_hash_collisions(client, sample_data):
+    users = sample_data['users']
+    # 新しい側に衝突する投稿が並んでいても、ページは同じ会話の投稿で埋まる
+    add_posts(users, 30, timedelta(minutes=1), collide=True)
+    posts = add_posts(users, 25, timedelta(hours=1))
+
+    response = client.get(f'/api/posts/by-url?url={VARIANTS[1]}&before=')
+    data = response.get_json()
+    assert data['url'] == CONVERSATION
+    assert [post['id'] for post in data['posts']] == [post.id for post in posts[:20]]
+    assert data['has_next']
+
+    data = client.get(f'/api/posts/by-url?url={CONVERSATION}&before={data["next_cursor"]}').get_json()
+    assert [post['id'] for post in data['posts']] == [post.id for post in posts[20:]]
+    assert not data['has_next']
+
+def test_duplicate_is_found_behind_hash_collisions(login, sample_data):
+    users = sample_data['users']
+    # 古い側に衝突する投稿が10件以上あっても、最初に投稿された同じ会話を返す
+    add_posts(users, 15, timedelta(days=2), collide=True)
+    original = add_posts(users, 2, timedelta(days=1))[-1]
+
+    response = login(users[1].id).post('/api/posts', json={'url': VARIANTS[2], 'content': '同じ会話をもう一度'})
+    assert response.status_code == 409
+    assert response.get_json()['duplicate_of'] == original.id
+
+def test_collisions_alone_are_not_duplicates(login, sample_data):
+    users = sample_data['users']
+    add_posts(users, 3, timedelta(days=1), collide=True)
+
+    response = login(users[1].id).post('/api/posts', json={'url': CONVERSATION, 'content': '新しい会話'})
+    assert response.status_code == 201
+    assert Post.query.filter(Post.url_hash == url_hash(CONVERSATION)).count() == 4
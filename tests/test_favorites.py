@@ -0,0 +1,67 @@
+import random
+from threading import Barrier, Thread
+import pytest
+from models import db, User, Post, Favorite
+from commands import check_counts
+from conftest import make_client
+
+# お気に入りのトグルを複数スレッドから同時に行っても、posts.favorite_count が favorites の件数と一致すること
+# 接続ごとに別のトランザクションになるよう、ファイルの SQLite（file_app）で動かす
+
+THREADS = 8
+TOGGLES = 40
+
+@pytest.fixture
+def favorite_app(file_app):
+    with file_app.app_context():
+        users = [User(name=f'user{i}', email=f'user{i}@example.com', google_id=f'google-{i}') for i in range(4)]
+        db.session.add_all(users)
+        db.session.flush()
+        posts = [Post(content=f'投稿 {i}', url=f'https://chatgpt.com/share/favorite-{i}', user_id=users[0].id)
+            for i in range(3)]
+        db.session.add_all(posts)
+        db.session.commit()
+        file_app.config['TEST_USER_IDS'] = [user.id for user in users]
+        file_app.config['TEST_POST_IDS'] = [post.id for post in posts]
+        db.session.remove()
+    return file_app
+
+def test_toggle_is_exact(client, sample_data, login):
+    user = sample_data['users'][0]
+    post = sample_data['posts'][0]
+    user_client = login(user.id)
+
+    data = user_client.post(f'/api/posts/{post.id}/favorite').get_json()
+    assert (data['action'], data['favorite_count']) == ('added', 1)
+    data = user_client.post(f'/api/posts/{post.id}/favorite').get_json()
+    assert (data['action'], data['favorite_count']) == ('removed', 0)
+
+def test_concurrent_toggles_keep_counts_exact(favorite_app):
+    user_ids = favorite_app.config['TEST_USER_IDS']
+    post_ids = favorite_app.config['TEST_POST_IDS']
+    barrier = Barrier(THREADS)
+    statuses = []
+
+    def toggle(index):
+        # 同じユーザーを2スレッドずつに割り当て、同じ行の追加と削除も競合させる
+        client = make_client(favorite_app, user_ids[index % len(user_ids)])
+        rng = random.Random(index)
+        barrier.wait()
+        for _ in range(TOGGLES):
+            statuses.append(client.post(f'/api/posts/{rng.choice(post_ids)}/favorite').status_code)
+
+    threads = [Thread(target=toggle, args=(index,)) for index in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [200] * (THREADS * TOGGLES)
+    with favorite_app.app_context():
+        counts = dict(db.session.query(Post.id, Post.favorite_count).all())
+        actual = dict(db.session.query(Favorite.post_id, db.func.count()).group_by(Favorite.post_id).all())
+        assert counts == {post_id: actual.get(post_id, 0) for post_id in post_ids}
+
+    result = favorite_app.test_cli_runner().invoke(check_counts)
+    assert result.exit_code == 0, result.output
+    assert 'favorite_count: 0 件の不整合' in result.output
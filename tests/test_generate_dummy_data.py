@@ -0,0 +1,25 @@
+import os
+import subprocess
+import sys
+from app import ROOT_PATH
+
+# scripts/generate_dummy_data.py の引数の検証（データベースに触れる前にエラーにする）
+
+def run(*args, database):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{database}', METRICS_ENABLED='0')
+    return subprocess.run([sys.executable, 'scripts/generate_dummy_data.py', *args],
+        cwd=ROOT_PATH, env=env, capture_output=True, text=True)
+
+def test_replies_without_posts_are_rejected(tmp_path):
+    database = tmp_path / 'dummy.db'
+    result = run('--posts', '0', '--replies', '5', database=database)
+    assert result.returncode == 2
+    assert '--posts も1以上' in result.stderr
+    assert not database.exists()
+
+def test_valid_counts_are_accepted(tmp_path):
+    database = tmp_path / 'dummy.db'
+    result = run('--reset', '--posts', '3', '--replies', '5', '--users', '2', '--favorites', '5', database=database)
+    assert result.returncode == 0, result.stderr
+    result = run('--posts', '0', '--replies', '0', '--users', '1', '--favorites', '0', database=database)
+    assert result.returncode == 0, result.stderr
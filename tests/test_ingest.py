@@ -0,0 +1,42 @@
+import json
+from datetime import datetime, timedelta
+from ingest import import_posts
+from models import db, Post
+
+# 一括登録: 投稿IDの順と作成日時の順が食い違う created_at は受け付けない
+# （タグ別一覧は投稿IDの降順、タイムラインは作成日時の降順で返すため）
+
+def line(i, created_at=None):
+    record = {'content': f'取り込み {i}', 'url': f'https://chatgpt.com/share/imported-{i}', 'tags': ['tag0']}
+    if created_at is not None:
+        record['created_at'] = created_at.isoformat()
+    return json.dumps(record, ensure_ascii=False)
+
+def latest():
+    return db.session.query(db.func.max(Post.created_at)).scalar()
+
+def test_backdated_and_future_rows_are_rejected(sample_data):
+    start = latest()
+    report = import_posts([
+        line(0, start - timedelta(days=1)),          # 既存の最新の投稿より前
+        line(1, start + timedelta(milliseconds=2)),
+        line(2, datetime.utcnow() + timedelta(days=1)),  # 未来
+        line(3),
+        line(4, start + timedelta(milliseconds=1)),  # 同じ取り込みの前の行より前
+    ], sample_data['users'][0].id, unfurl=False)
+    assert report['imported'] == 2
+    assert [(error['line'], error['error']) for error in report['errors']] == [
+        (1, 'created_at が既存の最新の投稿より前です'),
+        (3, 'created_at が未来の日時です'),
+        (5, 'created_at が既存の最新の投稿より前です'),
+    ]
+
+def test_tag_feed_matches_the_timeline_after_import(client, sample_data):
+    start = latest()
+    lines = [line(i, start + timedelta(microseconds=i)) for i in range(10)] + [line(10)]
+    assert import_posts(lines, sample_data['users'][0].id, unfurl=False) == {'imported': 11, 'errors': []}
+
+    # 取り込んだ投稿はどちらの一覧でも先頭に同じ順で並ぶ
+    timeline = [post['id'] for post in client.get('/api/posts?before=').get_json()['posts']]
+    tag_feed = [post['id'] for post in client.get('/api/posts/tag/tag0?before=').get_json()['posts']]
+    assert timeline[:11] == tag_feed[:11] == sorted(timeline[:11], reverse=True)
@@ -0,0 +1,143 @@
+import time
+from urllib.parse import urlsplit, parse_qs
+import pytest
+import rsa
+from flask import Flask, request, jsonify
+from google.auth import crypt, jwt
+from models import db, User, Post
+from oauth import oauth_client
+
+# Google OAuth のログインを手元のスタンドインの OpenID プロバイダ（/token と /certs）に対して確かめる
+# （ネットワークには出ない）
+
+CLIENT_ID = 'test-client'
+CLIENT_SECRET = 'test-secret'
+ISSUER = 'https://accounts.google.com'
+
+# 鍵の生成は遅いので、テスト全体で2本（入れ替え前後）を使い回す
+KEYS = {}
+
+def signing_key(kid):
+    if kid not in KEYS:
+        public, private = rsa.newkeys(1024)
+        KEYS[kid] = (public.save_pkcs1().decode(), crypt.RSASigner.from_string(private.save_pkcs1().decode(), key_id=kid))
+    return KEYS[kid]
+
+class Provider:
+    # 公開中の鍵・署名に使う鍵・Cache-Control を切り替えられるプロバイダ
+    def __init__(self):
+        self.published = ['key-1']
+        self.signing = 'key-1'
+        self.cache_control = 'public, max-age=300'
+        self.name = 'Alice'
+        self.requests = {'certs': 0, 'token': 0}
+        self.connections = set()
+        self.app = Flask('openid-provider')
+        self.app.add_url_rule('/certs', 'certs', self.certs)
+        self.app.add_url_rule('/token', 'token', self.token, methods=['POST'])
+
+    def certs(self):
+        self.requests['certs'] += 1
+        self.connections.add(request.environ['REMOTE_PORT'])
+        response = jsonify({kid: signing_key(kid)[0] for kid in self.published})
+        response.headers['Cache-Control'] = self.cache_control
+        return response
+
+    def token(self):
+        self.requests['token'] += 1
+        self.connections.add(request.environ['REMOTE_PORT'])
+        if request.form['code'] != 'good-code' or request.form['client_secret'] != CLIENT_SECRET:
+            return jsonify({'error': 'invalid_grant'}), 400
+        now = int(time.time())
+        id_token = jwt.encode(signing_key(self.signing)[1], {
+            'iss': ISSUER, 'aud': CLIENT_ID, 'sub': 'google-user-1', 'email': 'alice@example.com',
+            'name': self.name, 'iat': now, 'exp': now + 3600,
+        }).decode()
+        return jsonify({'access_token': 'access', 'id_token': id_token, 'token_type': 'Bearer', 'expires_in': 3600})
+
+@pytest.fixture
+def provider(app, serve):
+    provider = Provider()
+    url = serve(provider.app)
+    app.config.update(
+        GOOGLE_CLIENT_ID=CLIENT_ID,
+        GOOGLE_CLIENT_SECRET=CLIENT_SECRET,
+        GOOGLE_TOKEN_URI=f'{url}/token',
+        GOOGLE_CERTS_URI=f'{url}/certs',
+        OAUTH_CERTS_MIN_REFRESH=0,
+        OAUTH_HTTP_TIMEOUT=5,
+    )
+    return provider
+
+def log_in(app, code='good-code'):
+    # /auth/login で発行された state を付けて /auth/callback に戻る
+    client = app.test_client()
+    location = client.get('/auth/login').headers['Location']
+    state = parse_qs(urlsplit(location).query)['state'][0]
+    return client.get(f'/auth/callback?state={state}&code={code}')
+
+def test_login_caches_signing_keys(app, provider):
+    for _ in range(3):
+        response = log_in(app)
+        assert response.status_code == 302
+    assert User.query.filter_by(email='alice@example.com').count() == 1
+    assert provider.requests == {'certs': 1, 'token': 3}
+    assert oauth_client().keys.fetches == 1
+    # 鍵の取得とトークンの交換は同じ接続を使い回す
+    assert len(provider.connections) == 1
+
+def test_unknown_kid_refetches_keys(app, provider):
+    assert log_in(app).status_code == 302
+
+    # 鍵の入れ替え: キャッシュの期限前でも、未知の kid を見たら取り直す
+    provider.published = ['key-1', 'key-2']
+    provider.signing = 'key-2'
+    assert log_in(app).status_code == 302
+    assert provider.requests['certs'] == 2
+
+    assert log_in(app).status_code == 302
+    assert provider.requests['certs'] == 2
+
+def test_no_store_keys_are_not_cached(app, provider):
+    provider.cache_control = 'no-store'
+    for _ in range(2):
+        assert log_in(app).status_code == 302
+    assert provider.requests['certs'] == 2
+
+def test_key_missing_after_refetch_is_rejected(app, provider):
+    provider.signing = 'key-2'
+    assert log_in(app).status_code == 400
+
+def test_bad_code_and_state_are_rejected(app, provider):
+    assert log_in(app, code='bad-code').status_code == 400
+    assert app.test_client().get('/auth/callback?state=forged&code=good-code').status_code == 400
+    assert provider.requests['certs'] == 0
+
+def test_one_client_per_app(app, provider):
+    with app.app_context():
+        first = oauth_client()
+    with app.test_request_context('/'):
+        assert oauth_client() is first
+    assert log_in(app).status_code == 302
+    assert oauth_client() is first
+    assert app.extensions['oauth_client'] is first
+
+def test_profile_change_invalidates_cached_responses(app, provider):
+    # ログインで名前が変わったら、投稿者名を含むキャッシュ済みのレスポンスと ETag を使わない
+    app.config['RESPONSE_CACHE_ENABLED'] = True
+    assert log_in(app).status_code == 302
+    user = User.query.filter_by(email='alice@example.com').one()
+    db.session.add(Post(content='会話', url='https://chatgpt.com/share/alice', user_id=user.id))
+    db.session.commit()
+
+    client = app.test_client()
+    response = client.get('/api/posts')
+    assert response.get_json()['posts'][0]['author']['name'] == 'Alice'
+    etag = response.headers['ETag']
+    assert client.get('/api/posts', headers={'If-None-Match': etag}).status_code == 304
+
+    provider.name = 'Alice Liddell'
+    assert log_in(app).status_code == 302
+    response = client.get('/api/posts', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['posts'][0]['author']['name'] == 'Alice Liddell'
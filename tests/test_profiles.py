@@ -0,0 +1,28 @@
+import cProfile
+import pytest
+
+# flask profiles show: 保存先のディレクトリ名にドットがあっても、list のファイル名で開けること
+
+STEM = '20261019T010203-000004_GET_api-posts_12ms'
+
+@pytest.fixture
+def profiles(app, tmp_path):
+    directory = tmp_path / 'atg.instance' / 'profiles.d'
+    directory.mkdir(parents=True)
+    profile = cProfile.Profile()
+    profile.runcall(sorted, range(10))
+    profile.dump_stats(str(directory / f'{STEM}.prof'))
+    app.config['PROFILE_DIR'] = str(directory)
+    return app.test_cli_runner()
+
+@pytest.mark.parametrize('name', [f'{STEM}.prof', f'{STEM}.speedscope.json', STEM, f'elsewhere/{STEM}.prof'])
+def test_show_opens_the_profile(profiles, name):
+    result = profiles.invoke(args=['profiles', 'show', name])
+    assert result.exit_code == 0, result.output
+    assert 'function calls' in result.output
+
+def test_list_and_missing_profiles(profiles):
+    assert STEM in profiles.invoke(args=['profiles', 'list']).output
+    result = profiles.invoke(args=['profiles', 'show', 'missing.prof'])
+    assert result.exit_code != 0
+    assert 'missing.prof がありません' in result.output
@@ -0,0 +1,41 @@
+import pytest
+from models import db, Favorite
+from commands import query_plan_targets, query_plans, is_bad_plan, check_query_plans
+
+# 各エンドポイントのクエリが全件走査や一時B-treeでの並べ替えをしないこと（EXPLAIN QUERY PLAN）
+
+TARGETS = query_plan_targets(0, 0, '', '')
+
+@pytest.fixture
+def plan_data(sample_data, login):
+    user = sample_data['users'][0]
+    db.session.add_all([Favorite(user_id=user.id, post_id=post.id) for post in sample_data['posts'][:30]])
+    db.session.commit()
+    post = sample_data['posts'][0]
+    return {
+        'targets': query_plan_targets(post.id, user.id, sample_data['tags'][0].name, post.url),
+        'client': login(user.id),
+    }
+
+@pytest.mark.parametrize('index', range(len(TARGETS)), ids=[name for name, url, login, allow_sort in TARGETS])
+def test_feed_query_uses_index(app, plan_data, index):
+    name, url, login, allow_sort = plan_data['targets'][index]
+    response, plans = query_plans(plan_data['client'] if login else app.test_client(), url)
+    assert response.status_code == 200
+    assert plans
+    bad = [detail for plan in plans for detail in plan if is_bad_plan(detail, allow_sort)]
+    assert not bad, plans
+
+def test_check_query_plans_command(app, plan_data):
+    result = app.test_cli_runner().invoke(check_query_plans)
+    assert result.exit_code == 0, result.output
+
+@pytest.mark.parametrize('detail, allow_sort, bad', [
+    ('SCAN posts', False, True),
+    ('SCAN posts USING INDEX ix_posts_created_at_id', False, False),
+    ('USE TEMP B-TREE FOR ORDER BY', False, True),
+    ('USE TEMP B-TREE FOR ORDER BY', True, False),
+    ('SCAN posts_fts VIRTUAL TABLE INDEX 0:M2', False, False),
+])
+def test_is_bad_plan(detail, allow_sort, bad):
+    assert is_bad_plan(detail, allow_sort) == bad
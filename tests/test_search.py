@@ -0,0 +1,45 @@
+from models import db, Post
+
+# /api/search: 該当件数が少なければスコア順、多ければ新しい順
+
+def add_posts(users, contents):
+    posts = [Post(content=content, url=f'https://chatgpt.com/share/search-{i}', user_id=users[0].id)
+        for i, content in enumerate(contents)]
+    db.session.add_all(posts)
+    db.session.commit()
+    return posts
+
+def collect(client, q):
+    # カーソルを辿って全ページを取得する
+    ids, orders, url = [], set(), f'/api/search?q={q}'
+    while True:
+        response = client.get(url)
+        assert response.status_code == 200
+        data = response.get_json()
+        ids += [post['id'] for post in data['posts']]
+        orders.add(data['order'])
+        if not data['has_next']:
+            return ids, orders
+        url = f'/api/search?q={q}&cursor={data["next_cursor"]}'
+
+def test_rare_terms_are_ranked(client, sample_data):
+    posts = add_posts(sample_data['users'], ['量子コンピュータ', '量子コンピュータと量子コンピュータの話'])
+    response = client.get('/api/search?q=量子コンピュータ')
+    data = response.get_json()
+    assert data['order'] == 'relevance'
+    assert [post['id'] for post in data['posts']] == [posts[1].id, posts[0].id]
+
+def test_common_terms_are_returned_newest_first(app, client, sample_data):
+    app.config['SEARCH_RANK_LIMIT'] = 10
+    ids, orders = collect(client, 'ChatGPT')
+    assert orders == {'recent'}
+    assert ids == sorted((post.id for post in sample_data['posts']), reverse=True)
+
+def test_ranked_pages_cover_all_matches(app, client, sample_data):
+    app.config['SEARCH_RANK_LIMIT'] = 100
+    ids, orders = collect(client, 'ChatGPT')
+    assert orders == {'relevance'}
+    assert sorted(ids) == sorted(post.id for post in sample_data['posts'])
+
+def test_short_terms_are_rejected(client):
+    assert client.get('/api/search?q=ab').status_code == 400
@@ -0,0 +1,72 @@
+import pytest
+from flask_login import login_user
+from models import db, Post, Tag, Favorite
+from pagination import paginate_feed
+from serializers import with_relations, load_posts, serialize_posts
+from user_cache import load_session_user
+
+# 一覧のシリアライズで発行するクエリ数がページサイズによらず一定であること
+
+FEEDS = {
+    'timeline': lambda data: with_relations(Post.query),
+    'tag': lambda data: with_relations(Post.query).join(Post.tags).filter(Tag.name == data['tags'][0].name),
+    'user': lambda data: with_relations(Post.query).filter_by(user_id=data['users'][0].id),
+    'replies': lambda data: with_relations(Post.query).filter_by(reply_to_id=data['posts'][0].id),
+}
+
+@pytest.mark.parametrize('name', FEEDS)
+def test_feed_query_count_is_constant(app, sample_data, count_queries, name):
+    # ログインユーザーはキャッシュに載せてから数える
+    user = load_session_user(sample_data['users'][0].id)
+    query = FEEDS[name](sample_data)
+    counts = {}
+    for per_page in (5, 50):
+        with app.test_request_context('/?before='), count_queries() as statements:
+            login_user(user)
+            posts, meta = paginate_feed(query, per_page=per_page)
+            page = serialize_posts(posts)
+        counts[per_page] = len(statements)
+        assert page
+    assert counts[5] == counts[50], counts
+
+def test_favorites_query_count_is_constant(app, sample_data, count_queries):
+    user = load_session_user(sample_data['users'][0].id)
+    db.session.add_all([Favorite(user_id=user.id, post_id=post.id) for post in sample_data['posts']])
+    db.session.commit()
+
+    counts = {}
+    for per_page in (5, 50):
+        with app.test_request_context('/?before='), count_queries() as statements:
+            login_user(user)
+            favorites, meta = paginate_feed(
+                Favorite.query.filter_by(user_id=user.id),
+                per_page=per_page,
+                order_by=(Favorite.created_at, Favorite.post_id)
+            )
+            posts = serialize_posts(load_posts([favorite.post_id for favorite in favorites]))
+        counts[per_page] = len(statements)
+        assert len(posts) == per_page
+    assert counts[5] == counts[50], counts
+
+def test_serialized_fields(app, sample_data):
+    user = sample_data['users'][0]
+    post = sample_data['posts'][0]
+    db.session.add(Favorite(user_id=user.id, post_id=post.id))
+    db.session.commit()
+
+    with app.test_request_context('/'):
+        login_user(load_session_user(user.id))
+        data = serialize_posts(load_posts([post.id]))[0]
+
+    assert data['author']['id'] == post.user_id
+    assert sorted(data['tags']) == sorted(tag.name for tag in post.tags)
+    assert data['replies_count'] == 10
+    assert data['is_favorited'] is True
+    assert data['is_own'] == (post.user_id == user.id)
+
+def test_listing_endpoints_respond(client, sample_data):
+    post = sample_data['posts'][0]
+    for url in ['/api/posts', f'/api/posts/tag/{sample_data["tags"][0].name}',
+                f'/api/posts/user/{post.user_id}', f'/api/posts/{post.id}/replies']:
+        response = client.get(url)
+        assert response.status_code == 200, url
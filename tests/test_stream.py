@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+import pytest
+import stream
+from models import db, StreamEvent
+
+# stream_events の古い行は、ライブ配信の接続がなくても書き込みのついでに消えること
+
+@pytest.fixture(autouse=True)
+def reset_hub():
+    stream._hub.reset()
+    yield
+    stream._hub.reset()
+
+def add_events(count, age):
+    created_at = datetime.utcnow() - age
+    db.session.add_all([StreamEvent(kind='post', data='{}', created_at=created_at) for _ in range(count)])
+    db.session.commit()
+
+def test_publish_prunes_expired_events(app, sample_data, login):
+    app.config['STREAM_RETENTION'] = 3600
+    add_events(5, timedelta(hours=2))
+    add_events(3, timedelta(minutes=5))
+
+    response = login(sample_data['users'][0].id).post('/api/posts', json={
+        'url': 'https://chatgpt.com/share/stream-prune',
+        'content': '配信の保持期間',
+    })
+    assert response.status_code == 201
+    assert stream.stream_stats()['subscribers'] == 0
+    # 保持期間内の3件と、今回の投稿の1件だけが残る
+    assert StreamEvent.query.count() == 4
+
+def test_prune_runs_once_per_interval(app, sample_data, login):
+    app.config['STREAM_RETENTION'] = 3600
+    client = login(sample_data['users'][0].id)
+    post_id = sample_data['posts'][0].id
+    client.post(f'/api/posts/{post_id}/favorite')
+
+    # 直後の書き込みでは消さない（保持期間の1/10ごと）
+    add_events(2, timedelta(hours=2))
+    client.post(f'/api/posts/{post_id}/favorite')
+    assert StreamEvent.query.filter(StreamEvent.created_at < datetime.utcnow() - timedelta(hours=1)).count() == 2
+
+    stream._hub.last_prune -= 3600
+    client.post(f'/api/posts/{post_id}/favorite')
+    assert StreamEvent.query.filter(StreamEvent.created_at < datetime.utcnow() - timedelta(hours=1)).count() == 0
+
+def test_page_exposes_the_current_user_for_streamed_posts(client, login, sample_data):
+    # 配信される投稿の is_own は常に false で、main.js が currentUser と投稿者を比べて付け直す
+    user = sample_data['users'][0]
+    page = login(user.id).get('/').get_data(as_text=True)
+    assert f'const currentUser = {{"id": {user.id}, "name": "{user.name}"}};' in page
+    assert 'const currentUser = null;' in client.get('/').get_data(as_text=True)
@@ -0,0 +1,51 @@
+import json
+import api
+from ingest import import_posts
+from models import db, Post
+
+# タグ索引（/api/posts/tags）: 投稿の削除後に作った投稿が、削除された投稿のIDを引き継がないこと
+
+def create(client, name, tags):
+    response = client.post('/api/posts', json={'url': f'https://chatgpt.com/share/{name}', 'content': name, 'tags': tags})
+    assert response.status_code == 201
+    return response.get_json()['post_id']
+
+def tagged(client, tag):
+    return [post['id'] for post in client.get(f'/api/posts/tags?all={tag}').get_json()['posts']]
+
+def test_delete_then_create_in_the_same_worker(login, sample_data):
+    client = login(sample_data['users'][0].id)
+    deleted = create(client, 'alpha-post', ['alpha'])
+    assert tagged(client, 'alpha') == [deleted]
+
+    assert client.delete(f'/api/posts/{deleted}').status_code == 200
+    created = create(client, 'beta-post', ['beta'])
+    assert created > deleted
+    assert tagged(client, 'beta') == [created]
+    assert tagged(client, 'alpha') == []
+
+def test_delete_then_create_in_another_worker(login, sample_data, monkeypatch):
+    # 削除したのが別のワーカーなら、このワーカーの索引には削除が届かない
+    monkeypatch.setattr(api, 'unindex_post', lambda post_id, tag_ids: None)
+    client = login(sample_data['users'][0].id)
+    deleted = create(client, 'alpha-post', ['alpha'])
+    assert tagged(client, 'alpha') == [deleted]
+
+    assert client.delete(f'/api/posts/{deleted}').status_code == 200
+    created = create(client, 'beta-post', ['beta'])
+    assert tagged(client, 'beta') == [created]
+    assert tagged(client, 'alpha') == []
+
+def test_import_does_not_reuse_deleted_ids(login, sample_data):
+    user_id = sample_data['users'][0].id
+    client = login(user_id)
+    deleted = create(client, 'alpha-post', ['alpha'])
+    assert tagged(client, 'alpha') == [deleted]
+    assert client.delete(f'/api/posts/{deleted}').status_code == 200
+
+    line = json.dumps({'content': 'インポートした投稿', 'url': 'https://chatgpt.com/share/imported', 'tags': ['beta']})
+    assert import_posts([line], user_id, unfurl=False)['imported'] == 1
+    imported = db.session.query(db.func.max(Post.id)).scalar()
+    assert imported > deleted
+    assert tagged(client, 'beta') == [imported]
+    assert tagged(client, 'alpha') == []
@@ -0,0 +1,164 @@
+import socket
+import sqlite3
+import time
+import pytest
+from flask import Flask, request
+import api
+import unfurl
+from models import db, User, UrlPreview
+from unfurl import unfurl_pending, unfurl_stats, fetch_preview, make_session, UnfurlError
+from conftest import make_client
+
+# URLのプレビュー取得を手元のスタンドインのサイトに対して確かめる
+# 取得はバックグラウンドのスレッドで行うので、ファイルの SQLite（file_app）で動かす
+
+PAGE = '''<!doctype html>
+<html><head>
+<title>タイトル（title 要素）</title>
+<meta property="og:title" content="ChatGPT との会話">
+<meta property="og:description" content="共有された会話の説明">
+</head><body>本文</body></html>'''
+
+class Site:
+    # /ok はプレビューを返し、/broken は 500 を返す。取得のたびに、その時点で投稿がコミット済みだったかを記録する
+    def __init__(self, database):
+        self.database = database
+        self.hits = {}
+        self.committed = []
+        self.app = Flask('stand-in-site')
+        self.app.add_url_rule('/<path:name>', 'page', self.page)
+
+    def page(self, name):
+        self.hits[name] = self.hits.get(name, 0) + 1
+        with sqlite3.connect(self.database) as conn:
+            self.committed.append(conn.execute('SELECT count(*) FROM posts WHERE url = ?', (request.url,)).fetchone()[0])
+        if name.startswith('broken'):
+            return 'error', 500
+        return PAGE, 200, {'Content-Type': 'text/html; charset=utf-8'}
+
+@pytest.fixture
+def site(file_app, serve, tmp_path):
+    unfurl._unfurler.reset()
+    file_app.config.update(
+        UNFURL_ENABLED=True,
+        UNFURL_ALLOW_PRIVATE=True,
+        UNFURL_CONCURRENCY=2,
+        UNFURL_MAX_ATTEMPTS=3,
+        UNFURL_TOTAL_TIMEOUT=5,
+    )
+    site = Site(str(tmp_path / 'test.db'))
+    site.url = serve(site.app)
+    with file_app.app_context():
+        user = User(name='user', email='user@example.com', google_id='google-user')
+        db.session.add(user)
+        db.session.commit()
+        site.client = make_client(file_app, user.id)
+        db.session.remove()
+    yield site
+    unfurl._unfurler.reset()
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+def preview_row(app, url):
+    with app.app_context():
+        row = UrlPreview.query.filter_by(url=url).first()
+        result = row and {'status': row.status, 'attempts': row.attempts, 'title': row.title, 'description': row.description}
+        db.session.remove()
+        return result
+
+def post_preview(site):
+    return site.client.get('/api/posts').get_json()['posts'][0]['preview']
+
+def test_preview_is_fetched_after_commit(file_app, site):
+    url = f'{site.url}/ok'
+    response = site.client.post('/api/posts', json={'url': url, 'content': 'プレビュー付きの投稿'})
+    assert response.status_code == 201
+
+    assert wait_for(lambda: (preview_row(file_app, url) or {}).get('status') == 'ok')
+    assert preview_row(file_app, url) == {
+        'status': 'ok', 'attempts': 1, 'title': 'ChatGPT との会話', 'description': '共有された会話の説明'
+    }
+    # 取得したときには投稿がコミット済みだった
+    assert site.committed == [1]
+    assert wait_for(lambda: unfurl_stats()['queued'] == 0)
+
+    assert post_preview(site)['title'] == 'ChatGPT との会話'
+
+def test_reply_preview_is_fetched_after_commit(file_app, site):
+    response = site.client.post('/api/posts', json={'url': f'{site.url}/ok-parent', 'content': '返信先'})
+    parent_id = response.get_json()['post_id']
+    url = f'{site.url}/ok-reply'
+    response = site.client.post(f'/api/posts/{parent_id}/replies', json={'url': url, 'content': 'リンク付きの返信'})
+    assert response.status_code == 201
+
+    assert wait_for(lambda: (preview_row(file_app, url) or {}).get('status') == 'ok')
+    assert site.hits['ok-reply'] == 1
+    assert site.committed == [1, 1]
+    assert preview_row(file_app, url)['title'] == 'ChatGPT との会話'
+
+def test_failures_are_recorded_and_retried_up_to_the_limit(file_app, site):
+    url = f'{site.url}/broken'
+    assert site.client.post('/api/posts', json={'url': url, 'content': '取得できない投稿'}).status_code == 201
+
+    assert wait_for(lambda: (preview_row(file_app, url) or {}).get('status') == 'error')
+    assert preview_row(file_app, url)['attempts'] == 1
+
+    with file_app.app_context():
+        # 失敗したURLは --retry-errors のときだけ取り直す
+        assert unfurl_pending() == {'ok': 0, 'error': 0}
+        assert unfurl_pending(retry_errors=True) == {'ok': 0, 'error': 1}
+        assert unfurl_pending(retry_errors=True) == {'ok': 0, 'error': 1}
+        # UNFURL_MAX_ATTEMPTS 回で打ち切る
+        assert unfurl_pending(retry_errors=True) == {'ok': 0, 'error': 0}
+
+    assert preview_row(file_app, url)['attempts'] == 3
+    assert site.hits['broken'] == 3
+    assert post_preview(site) is None
+
+def test_rollback_enqueues_nothing(file_app, site, monkeypatch):
+    def fail():
+        raise RuntimeError('書き込みの失敗')
+    monkeypatch.setattr(api, 'bump_generation', fail)
+
+    url = f'{site.url}/rolled-back'
+    response = site.client.post('/api/posts', json={'url': url, 'content': 'ロールバックされる投稿'})
+    assert response.status_code == 500
+
+    time.sleep(0.2)
+    assert site.hits == {}
+    assert unfurl_stats()['queued'] == 0
+    assert preview_row(file_app, url) is None
+
+def test_internal_addresses_are_rejected(file_app, site):
+    file_app.config['UNFURL_ALLOW_PRIVATE'] = False
+    with pytest.raises(UnfurlError, match='内部アドレス'):
+        fetch_preview(make_session(file_app.config), f'{site.url}/ok', file_app.config)
+    assert site.hits == {}
+
+def test_connects_to_the_checked_address(file_app, site, monkeypatch):
+    # DNS rebinding: 確認したときの名前解決と、接続するときの名前解決で別のアドレスを返す名前
+    # （ここでは 127.0.0.1 をグローバルなアドレスとみなし、2回目以降は待ち受けのない 127.0.0.2 を返す）
+    file_app.config['UNFURL_ALLOW_PRIVATE'] = False
+    monkeypatch.setattr(unfurl, '_is_global', lambda address: address == '127.0.0.1')
+    answers = ['127.0.0.1']
+    resolved = []
+    getaddrinfo = socket.getaddrinfo
+    def rebinding_getaddrinfo(host, port, *args, **kwargs):
+        if host != 'rebind.test':
+            return getaddrinfo(host, port, *args, **kwargs)
+        address = answers.pop(0) if answers else '127.0.0.2'
+        resolved.append(address)
+        return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (address, port))]
+    monkeypatch.setattr(socket, 'getaddrinfo', rebinding_getaddrinfo)
+
+    port = site.url.rsplit(':', 1)[1]
+    preview = fetch_preview(make_session(file_app.config), f'http://rebind.test:{port}/ok-rebind', file_app.config)
+    assert preview['title'] == 'ChatGPT との会話'
+    assert resolved == ['127.0.0.1']
+    assert site.hits == {'ok-rebind': 1}
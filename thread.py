@@ -0,0 +1,51 @@
+from models import db
+from serializers import load_posts
+
+# 返信ツリー（スレッド）の一括取得
+# 再帰CTEで指定した投稿以下の返信をたどり、行きがけ順（親の直後に子、兄弟はID順）で返す。
+# 経路文字列の昇順でキューから取り出すので、LIMIT に達した時点で探索を打ち切れる
+# （件数の多いスレッドでも先頭の limit 件ぶんしか辿らない）。
+
+DEFAULT_MAX_DEPTH = 50
+DEFAULT_LIMIT = 200
+MAX_LIMIT = 500  # load_posts の IN 句が SQLite のバインド変数上限に収まる件数
+
+THREAD_QUERY = '''
+    WITH RECURSIVE thread(id, reply_to_id, depth, path) AS (
+        SELECT id, reply_to_id, 0, printf('%010d', id)
+        FROM posts
+        WHERE id = :root_id
+        UNION ALL
+        SELECT p.id, p.reply_to_id, t.depth + 1, t.path || '/' || printf('%010d', p.id)
+        FROM thread AS t
+        JOIN posts AS p ON p.reply_to_id = t.id
+        WHERE t.depth < :max_depth
+        ORDER BY 4
+        LIMIT :limit
+    )
+    SELECT id, reply_to_id, depth FROM thread ORDER BY path
+'''
+
+def fetch_thread(root_id, max_depth=DEFAULT_MAX_DEPTH, limit=DEFAULT_LIMIT):
+    # (投稿, 返信先ID, 深さ) の行きがけ順のリストと、limit で打ち切ったかどうか
+    rows = db.session.execute(db.text(THREAD_QUERY), {
+        'root_id': root_id,
+        'max_depth': max_depth,
+        'limit': limit + 1
+    }).fetchall()
+
+    truncated = len(rows) > limit
+    rows = rows[:limit]
+    posts = {post.id: post for post in load_posts([post_id for post_id, reply_to_id, depth in rows])}
+    return [(posts[post_id], reply_to_id, depth) for post_id, reply_to_id, depth in rows if post_id in posts], truncated
+
+def nest(items):
+    # 行きがけ順の平坦なリストを replies を持つ入れ子に組み直す
+    nodes = {}
+    roots = []
+    for item in items:
+        item['replies'] = []
+        nodes[item['id']] = item
+        parent = nodes.get(item['reply_to_id'])
+        (parent['replies'] if parent else roots).append(item)
+    return roots
@@ -0,0 +1,364 @@
+import codecs
+import ipaddress
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from html.parser import HTMLParser
+from threading import Lock, Timer
+from urllib.parse import urljoin, urlsplit
+from flask import current_app
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, Post, UrlPreview
+from cache import bump_generation
+from urls import try_normalize_url
+
+# 投稿URLのプレビュー（タイトル・説明）の取得
+# 投稿の書き込みでは url_previews に status='pending' の行を作るだけで、取得はコミット後に
+# ワーカープロセスごとのスレッドプール（UNFURL_CONCURRENCY 本）で行う。受け付けるURLは
+# UNFURL_QUEUE_SIZE 件までで、溢れた分や失敗した分は pending / error のまま残り、`flask unfurl` で取得し直す。
+# 取得は接続・読み込み・全体のタイムアウトと読み込むバイト数で打ち切り、<head> の <title> と
+# OGP などの <meta> だけを読む。内部アドレス（ループバック・プライベート等）へは転送先も含めて接続しない
+# （手元のスタンドインサーバーで試すときは UNFURL_ALLOW_PRIVATE=1）。アドレスの確認は接続のたびに行い、
+# 確かめたアドレスにそのまま接続する（確認の後で名前解決し直すと、DNS rebinding で内部アドレスに向けられる）。
+# プレビューは正規化したURLごとに1行で、同じURLの投稿で共有する。
+
+IN_CLAUSE_SIZE = 500
+CHUNK_BYTES = 16 * 1024
+
+# <meta> の property / name -> (項目, 優先度)。小さいほど優先
+META_FIELDS = {
+    'og:title': ('title', 0),
+    'twitter:title': ('title', 1),
+    'og:description': ('description', 0),
+    'twitter:description': ('description', 1),
+    'description': ('description', 2),
+    'og:site_name': ('site_name', 0),
+    'og:image': ('image', 0),
+    'twitter:image': ('image', 1),
+}
+FIELD_LIMITS = {'title': 300, 'description': 1000, 'site_name': 200, 'image': 2048}
+
+class UnfurlError(Exception):
+    pass
+
+def _clean(value, limit):
+    value = ' '.join(value.split())
+    return value[:limit - 1] + '…' if len(value) > limit else value
+
+class PreviewParser(HTMLParser):
+    # <head> の中だけを読み、</head> か <body> で打ち切る
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.fields = {}
+        self.title = []
+        self.in_title = False
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'body':
+            self.done = True
+        elif tag == 'title':
+            self.in_title = True
+        elif tag == 'meta':
+            attrs = dict(attrs)
+            field = META_FIELDS.get((attrs.get('property') or attrs.get('name') or '').lower())
+            content = (attrs.get('content') or '').strip()
+            if field and content and field[1] < self.fields.get(field[0], (None, len(META_FIELDS)))[1]:
+                self.fields[field[0]] = (content, field[1])
+
+    def handle_endtag(self, tag):
+        if tag == 'title':
+            self.in_title = False
+        elif tag == 'head':
+            self.done = True
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title.append(data)
+
+    def preview(self, base_url):
+        values = {field: value for field, (value, priority) in self.fields.items()}
+        values.setdefault('title', ''.join(self.title))
+        if values.get('image'):
+            values['image'] = urljoin(base_url, values['image'])
+            if urlsplit(values['image']).scheme not in ('http', 'https'):
+                del values['image']
+        preview = {field: (_clean(values[field], limit) if field in values else '') or None
+            for field, limit in FIELD_LIMITS.items()}
+        if not preview['title'] and not preview['description']:
+            raise UnfurlError('タイトルも説明もありません')
+        return preview
+
+def _is_global(address):
+    return ipaddress.ip_address(address.split('%')[0]).is_global
+
+def _resolve_global(host, port):
+    # 名前解決したアドレスがすべてグローバルなものか確かめ、接続に使うアドレスを返す
+    try:
+        addresses = [info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)]
+    except socket.gaierror:
+        raise UnfurlError('ホスト名を解決できません')
+    if not addresses or not all(map(_is_global, addresses)):
+        raise UnfurlError('内部アドレスには接続しません')
+    return addresses[0]
+
+def _pinned(connection_class):
+    # 接続のたびに1回だけ名前解決し、確かめたアドレスに接続する urllib3 の接続クラス
+    # （Host ヘッダ・SNI・証明書の検証には元のホスト名を使う）
+    class PinnedConnection(connection_class):
+        def _new_conn(self):
+            host = self._dns_host
+            self._dns_host = _resolve_global(host, self.port)
+            try:
+                return super()._new_conn()
+            finally:
+                self._dns_host = host
+    return PinnedConnection
+
+def _decoder(content_type):
+    # Content-Type に charset がなければ UTF-8 とみなす
+    charset = 'utf-8'
+    for param in content_type.split(';')[1:]:
+        name, _, value = param.partition('=')
+        if name.strip().lower() == 'charset' and value.strip():
+            charset = value.strip().strip('"')
+    try:
+        return codecs.getincrementaldecoder(charset)(errors='replace')
+    except LookupError:
+        return codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+def _abort(response):
+    # 読み込み中のスレッドを起こすためソケットを shutdown する
+    # （close は読み込み中のバッファのロックを待ってしまう）
+    sock = getattr(response.raw.connection, 'sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+def fetch_preview(http, url, config):
+    deadline = time.monotonic() + config.get('UNFURL_TOTAL_TIMEOUT', 10)
+    timeout = (config.get('UNFURL_CONNECT_TIMEOUT', 3), config.get('UNFURL_READ_TIMEOUT', 5))
+    max_bytes = config.get('UNFURL_MAX_BYTES', 256 * 1024)
+    headers = {
+        'User-Agent': config.get('UNFURL_USER_AGENT', 'ATG-LinkPreview/1.0'),
+        'Accept': 'text/html,application/xhtml+xml;q=0.9,*/*;q=0.1',
+        'Accept-Language': 'ja,en;q=0.8',
+    }
+
+    # 転送は自分で辿る（転送先のアドレスも接続時に確かめる。make_session 参照）
+    for _ in range(config.get('UNFURL_MAX_REDIRECTS', 3) + 1):
+        if try_normalize_url(url) is None:
+            raise UnfurlError('http(s) 以外のURLです')
+        response = http.get(url, headers=headers, timeout=timeout, stream=True, allow_redirects=False)
+        if not response.is_redirect:
+            break
+        response.close()
+        url = urljoin(url, response.headers['Location'])
+    else:
+        raise UnfurlError('転送が多すぎます')
+
+    with response:
+        if response.status_code != 200:
+            raise UnfurlError(f'HTTP {response.status_code}')
+        content_type = response.headers.get('Content-Type', '')
+        if 'html' not in content_type.lower():
+            raise UnfurlError(f'HTML ではありません: {content_type[:50]}')
+        parser = PreviewParser()
+        decoder = _decoder(content_type)
+        received = 0
+        # 少しずつ送り続けられると読み込みのタイムアウトにかからないので、全体の期限で接続を閉じる
+        watchdog = Timer(max(deadline - time.monotonic(), 0), _abort, args=(response,))
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            for chunk in response.iter_content(CHUNK_BYTES):
+                received += len(chunk)
+                parser.feed(decoder.decode(chunk))
+                if parser.done or received >= max_bytes:
+                    break
+        except Exception:
+            if time.monotonic() < deadline:
+                raise
+            # 期限で打ち切った場合は、それまでに読んだ分から作る
+        finally:
+            watchdog.cancel()
+    return parser.preview(url)
+
+def make_session(config):
+    # requests の読み込みは最初の取得時に行う（ワーカーの起動時間に含めない）
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class GuardedAdapter(HTTPAdapter):
+        # 内部アドレスへ接続しないよう、接続プールの接続クラスを差し替える
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': type('GuardedHTTPConnectionPool', (HTTPConnectionPool,),
+                    {'ConnectionCls': _pinned(HTTPConnectionPool.ConnectionCls)}),
+                'https': type('GuardedHTTPSConnectionPool', (HTTPSConnectionPool,),
+                    {'ConnectionCls': _pinned(HTTPSConnectionPool.ConnectionCls)}),
+            }
+
+    http = requests.Session()
+    adapter_class = HTTPAdapter if config.get('UNFURL_ALLOW_PRIVATE') else GuardedAdapter
+    if adapter_class is GuardedAdapter:
+        # プロキシ経由では接続先のアドレスを確かめられないので、環境変数のプロキシ設定は使わない
+        http.trust_env = False
+    adapter = adapter_class(pool_connections=config.get('UNFURL_CONCURRENCY', 4) * 2,
+        pool_maxsize=config.get('UNFURL_CONCURRENCY', 4))
+    http.mount('https://', adapter)
+    http.mount('http://', adapter)
+    return http
+
+def unfurl_url(http, url):
+    # 1件取得して url_previews を更新する（アプリケーションコンテキスト内で呼ぶ）
+    import requests
+    try:
+        values = dict(fetch_preview(http, url, current_app.config), status='ok', error=None)
+    except (UnfurlError, requests.RequestException) as e:
+        values = {'status': 'error', 'error': _clean(str(e) or type(e).__name__, 200)}
+    UrlPreview.query.filter_by(url=url).update(
+        dict(values, attempts=UrlPreview.attempts + 1, fetched_at=datetime.utcnow()),
+        synchronize_session=False
+    )
+    if values['status'] == 'ok':
+        # 取得できたプレビューをキャッシュ済みのレスポンスにも反映させる
+        bump_generation()
+    db.session.commit()
+    return values['status']
+
+class Unfurler:
+    # ワーカープロセス内の取得待ちと実行状態
+    def __init__(self):
+        self.lock = Lock()
+        self.stats = {'ok': 0, 'error': 0, 'dropped': 0}
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.executor = None
+        self.http = None
+        self.queued = set()
+
+    def submit(self, app, urls):
+        with self.lock:
+            if self.pid != os.getpid():
+                # fork 前のスレッドプールは子プロセスでは動かない
+                self.reset()
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(app.config.get('UNFURL_CONCURRENCY', 4), thread_name_prefix='unfurl')
+                self.http = make_session(app.config)
+            for url in urls:
+                if url in self.queued:
+                    continue
+                if len(self.queued) >= app.config.get('UNFURL_QUEUE_SIZE', 200):
+                    self.stats['dropped'] += 1
+                    continue
+                self.queued.add(url)
+                self.executor.submit(self.run, app, url)
+
+    def run(self, app, url):
+        status = 'error'
+        try:
+            with app.app_context():
+                try:
+                    status = unfurl_url(self.http, url)
+                finally:
+                    db.session.remove()
+        except Exception as e:
+            app.logger.warning(f'プレビューの保存に失敗しました: {url}: {e}')
+        finally:
+            with self.lock:
+                self.queued.discard(url)
+                self.stats[status] += 1
+
+_unfurler = Unfurler()
+
+def _normalize_all(urls):
+    return list(dict.fromkeys(key for key in map(try_normalize_url, urls) if key))
+
+def _insert_pending(keys):
+    # まだ行のないURLを pending で登録し、登録した件数を返す
+    if not keys:
+        return 0
+    now = datetime.utcnow()
+    return db.session.execute(
+        sqlite_insert(UrlPreview.__table__).on_conflict_do_nothing(),
+        [{'url': key, 'status': 'pending', 'attempts': 0, 'created_at': now} for key in keys]
+    ).rowcount
+
+def register_urls(urls):
+    # 書き込みと同じトランザクションで呼ぶ。まだ取得していない（pending の）正規化済みURLを返す
+    keys = _normalize_all(urls)
+    _insert_pending(keys)
+    pending = []
+    for i in range(0, len(keys), IN_CLAUSE_SIZE):
+        pending.extend(url for url, in db.session.query(UrlPreview.url)
+            .filter(UrlPreview.url.in_(keys[i:i + IN_CLAUSE_SIZE]), UrlPreview.status == 'pending'))
+    return pending
+
+def schedule_unfurl(urls):
+    # コミット後に呼ぶ（ロールバックされた投稿のURLは取得しない）
+    if urls and current_app.config.get('UNFURL_ENABLED', True):
+        _unfurler.submit(current_app._get_current_object(), urls)
+
+def unfurl_stats():
+    with _unfurler.lock:
+        return dict(_unfurler.stats, queued=len(_unfurler.queued))
+
+def load_previews(urls):
+    # 正規化済みURL -> 表示用のプレビュー（取得済みのものだけ）
+    urls = list({url for url in urls if url})
+    previews = {}
+    for i in range(0, len(urls), IN_CLAUSE_SIZE):
+        rows = db.session.query(UrlPreview.url, UrlPreview.title, UrlPreview.description,
+                UrlPreview.site_name, UrlPreview.image)\
+            .filter(UrlPreview.url.in_(urls[i:i + IN_CLAUSE_SIZE]), UrlPreview.status == 'ok')
+        for url, title, description, site_name, image in rows:
+            previews[url] = {'title': title, 'description': description, 'site_name': site_name, 'image': image}
+    return previews
+
+def backfill_previews(batch_size=IN_CLAUSE_SIZE):
+    # プレビューの行がない投稿URLを pending で登録する。登録した件数を返す
+    registered = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(Post.id, Post.url).filter(Post.id > last_id).order_by(Post.id).limit(batch_size).all()
+        if not rows:
+            return registered
+        registered += _insert_pending(_normalize_all(url for post_id, url in rows))
+        db.session.commit()
+        last_id = rows[-1][0]
+
+def unfurl_pending(limit=None, retry_errors=False):
+    # pending（と指定があれば試行回数の残っている error）の行をスレッドプールで取得する
+    app = current_app._get_current_object()
+    statuses = ['pending', 'error'] if retry_errors else ['pending']
+    query = db.session.query(UrlPreview.url)\
+        .filter(UrlPreview.status.in_(statuses), UrlPreview.attempts < app.config.get('UNFURL_MAX_ATTEMPTS', 3))\
+        .order_by(UrlPreview.id)
+    if limit:
+        query = query.limit(limit)
+    urls = [url for url, in query]
+    db.session.remove()
+
+    http = make_session(app.config)
+
+    def run(url):
+        with app.app_context():
+            try:
+                return unfurl_url(http, url)
+            finally:
+                db.session.remove()
+
+    results = {'ok': 0, 'error': 0}
+    with ThreadPoolExecutor(app.config.get('UNFURL_CONCURRENCY', 4)) as executor:
+        for status in executor.map(run, urls):
+            results[status] += 1
+    return results
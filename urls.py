@@ -0,0 +1,65 @@
+import hashlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# 投稿URLの正規化
+# 同じ会話へのリンクが表記の違い（ホスト名の大文字・既定ポート・フラグメント・末尾のスラッシュ・
+# 計測用のクエリ・旧ドメイン）で別物にならないよう、比較や重複排除には正規化したURLを使う。
+#   HTTPS://Chat.OpenAI.com:443/share/abc/?utm_source=x#top -> https://chatgpt.com/share/abc
+# posts.url_hash には正規化したURLの64ビットハッシュを入れて索引する（長い文字列を索引しない）。
+# 正規化の規則を変えた場合は、マイグレーションで url_hash を計算し直すこと。
+
+SCHEMES = ('http', 'https')
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+# ChatGPT の共有リンクは chat.openai.com から chatgpt.com に移った（旧ドメインは転送される）
+HOST_ALIASES = {
+    'chat.openai.com': 'chatgpt.com',
+    'www.chatgpt.com': 'chatgpt.com',
+}
+TRACKING_PARAMS = {'fbclid', 'gclid', 'ref', 'ref_src'}
+
+class InvalidUrl(ValueError):
+    pass
+
+def _is_tracking(name):
+    return name.startswith('utm_') or name in TRACKING_PARAMS
+
+def normalize_url(url):
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except (AttributeError, ValueError):
+        raise InvalidUrl('URLとして解釈できません')
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').rstrip('.')
+    if scheme not in SCHEMES or not host:
+        raise InvalidUrl('http(s) のURLではありません')
+
+    host = HOST_ALIASES.get(host, host)
+    if ':' in host:
+        host = f'[{host}]'  # IPv6
+    netloc = host if port in (None, DEFAULT_PORTS[scheme]) else f'{host}:{port}'
+
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/') or '/'
+    query = urlencode(sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not _is_tracking(name)
+    ))
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+def try_normalize_url(url):
+    # 正規化できないURL（返信の空URLなど）は None
+    try:
+        return normalize_url(url)
+    except InvalidUrl:
+        return None
+
+def url_hash(normalized):
+    # 正規化したURL -> SQLite の INTEGER に収まる符号付き64ビット整数
+    digest = hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+def try_url_hash(url):
+    normalized = try_normalize_url(url)
+    return None if normalized is None else url_hash(normalized)
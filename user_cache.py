@@ -0,0 +1,58 @@
+from threading import Lock
+from cachetools import TTLCache
+from flask import current_app
+from flask_login import UserMixin
+from models import User
+
+# ログインユーザーのキャッシュ（ワーカープロセスごと）
+# user_loader はログイン中のリクエストのたびに呼ばれるため、users の1行を毎回読まずに済むよう
+# セッションから切り離した軽量なユーザーを USER_CACHE_TTL 秒保持する。
+# プロフィールを変更したワーカーでは invalidate_user() で即座に捨て、
+# 他のワーカーでは TTL が過ぎると読み直される。
+
+class SessionUser(UserMixin):
+    # current_user として使う読み取り専用のユーザー（ORM のセッションに属さないのでリクエスト間で共有できる）
+    def __init__(self, id, email, name, profile_pic):
+        self.id = id
+        self.email = email
+        self.name = name
+        self.profile_pic = profile_pic
+
+_cache = None
+_lock = Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = TTLCache(
+            maxsize=current_app.config.get('USER_CACHE_SIZE', 4096),
+            ttl=current_app.config.get('USER_CACHE_TTL', 60)
+        )
+    return _cache
+
+def load_session_user(user_id):
+    with _lock:
+        user = _get_cache().get(user_id)
+        _stats['hits' if user else 'misses'] += 1
+    if user:
+        return user
+
+    row = User.query.with_entities(User.id, User.email, User.name, User.profile_pic)\
+        .filter_by(id=user_id)\
+        .first()
+    if row is None:
+        return None
+    user = SessionUser(*row)
+    with _lock:
+        _get_cache()[user_id] = user
+    return user
+
+def invalidate_user(user_id):
+    with _lock:
+        if _cache is not None:
+            _cache.pop(user_id, None)
+
+def user_cache_stats():
+    with _lock:
+        return dict(_stats, size=len(_cache) if _cache is not None else 0)